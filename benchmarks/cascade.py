@@ -0,0 +1,134 @@
+"""
+Compare cheap-first escalation against parsing with one model.
+
+The same stored documents are parsed three ways: with the cheap model alone,
+with the strong model alone, and with the cheap model escalating its
+low-confidence fields to the strong one (`parse --escalate-model`).
+Accuracy comes from `check.check` against the ground truth, matched by
+`original_filename`; requests, tokens and cost per document come from the
+telemetry spans of each run's LLM calls, priced per model by litellm.
+
+    python benchmarks/cascade.py --storage-dir data/processed/test-set \\
+        --ground-truth data/ground_truth/test_set_truth.json \\
+        --model gemini/gemini-2.0-flash-lite --escalate-model gemini/gemini-2.5-flash
+
+With `--model openai/mock --escalate-model openai/mock --api-base <mock server>`
+it runs offline; the mock's answers are always valid, so nothing is
+escalated and only the request counts and tokens compare.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+
+from pathlib import Path
+
+from shard_modes import add_costs, align
+
+RUNS = ['cheap', 'strong', 'cascade']
+
+def run_cascade(name: str, dataset_path: Path, truth: list, workdir: Path, model: str,
+                escalate_model=None, api_base=None, reasks: int = 0) -> dict:
+    """
+    Parse the dataset with a model, optionally escalating to a stronger one, and score it
+
+    Returns:
+        Dictionary of metrics for the run, and the path of its spans file
+    """
+    from docetl.operations.utils import clear_cache
+    from fema_agent import check, parse, telemetry
+
+    # The runs share prompts, so each starts with an empty DocETL cache
+    with contextlib.redirect_stdout(io.StringIO()):
+        clear_cache()
+
+    spans_path = workdir / f"{name}.spans.jsonl"
+    spans_path.unlink(missing_ok=True)
+    telemetry.enable(spans_path)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = parse.parse_dataset(
+            dataset_path, str(workdir / f"{name}.json"), model, dataset_name=f"cascade_{name}",
+            api_base=api_base, reasks=reasks, escalate_model=escalate_model
+            )
+    seconds = time.perf_counter() - start
+
+    attempts, truths = align(results, truth)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scored = check.check(attempts, truths)
+    escalated = sum(len(result.get('escalated_fields', [])) for result in results)
+    return {
+        'docs': len(results),
+        'docs_checked': len(attempts),
+        'seconds': seconds,
+        'field_accuracy': float(scored['correct'].mean()) if len(scored) else None,
+        'fields_escalated_per_doc': escalated / (len(results) or 1),
+        'spans_path': str(spans_path),
+    }
+
+def main():
+    p = argparse.ArgumentParser(description="Compare cheap-first escalation against parsing with one model")
+    p.add_argument('--storage-dir', required=True, help='Storage directory of the documents to parse')
+    p.add_argument('--ground-truth', default='data/ground_truth/test_set_truth.json',
+                   help='Ground truth JSON, matched to the documents by original filename')
+    p.add_argument('--model', default='gemini/gemini-2.0-flash-lite-preview-02-05',
+                   help='Cheap model to parse with first (any litellm model string)')
+    p.add_argument('--escalate-model', default='gemini-2.5-flash-preview-04-17',
+                   help='Strong model for the low-confidence fields')
+    p.add_argument('--api-base', default=None, help='Optional endpoint to send model calls to')
+    p.add_argument('--runs', nargs='+', choices=RUNS, default=RUNS, help='Runs to compare')
+    p.add_argument('--reasks', type=int, default=0,
+                   help='Times invalid fields are re-requested (default: none, so invalid fields are escalated)')
+    p.add_argument('--workdir', default=None,
+                   help='Directory for results and spans (default: a temp dir)')
+    p.add_argument('--output', default='cascade.json', help='Path of the JSON results file')
+    args = p.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='fema_cascade_'))
+    workdir.mkdir(parents=True, exist_ok=True)
+    # Keep the DocETL cache cleared between runs out of the user's home
+    os.environ['DOCETL_HOME_DIR'] = str(workdir)
+
+    from fema_agent.parse import create_docetl_dataset_from_storage
+
+    with open(args.ground_truth) as f:
+        truth = json.load(f)
+    dataset_path, _ = create_docetl_dataset_from_storage(args.storage_dir, temp_dir=str(workdir))
+
+    configs = {
+        'cheap': (args.model, None),
+        'strong': (args.escalate_model, None),
+        'cascade': (args.model, args.escalate_model),
+    }
+    runs = {}
+    for name in args.runs:
+        model, escalate_model = configs[name]
+        print(f"Parsing with {model}" + (f", escalating to {escalate_model}" if escalate_model else '') + "...",
+              flush=True)
+        runs[name] = run_cascade(name, dataset_path, truth, workdir, model, escalate_model=escalate_model,
+                                 api_base=args.api_base, reasks=args.reasks)
+    # Spans are read last, so calls logged by litellm after a pipeline returned are in
+    runs = {name: add_costs(metrics) for name, metrics in runs.items()}
+
+    print(f"\n{'run':<10}{'accuracy':>10}{'escalated':>11}{'requests':>10}{'in tokens':>11}{'out tokens':>11}"
+          f"{'cost':>10}{'seconds':>9}")
+    print(f"{'':<10}{'':>10}{'fields/doc':>11}{'/doc':>10}{'/doc':>11}{'/doc':>11}{'/doc':>10}")
+    for name, metrics in runs.items():
+        accuracy = metrics['field_accuracy']
+        print(f"{name:<10}{(f'{accuracy:.2%}' if accuracy is not None else '-'):>10}"
+              f"{metrics['fields_escalated_per_doc']:>11.1f}{metrics['requests_per_doc']:>10.1f}"
+              f"{metrics['input_tokens_per_doc']:>11.0f}{metrics['output_tokens_per_doc']:>11.0f}"
+              f"{'$' + format(metrics['cost_per_doc'], '.4f'):>10}{metrics['seconds']:>9.1f}")
+
+    with open(args.output, 'w') as f:
+        json.dump({'config': vars(args), 'runs': runs}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,125 @@
+"""
+Guard against import-time regressions in the CLIs.
+
+Each package module is imported in a fresh interpreter, timed, and checked
+for heavy dependencies (DocETL, litellm, pandas, ...) that should only be
+imported by the code paths that need them. `fema-agent <command> --help` is
+timed the same way. Exits non-zero if a module pulls in a heavy dependency
+at import or anything exceeds `--max-seconds`, so it can run in CI:
+
+    python benchmarks/import_time.py --max-seconds 0.5 --output import_times.json
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+MODULES = [
+    'fema_agent.cli',
+    'fema_agent.storage',
+    'fema_agent.packs',
+    'fema_agent.bundle',
+    'fema_agent.parse',
+    'fema_agent.batch',
+    'fema_agent.text_layer',
+    'fema_agent.checkboxes',
+    'fema_agent.validate',
+    'fema_agent.check',
+    'fema_agent.simple_form_fill',
+    'fema_agent.pull_pda',
+    'fema_agent.openfema',
+    'fema_agent.telemetry',
+    'fema_agent.instrument',
+    'fema_agent.states',
+    'fema_agent.mock_llm',
+]
+
+# Dependencies that take hundreds of milliseconds or more to import
+HEAVY_MODULES = ['docetl', 'litellm', 'pandas', 'numpy', 'pyarrow', 'pypdfium2']
+
+COMMANDS = ['storage', 'bundle', 'parse', 'text-layer', 'checkboxes', 'check', 'fill', 'pda', 'openfema', 'telemetry', 'mock-llm']
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "heavy": heavy}}))
+"""
+
+def time_import(module: str, repeat: int) -> dict:
+    """
+    Import a module in `repeat` fresh interpreters
+
+    Returns:
+        Dictionary with the fastest import time and the heavy modules it loaded
+    """
+    runs = []
+    for _ in range(repeat):
+        probe = IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)
+        output = subprocess.run(
+            [sys.executable, '-c', probe], capture_output=True, text=True, check=True
+            ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'seconds': min(run['seconds'] for run in runs),
+        'heavy': runs[0]['heavy'],
+    }
+
+def time_help(command: str, repeat: int) -> float:
+    """Fastest wall-clock time of `fema-agent <command> --help`, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-m', 'fema_agent.cli', command, '--help'],
+            capture_output=True, check=True
+            )
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    p = argparse.ArgumentParser(description="Measure import and --help times of the fema_agent CLIs")
+    p.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per measurement (fastest is kept)')
+    p.add_argument('--max-seconds', type=float, default=0.5,
+                   help='Fail if any module import or --help run takes longer than this')
+    p.add_argument('--output', type=str, default=None, help='Write the measurements to this JSON file')
+    args = p.parse_args()
+
+    failures = []
+
+    print(f"{'module':<30}{'import (s)':>12}  heavy dependencies")
+    imports = {}
+    for module in MODULES:
+        result = imports[module] = time_import(module, args.repeat)
+        print(f"{module:<30}{result['seconds']:>12.3f}  {', '.join(result['heavy']) or '-'}")
+        if result['heavy']:
+            failures.append(f"{module} imports {', '.join(result['heavy'])} at load")
+        if result['seconds'] > args.max_seconds:
+            failures.append(f"{module} takes {result['seconds']:.3f}s to import")
+
+    print(f"\n{'command':<30}{'--help (s)':>12}")
+    helps = {}
+    for command in COMMANDS:
+        seconds = helps[command] = time_help(command, args.repeat)
+        print(f"{'fema-agent ' + command:<30}{seconds:>12.3f}")
+        if seconds > args.max_seconds:
+            failures.append(f"fema-agent {command} --help takes {seconds:.3f}s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'imports': imports, 'help': helps, 'max_seconds': args.max_seconds}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if failures:
+        print("\nImport-time regressions:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
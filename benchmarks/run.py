@@ -0,0 +1,336 @@
+"""
+Benchmark the ingest -> parse -> evaluate pipeline against the mock LLM.
+
+For each corpus size, a synthetic corpus is generated and pushed through:
+
+    ingest   DeclarationStorage.add_document, per document
+    dataset  create_docetl_dataset_from_storage
+    parse    parse_dataset (DocETL), against the mock LLM server
+    check    check.check against the synthetic ground truth
+    fill     simple_form_fill.fill_form, per document, against the mock LLM server
+
+Each stage runs in a fresh process so its peak RSS can be measured in
+isolation; module import time is reported separately from stage time. Results (docs/sec, p50/p99 latency, peak RSS, LLM call counts)
+are written as JSON.
+"""
+
+import argparse
+import contextlib
+import functools
+import importlib
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue as queue_module
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+from fema_agent.mock_llm import MockLLMConfig, start_mock_server
+
+from synthetic import generate_corpus
+
+STAGES = ['ingest', 'dataset', 'parse', 'check', 'fill']
+
+MOCK_MODEL = 'openai/mock'
+
+def percentile(values, q: float):
+    """Nearest-rank percentile, or None for an empty sample"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def _peak_rss_mb() -> float:
+    """Peak RSS of this process and any children it waited on, in MB"""
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if platform.system() == 'Darwin' else 1024
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return max(self_rss, children_rss) / 2**20
+
+def _timed_completion(completion, latencies):
+    """Wrap a litellm `completion` function to record per-call latency"""
+    @functools.wraps(completion)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return completion(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+def stage_ingest(ctx):
+    from fema_agent.storage import DeclarationStorage
+
+    with open(ctx['pda_reports_path']) as f:
+        pda_reports = json.load(f)
+    with open(ctx['corpus_truth_path']) as f:
+        truth = json.load(f)
+
+    storage = DeclarationStorage(ctx['storage_dir'])
+    latencies = []
+    for entry in truth:
+        filename = entry['original_filename']
+        start = time.perf_counter()
+        entry['uuid'] = storage.add_document(
+            Path(ctx['pdf_dir']) / filename, metadata={'pda_report': pda_reports[filename]}
+            )
+        latencies.append(time.perf_counter() - start)
+
+    with open(ctx['truth_path'], 'w') as f:
+        json.dump(truth, f)
+    return {'docs': len(truth), 'latencies': latencies, 'latency_unit': 'document'}
+
+def stage_dataset(ctx):
+    from fema_agent.parse import create_docetl_dataset_from_storage
+
+    _, dataset = create_docetl_dataset_from_storage(ctx['storage_dir'], temp_dir=ctx['workdir'])
+    return {'docs': len(dataset), 'latencies': [], 'latency_unit': None}
+
+def stage_parse(ctx):
+    from fema_agent.parse import parse_dataset
+    import docetl.operations.utils.api as docetl_api
+
+    latencies = []
+    docetl_api.completion = _timed_completion(docetl_api.completion, latencies)
+
+    dataset_path = Path(ctx['workdir']) / f"{Path(ctx['storage_dir']).name}_docetl.json"
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = parse_dataset(
+            dataset_path, ctx['parsed_path'], MOCK_MODEL,
+            api_base=ctx['api_base'], use_text_layer=ctx['text_layer'],
+            checkbox_detection=ctx['checkboxes'], shard_mode=ctx['shard']
+            )
+    return {'docs': len(results), 'latencies': latencies, 'latency_unit': 'llm_call'}
+
+def stage_check(ctx):
+    from fema_agent import check
+
+    truth, attempt = check.load_data(ctx['truth_path'], ctx['parsed_path'])
+    truth = sorted(truth, key=lambda doc: doc['uuid'])
+    attempt = sorted(attempt, key=lambda doc: doc['uuid'])
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = check.check(attempt, truth)
+    return {
+        'docs': len(attempt),
+        'latencies': [],
+        'latency_unit': None,
+        'field_accuracy': float(results['correct'].mean()),
+    }
+
+def stage_fill(ctx):
+    from fema_agent.simple_form_fill import fill_form
+    from fema_agent.storage import DeclarationStorage
+
+    storage = DeclarationStorage(ctx['storage_dir'])
+    doc_latencies = []
+    for doc_id in storage.get_all_documents():
+        document = storage.get_document_metadata(doc_id)
+        start = time.perf_counter()
+        fill_form(
+            document, chunk_size=ctx['fields_per_request'],
+            model=MOCK_MODEL, api_base=ctx['api_base']
+            )
+        doc_latencies.append(time.perf_counter() - start)
+    return {'docs': len(doc_latencies), 'latencies': doc_latencies, 'latency_unit': 'document'}
+
+STAGE_FUNCTIONS = {
+    'ingest': stage_ingest,
+    'dataset': stage_dataset,
+    'parse': stage_parse,
+    'check': stage_check,
+    'fill': stage_fill,
+}
+
+# Modules each stage imports, timed separately from the stage itself. The
+# package defers its heavy dependencies, so those are listed explicitly
+STAGE_IMPORTS = {
+    'ingest': ['fema_agent.storage', 'PyPDF2'],
+    'dataset': ['fema_agent.parse'],
+    'parse': ['fema_agent.parse', 'docetl.api', 'docetl.operations.utils.api', 'pypdfium2', 'numpy'],
+    'check': ['fema_agent.check', 'pandas'],
+    'fill': ['fema_agent.simple_form_fill', 'litellm'],
+}
+
+def _stage_worker(stage, ctx, queue):
+    os.environ.update(ctx['env'])
+    # A spawned process defaults to spawning its own children; restore the
+    # platform default, which is what fill_form's worker pool normally uses
+    mp.set_start_method(ctx['start_method'], force=True)
+    # Keep anything written relative to the working directory inside the run
+    os.chdir(ctx['workdir'])
+    try:
+        start = time.perf_counter()
+        for module in STAGE_IMPORTS[stage]:
+            importlib.import_module(module)
+        import_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = STAGE_FUNCTIONS[stage](ctx)
+        result['seconds'] = time.perf_counter() - start
+        result['import_seconds'] = import_seconds
+        result['peak_rss_mb'] = _peak_rss_mb()
+        queue.put(result)
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+
+def run_stage(stage: str, ctx: dict, server) -> dict:
+    """
+    Run one stage in a fresh process and summarize it
+
+    Returns:
+        Dictionary of metrics for the stage
+    """
+    server.reset_stats()
+    spawn = mp.get_context('spawn')
+    queue = spawn.Queue()
+    process = spawn.Process(target=_stage_worker, args=(stage, ctx, queue))
+    process.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except queue_module.Empty:
+            if not process.is_alive():
+                result = {'error': f"Stage process exited with code {process.exitcode}"}
+                break
+    process.join()
+
+    if 'error' in result:
+        return result
+
+    latencies = result.pop('latencies')
+    seconds = result['seconds']
+    result.update({
+        'docs_per_sec': result['docs'] / seconds if seconds else None,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'llm_requests': server.stats['requests'],
+        'llm_rate_limited': server.stats['rate_limited'],
+        'llm_errors': server.stats['errors'],
+        'llm_input_tokens': server.stats['input_tokens'],
+        'llm_output_tokens': server.stats['output_tokens'],
+    })
+    return result
+
+def run_benchmark(n_docs: int, stages, workdir: Path, server, seed: int = 0,
+                  fields_per_request: int = 5, text_layer: bool = False,
+                  checkboxes: bool = False, shard: str = 'page') -> dict:
+    """
+    Generate a corpus of `n_docs` documents and run each stage over it
+
+    Returns:
+        Dictionary mapping stage name to its metrics
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    if 'ingest' in stages:
+        # Start from an empty store, so reruns don't ingest duplicates
+        shutil.rmtree(workdir / 'storage', ignore_errors=True)
+    corpus = generate_corpus(workdir / 'corpus', n_docs, seed=seed, ingest=False)
+
+    ctx = {
+        'workdir': str(workdir),
+        'pdf_dir': corpus['pdf_dir'],
+        'pda_reports_path': corpus['pda_reports_path'],
+        'corpus_truth_path': corpus['truth_path'],
+        'truth_path': str(workdir / 'truth.json'),
+        'storage_dir': str(workdir / 'storage'),
+        'parsed_path': str(workdir / 'parsed.json'),
+        'api_base': server.base_url,
+        'fields_per_request': fields_per_request,
+        'text_layer': text_layer,
+        'checkboxes': checkboxes,
+        'shard': shard,
+        'start_method': mp.get_start_method(),
+        'env': {
+            # litellm's OpenAI client insists on a key, even for a local endpoint
+            'OPENAI_API_KEY': 'mock',
+            # Keep DocETL's LLM cache inside the run, so repeated runs aren't served from cache
+            'DOCETL_HOME_DIR': str(workdir),
+        },
+    }
+
+    results = {}
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        print(f"[{n_docs} docs] {stage}...", flush=True)
+        results[stage] = run_stage(stage, ctx, server)
+        if 'error' in results[stage]:
+            print(f"  failed: {results[stage]['error']}")
+        else:
+            print(f"  {results[stage]['docs_per_sec']:.2f} docs/sec, "
+                  f"peak RSS {results[stage]['peak_rss_mb']:.0f} MB")
+    return results
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the FEMA form pipeline against the mock LLM")
+    p.add_argument('--docs', type=int, nargs='+', default=[10, 100],
+                   help='Corpus sizes to benchmark')
+    p.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES,
+                   help='Stages to run (later stages depend on earlier ones)')
+    p.add_argument('--latency', type=float, default=0.5, help='Mean mock LLM latency in seconds')
+    p.add_argument('--jitter', type=float, default=0.1, help='Uniform +/- mock LLM latency jitter')
+    p.add_argument('--error-rate', type=float, default=0.0,
+                   help='Fraction of mock LLM requests failed with HTTP 500')
+    p.add_argument('--rate-limit-rate', type=float, default=0.0,
+                   help='Fraction of mock LLM requests answered with HTTP 429')
+    p.add_argument('--requests-per-minute', type=int, default=None,
+                   help='Mock LLM quota over a sliding one-minute window')
+    p.add_argument('--fields-per-request', type=int, default=5,
+                   help='Fields per LLM call in the fill stage')
+    p.add_argument('--text-layer', action='store_true',
+                   help='Read pages from their text layer in the parse stage, only sending the rest to the LLM')
+    p.add_argument('--checkboxes', action='store_true',
+                   help='Read checkbox fields from page images in the parse stage, only sending unclear boxes to the LLM')
+    p.add_argument('--shard', choices=['page', 'map', 'parallel_map', 'document'], default='page',
+                   help='Request each page, each field group of it, or each whole document in the parse stage')
+    p.add_argument('--seed', type=int, default=0, help='Seed for the corpus and the mock LLM server')
+    p.add_argument('--workdir', type=str, default=None,
+                   help='Directory for corpora and intermediate files (default: a temp dir)')
+    p.add_argument('--output', type=str, default='benchmark_results.json',
+                   help='Path of the JSON results file')
+    args = p.parse_args()
+
+    config = MockLLMConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        requests_per_minute=args.requests_per_minute,
+        seed=args.seed
+        )
+    server = start_mock_server(config)
+    print(f"Mock LLM server at {server.base_url}")
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='fema_bench_'))
+    runs = []
+    for n_docs in args.docs:
+        stages = run_benchmark(
+            n_docs, args.stages, workdir / f"docs_{n_docs}", server,
+            seed=args.seed, fields_per_request=args.fields_per_request,
+            text_layer=args.text_layer, checkboxes=args.checkboxes, shard=args.shard
+            )
+        runs.append({'docs': n_docs, 'stages': stages})
+    server.shutdown()
+
+    report = {
+        'config': {**vars(args), 'python': sys.version.split()[0], 'platform': platform.platform()},
+        'runs': runs,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,155 @@
+"""
+Compare the accuracy and cost per document of parse's shard modes.
+
+Each mode (`parse --shard`; by default `page`, a request per page, against
+`document`, one whole-document request) parses the same stored documents.
+Accuracy comes from `check.check` against the ground truth, matched by
+`original_filename`; requests, tokens and cost come from the telemetry
+spans of the mode's LLM calls. Re-asks are off by default, so only each
+mode's own requests are compared.
+
+    python benchmarks/shard_modes.py --storage-dir data/processed/test-set \\
+        --ground-truth data/ground_truth/test_set_truth.json --model gemini/gemini-2.0-flash-lite
+
+With `--model openai/mock --api-base <mock server>` it runs offline; the mock's
+answers are random, so that only compares request counts and tokens.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+
+from pathlib import Path
+
+DEFAULT_MODES = ['page', 'document']
+
+def align(results: list, truth: list):
+    """
+    Pair parsed results with their ground truth by original filename
+
+    Fields missing from a result (e.g. its request failed) are left empty,
+    so they count as errors wherever the truth has a value.
+    """
+    from fema_agent.forms.fema_010_0_13 import FEMA_FORM_010_0_13
+
+    by_filename = {result['original_filename']: result for result in results}
+    attempts, truths = [], []
+    for entry in truth:
+        result = by_filename.get(entry['original_filename'])
+        if result is None:
+            continue
+        attempt = dict(result)
+        for field_name, field in FEMA_FORM_010_0_13.fields.items():
+            attempt.setdefault(field_name, [] if field.is_multi_select else False if field.is_boolean else '')
+        attempts.append(attempt)
+        truths.append(entry)
+    return attempts, truths
+
+def run_mode(mode: str, dataset_path: Path, truth: list, workdir: Path, model: str,
+             api_base=None, reasks: int = 0) -> dict:
+    """
+    Parse the dataset with one shard mode and score it
+
+    Returns:
+        Dictionary of metrics for the mode, and the path of its spans file
+    """
+    from fema_agent import check, parse, telemetry
+
+    spans_path = workdir / f"{mode}.spans.jsonl"
+    spans_path.unlink(missing_ok=True)
+    telemetry.enable(spans_path)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = parse.parse_dataset(
+            dataset_path, str(workdir / f"{mode}.json"), model,
+            dataset_name=f"shard_{mode}", api_base=api_base, shard_mode=mode, reasks=reasks
+            )
+    seconds = time.perf_counter() - start
+
+    attempts, truths = align(results, truth)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scored = check.check(attempts, truths)
+    return {
+        'docs': len(results),
+        'docs_checked': len(attempts),
+        'seconds': seconds,
+        'field_accuracy': float(scored['correct'].mean()) if len(scored) else None,
+        'spans_path': str(spans_path),
+    }
+
+def add_costs(metrics: dict) -> dict:
+    """Add request, token and cost totals per document from a mode's spans"""
+    from fema_agent import telemetry
+
+    spans_path = metrics.pop('spans_path')
+    docs = metrics['docs'] or 1
+    if not Path(spans_path).exists():
+        return {**metrics, 'requests_per_doc': 0.0, 'input_tokens_per_doc': 0.0,
+                'output_tokens_per_doc': 0.0, 'cost_per_doc': 0.0}
+    spans = telemetry.load_spans(spans_path)
+    return {
+        **metrics,
+        'requests_per_doc': len(spans) / docs,
+        'input_tokens_per_doc': float(spans['gen_ai.usage.input_tokens'].sum()) / docs,
+        'output_tokens_per_doc': float(spans['gen_ai.usage.output_tokens'].sum()) / docs,
+        'cost_per_doc': float(spans['fema.cost_usd'].sum()) / docs,
+    }
+
+def main():
+    from fema_agent.parse import SHARD_MODES
+
+    p = argparse.ArgumentParser(description="Compare the accuracy and cost per document of parse's shard modes")
+    p.add_argument('--storage-dir', required=True, help='Storage directory of the documents to parse')
+    p.add_argument('--ground-truth', default='data/ground_truth/test_set_truth.json',
+                   help='Ground truth JSON, matched to the documents by original filename')
+    p.add_argument('--model', required=True, help='Model to parse with (any litellm model string)')
+    p.add_argument('--api-base', default=None, help='Optional endpoint to send model calls to')
+    p.add_argument('--modes', nargs='+', choices=SHARD_MODES, default=DEFAULT_MODES,
+                   help='Shard modes to compare')
+    p.add_argument('--reasks', type=int, default=0,
+                   help='Times invalid fields are re-requested (default: none, to compare the modes alone)')
+    p.add_argument('--workdir', default=None,
+                   help='Directory for results and spans (default: a temp dir)')
+    p.add_argument('--output', default='shard_modes.json', help='Path of the JSON results file')
+    args = p.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='fema_shard_modes_'))
+    workdir.mkdir(parents=True, exist_ok=True)
+    # A fresh DocETL cache, so no mode is answered from an earlier run's cache
+    os.environ['DOCETL_HOME_DIR'] = str(workdir)
+
+    from fema_agent.parse import create_docetl_dataset_from_storage
+
+    with open(args.ground_truth) as f:
+        truth = json.load(f)
+    dataset_path, _ = create_docetl_dataset_from_storage(args.storage_dir, temp_dir=str(workdir))
+
+    runs = {}
+    for mode in args.modes:
+        print(f"Parsing with --shard {mode}...", flush=True)
+        runs[mode] = run_mode(mode, dataset_path, truth, workdir, args.model,
+                              api_base=args.api_base, reasks=args.reasks)
+    # Spans are read last, so calls logged by litellm after a pipeline returned are in
+    runs = {mode: add_costs(metrics) for mode, metrics in runs.items()}
+
+    print(f"\n{'mode':<14}{'accuracy':>10}{'requests':>10}{'in tokens':>11}{'out tokens':>11}{'cost':>10}{'seconds':>9}")
+    print(f"{'':<14}{'':>10}{'/doc':>10}{'/doc':>11}{'/doc':>11}{'/doc':>10}")
+    for mode, metrics in runs.items():
+        accuracy = metrics['field_accuracy']
+        print(f"{mode:<14}{(f'{accuracy:.2%}' if accuracy is not None else '-'):>10}"
+              f"{metrics['requests_per_doc']:>10.1f}{metrics['input_tokens_per_doc']:>11.0f}"
+              f"{metrics['output_tokens_per_doc']:>11.0f}{'$' + format(metrics['cost_per_doc'], '.4f'):>10}"
+              f"{metrics['seconds']:>9.1f}")
+
+    with open(args.output, 'w') as f:
+        json.dump({'config': vars(args), 'runs': runs}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
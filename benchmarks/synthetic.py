@@ -0,0 +1,236 @@
+"""
+Synthetic FEMA Form 010-0-13 documents for benchmarking.
+
+Generates filled-in, four-page declaration request PDFs with a real text
+layer, along with the ground-truth field values used to fill them and a
+short synthetic PDA report per document. Everything is seeded, so the same
+corpus size and seed always produce the same corpus.
+"""
+
+import argparse
+import json
+import random
+import zlib
+
+from pathlib import Path
+
+from fema_agent.forms.fema_010_0_13 import FEMA_FORM_010_0_13
+from fema_agent.states import STATE_ABBREVIATIONS
+from fema_agent.storage import DeclarationStorage
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+MARGIN = 50
+FONT_SIZE = 9
+LINE_HEIGHT = 12
+CHARS_PER_LINE = 105
+
+WORDS = (
+    "storm flooding damage county roads bridges power outages residents shelters "
+    "debris removal emergency response local resources state agencies estimated "
+    "public infrastructure homes destroyed affected area assistance requested"
+).split()
+
+def _escape(text: str) -> str:
+    """Escape a string for use inside a PDF literal string"""
+    text = text.encode('latin-1', 'replace').decode('latin-1')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def _wrap(text: str, width: int = CHARS_PER_LINE):
+    """Greedy word wrap"""
+    lines, current = [], ''
+    for word in text.split():
+        if current and len(current) + len(word) + 1 > width:
+            lines.append(current)
+            current = word
+        else:
+            current = f"{current} {word}".strip()
+    lines.append(current)
+    return lines
+
+def render_pdf(pages) -> bytes:
+    """
+    Render pages of text lines to a minimal PDF with a Helvetica text layer
+
+    Args:
+        pages: List of pages, each a list of text lines
+
+    Returns:
+        The PDF file contents
+    """
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    page_ids = []
+    next_id = 4
+    for lines in pages:
+        stream = [f"BT /F1 {FONT_SIZE} Tf {LINE_HEIGHT} TL {MARGIN} {PAGE_HEIGHT - MARGIN} Td"]
+        stream.extend(f"({_escape(line)}) Tj T*" for line in lines)
+        stream.append("ET")
+        content = zlib.compress('\n'.join(stream).encode('latin-1'))
+
+        page_id, content_id = next_id, next_id + 1
+        next_id += 2
+        page_ids.append(page_id)
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        objects[content_id] = (
+            f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode()
+            + content + b"\nendstream"
+        )
+
+    kids = ' '.join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[2] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += f"{obj_id} 0 obj\n".encode() + objects[obj_id] + b"\nendobj\n"
+
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for obj_id in sorted(objects):
+        out += f"{offsets[obj_id]:010d} 00000 n \n".encode()
+    out += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref_offset}\n%%EOF\n"
+    ).encode()
+    return bytes(out)
+
+def _sentence(rng, n_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + '.'
+
+def synthetic_values(rng):
+    """Draw a plausible value for every form field"""
+    values = {}
+    for field_name, field in FEMA_FORM_010_0_13.fields.items():
+        if field.is_boolean:
+            values[field_name] = rng.random() < 0.5
+        elif field.is_multi_select:
+            values[field_name] = rng.sample(field.options, k=rng.randint(1, min(3, len(field.options))))
+        elif field.options:
+            values[field_name] = rng.choice(field.options)
+        elif field_name == 'state_or_tribe':
+            values[field_name] = rng.choice(sorted(STATE_ABBREVIATIONS)).title()
+        elif field_name == 'population':
+            values[field_name] = f"{rng.randint(10_000, 20_000_000):,}"
+        elif 'date' in field_name:
+            values[field_name] = f"{rng.randint(2017, 2019)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        elif field_name in ('damage_description', 'resource_description'):
+            values[field_name] = ' '.join(_sentence(rng, rng.randint(12, 25)) for _ in range(rng.randint(3, 8)))
+        elif rng.random() < 0.25:
+            values[field_name] = ''
+        else:
+            values[field_name] = _sentence(rng, rng.randint(2, 10))
+    return values
+
+def page_lines(page, values):
+    """Lay out the fields of one form page as text lines"""
+    lines = []
+    if page == 1:
+        lines += [
+            "OMB Control Number: 1660-0009    Expiration: 12/31/2019",
+            "DEPARTMENT OF HOMELAND SECURITY - Federal Emergency Management Agency",
+            "REQUEST FOR PRESIDENTIAL DISASTER DECLARATION",
+            "",
+        ]
+    for field_name, field in FEMA_FORM_010_0_13.get_fields_for_page(page).items():
+        value = values[field_name]
+        if field.is_boolean:
+            lines.append(f"{field.field_number}. [{'X' if value else ' '}] {field.description.strip()}")
+        elif field.is_multi_select:
+            lines.append(f"{field.field_number}. {field.description}")
+            lines += [f"    [{'X' if option in value else ' '}] {option}" for option in field.options]
+        else:
+            lines += _wrap(f"{field.field_number}. {field.description}: {value}")
+        lines.append("")
+    lines.append(f"FEMA Form 010-0-13 (4/17)    Page {page} of 4")
+    return lines
+
+def make_document(rng):
+    """Generate one synthetic filled-in form, returning (pdf bytes, field values)"""
+    values = synthetic_values(rng)
+    pages = [page_lines(page, values) for page in sorted(FEMA_FORM_010_0_13.fields_by_page)]
+    return render_pdf(pages), values
+
+def make_pda_report(rng, values):
+    """A short synthetic PDA report consistent with the form's values"""
+    return (
+        f"Preliminary Damage Assessment Report. {values['state_or_tribe']} - "
+        f"{', '.join(values['incident_type'])}. Incident period "
+        f"{values['incident_period_beginning_date']} to {values['incident_period_end_date']}. "
+        + ' '.join(_sentence(rng, rng.randint(10, 20)) for _ in range(rng.randint(5, 15)))
+    )
+
+def generate_corpus(output_dir, n_docs: int, seed: int = 0, ingest: bool = True):
+    """
+    Generate a synthetic corpus of filled-in forms
+
+    Writes one PDF per document to `output_dir/pdfs`, the ground truth to
+    `truth.json` (one entry per document, keyed by `original_filename`) and
+    the PDA reports to `pda_reports.json` (filename -> report).
+
+    Args:
+        output_dir: Directory in which to write the corpus
+        n_docs: Number of documents to generate
+        seed: Random seed
+        ingest: Whether to also add the documents, with their PDA reports, to a
+            DeclarationStorage under `output_dir/storage`. Ground truth entries
+            then also carry each document's `uuid`.
+
+    Returns:
+        Dictionary with the `pdf_dir`, `storage_dir`, `truth_path` and
+        `pda_reports_path` paths
+    """
+    rng = random.Random(seed)
+    output_dir = Path(output_dir)
+    pdf_dir = output_dir / "pdfs"
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+
+    truth, pda_reports = [], {}
+    for i in range(n_docs):
+        pdf_bytes, values = make_document(rng)
+        pdf_path = pdf_dir / f"synthetic_{i:05d}.pdf"
+        pdf_path.write_bytes(pdf_bytes)
+        truth.append({"original_filename": pdf_path.name, **values})
+        pda_reports[pdf_path.name] = make_pda_report(rng, values)
+
+    storage_dir = None
+    if ingest:
+        storage_dir = output_dir / "storage"
+        storage = DeclarationStorage(storage_dir)
+        for entry in truth:
+            filename = entry["original_filename"]
+            entry["uuid"] = storage.add_document(
+                pdf_dir / filename, metadata={"pda_report": pda_reports[filename]}
+                )
+
+    truth_path = output_dir / "truth.json"
+    with open(truth_path, 'w') as f:
+        json.dump(truth, f, indent=2)
+
+    pda_reports_path = output_dir / "pda_reports.json"
+    with open(pda_reports_path, 'w') as f:
+        json.dump(pda_reports, f, indent=2)
+
+    return {
+        "pdf_dir": str(pdf_dir),
+        "storage_dir": str(storage_dir) if storage_dir else None,
+        "truth_path": str(truth_path),
+        "pda_reports_path": str(pda_reports_path),
+    }
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Generate a synthetic FEMA Form 010-0-13 corpus")
+    p.add_argument('output_dir', help='Directory in which to write the corpus')
+    p.add_argument('--docs', type=int, default=100, help='Number of documents to generate')
+    p.add_argument('--seed', type=int, default=0, help='Random seed')
+    p.add_argument('--no-ingest', action='store_true',
+                   help='Only write PDFs, without adding them to a storage directory')
+    args = p.parse_args()
+
+    paths = generate_corpus(args.output_dir, args.docs, seed=args.seed, ingest=not args.no_ingest)
+    print(json.dumps(paths, indent=2))
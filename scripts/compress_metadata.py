@@ -1,28 +1,28 @@
 import json
 from pathlib import Path
 
+from fema_agent.storage import DeclarationStorage, scan_document_dirs
+
 def compress_metadata(base_dir, output_file):
     """Compress UUID-based metadata into a single JSONL file"""
     processed = 0
     base_path = Path(base_dir)
+    # Read through the storage so pending change log entries are included
+    storage = DeclarationStorage(base_dir)
     
     # Ensure output directory exists
     Path(output_file).parent.mkdir(parents=True, exist_ok=True)
     
     with open(output_file, 'w') as out_f:
-        for uuid_dir in base_path.iterdir():
-            if not uuid_dir.is_dir():
-                continue
-                
+        for uuid_dir in scan_document_dirs(base_path):
             metadata_file = uuid_dir / "metadata.json"
             if not metadata_file.exists():
                 continue
                 
-            with open(metadata_file, 'r') as f:
-                metadata = json.load(f)
-                metadata['uuid'] = uuid_dir.name
-                out_f.write(json.dumps(metadata) + '\n')
-                processed += 1
+            metadata = storage.get_document_metadata(uuid_dir.name)
+            metadata['uuid'] = uuid_dir.name
+            out_f.write(json.dumps(metadata) + '\n')
+            processed += 1
     
     print(f"Compressed {processed} metadata files to {output_file}")
 
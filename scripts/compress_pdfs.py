@@ -1,23 +1,244 @@
 import argparse
+import bz2
+import os
+import stat
+import struct
+import time
 import zipfile
+import zlib
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 
-def create_pdf_archive(pdf_dir, output_file):
-    """Create a ZIP archive of PDFs preserving UUID directory structure"""
+from fema_agent.packs import PackStore
+from fema_agent.storage import scan_document_dirs
+
+# Scanned PDFs are already compressed internally, so storing them as-is is
+# usually the right trade-off; the other codecs are kept for text-heavy corpora.
+COMPRESSION_METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+}
+
+# Version of the ZIP format needed to extract each method, and ZIP64 records
+VERSION_NEEDED = {zipfile.ZIP_STORED: 20, zipfile.ZIP_DEFLATED: 20, zipfile.ZIP_BZIP2: 46}
+ZIP64_VERSION = 45
+
+# Sizes, offsets and member counts from which ZIP64 records are needed
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+ZIP64_END_LOCATOR = struct.Struct('<IIQI')
+
+@dataclass
+class ArchiveMember:
+    """A single archive member, compressed ahead of time by a worker thread"""
+    arcname: str
+    data: bytes
+    crc: int
+    file_size: int
+    date_time: tuple
+    mode: int
+
+def compress_bytes(data, compress_type, compresslevel=None):
+    """Compress raw bytes as a ZIP member of the given method"""
+    if compress_type == zipfile.ZIP_STORED:
+        return bytes(data)
+    if compress_type == zipfile.ZIP_DEFLATED:
+        level = zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else compresslevel
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+    if compress_type == zipfile.ZIP_BZIP2:
+        return bz2.compress(data, 9 if compresslevel is None else compresslevel)
+    raise ValueError(f"Unsupported compression method: {compress_type}")
+
+def compress_directory(packs, uuid_dir, compress_type, compresslevel=None):
+    """
+    Read and compress every PDF of a single document, loose or packed
+
+    zlib and bz2 release the GIL while compressing, so several documents
+    are compressed concurrently from a thread pool.
+
+    Members are named `<uuid>/...` whatever the storage layout, so archives
+    of flat and sharded stores can be set up either way. Packed files are
+    read from the store's packs and dated by their pack file.
+
+    Args:
+        packs: PackStore of the storage directory
+
+    Returns:
+        List of ArchiveMember objects, ready to be appended to the archive
+    """
+    def member(arcname, data, mtime, mode):
+        return ArchiveMember(
+            arcname=arcname,
+            data=compress_bytes(data, compress_type, compresslevel),
+            crc=zlib.crc32(data),
+            file_size=len(data),
+            date_time=time.localtime(mtime)[:6],
+            mode=mode,
+        )
+
+    doc_id = uuid_dir.name
+    members = {}
+    for pdf_file in sorted(uuid_dir.glob('**/*.pdf')):
+        file_stat = pdf_file.stat()
+        members[pdf_file.relative_to(uuid_dir).as_posix()] = member(
+            pdf_file.relative_to(uuid_dir.parent).as_posix(), pdf_file.read_bytes(),
+            file_stat.st_mtime, file_stat.st_mode
+            )
+
+    packed = [name for name in packs.names(doc_id) if name not in members]
+    if packed:
+        pack_mtime = packs.pack_path(packs.shard(doc_id)).stat().st_mtime
+        for name in packed:
+            members[name] = member(f"{doc_id}/{name}", packs.read(doc_id, name), pack_mtime, stat.S_IFREG | 0o644)
+    return [members[name] for name in sorted(members)]
+
+def _zip64_field(value, limit, marker=0xFFFFFFFF):
+    """A header field's value, or the marker pointing to its ZIP64 record once it reaches the limit"""
+    return marker if value >= limit else value
+
+def _dos_date_time(date_time):
+    """A (year, month, day, hour, minute, second) tuple as MS-DOS (time, date) fields"""
+    year, month, day, hour, minute, second = date_time if date_time[0] >= 1980 else (1980, 1, 1, 0, 0, 0)
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+class ArchiveWriter:
+    """
+    Write a ZIP archive of members compressed ahead of time
+
+    zipfile compresses each member itself, in the thread writing it, and has
+    no public API for adding data that's already compressed. So this writes
+    the ZIP format's local headers, central directory and end records itself,
+    with ZIP64 records where sizes, offsets or the member count need them.
+    Archives are read back with zipfile or any unzip tool.
+
+    Args:
+        path: Path of the archive to create
+        compress_type: ZIP method the members are compressed with
+    """
+    def __init__(self, path, compress_type):
+        self.compress_type = compress_type
+        self._file = open(path, 'wb')
+        self._central = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, member):
+        """Append a compressed member"""
+        name = member.arcname.encode('utf-8')
+        flags = 0 if member.arcname.isascii() else 0x800
+        dos_time, dos_date = _dos_date_time(member.date_time)
+        compress_size = len(member.data)
+        offset = self._file.tell()
+
+        zip64 = max(member.file_size, compress_size) >= ZIP64_LIMIT
+        version = max(VERSION_NEEDED[self.compress_type], ZIP64_VERSION if zip64 else 0)
+        extra = struct.pack('<HHQQ', 1, 16, member.file_size, compress_size) if zip64 else b''
+        self._file.write(LOCAL_HEADER.pack(
+            0x04034b50, version, flags, self.compress_type, dos_time, dos_date, member.crc,
+            0xFFFFFFFF if zip64 else compress_size, 0xFFFFFFFF if zip64 else member.file_size,
+            len(name), len(extra)
+            ))
+        self._file.write(name)
+        self._file.write(extra)
+        self._file.write(member.data)
+
+        # The central directory's ZIP64 field holds only the values that overflow
+        overflow = [value for value in (member.file_size, compress_size, offset) if value >= ZIP64_LIMIT]
+        extra = struct.pack(f'<HH{len(overflow)}Q', 1, 8 * len(overflow), *overflow) if overflow else b''
+        version = max(VERSION_NEEDED[self.compress_type], ZIP64_VERSION if overflow else 0)
+        self._central.append(CENTRAL_HEADER.pack(
+            0x02014b50, (3 << 8) | version, version, flags, self.compress_type, dos_time, dos_date, member.crc,
+            _zip64_field(compress_size, ZIP64_LIMIT), _zip64_field(member.file_size, ZIP64_LIMIT),
+            len(name), len(extra), 0, 0, 0, (member.mode & 0xFFFF) << 16, _zip64_field(offset, ZIP64_LIMIT)
+            ) + name + extra)
+
+    def close(self):
+        """Write the central directory and end records, and close the file"""
+        if self._file.closed:
+            return
+        start = self._file.tell()
+        for header in self._central:
+            self._file.write(header)
+        end = self._file.tell()
+        count, size = len(self._central), end - start
+
+        if count >= ZIP_FILECOUNT_LIMIT or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            self._file.write(ZIP64_END_RECORD.pack(
+                0x06064b50, ZIP64_END_RECORD.size - 12, ZIP64_VERSION, ZIP64_VERSION, 0, 0,
+                count, count, size, start
+                ))
+            self._file.write(ZIP64_END_LOCATOR.pack(0x07064b50, 0, end, 1))
+        count_field = _zip64_field(count, ZIP_FILECOUNT_LIMIT, marker=0xFFFF)
+        self._file.write(END_RECORD.pack(
+            0x06054b50, 0, 0, count_field, count_field,
+            _zip64_field(size, ZIP64_LIMIT), _zip64_field(start, ZIP64_LIMIT), 0
+            ))
+        self._file.close()
+
+def create_pdf_archive(pdf_dir, output_file, compression='stored', compresslevel=None, workers=None):
+    """
+    Create a ZIP archive of PDFs preserving UUID directory structure
+
+    Packed documents are included, unpacked to `<uuid>/<name>` like loose ones.
+
+    UUID directories are read and compressed in parallel by a thread pool
+    while the main thread streams finished members into the archive. Only a
+    bounded window of directories is held in memory at any one time.
+
+    Args:
+        pdf_dir: Root directory containing one subdirectory per document
+        output_file: Path of the archive to create
+        compression: One of COMPRESSION_METHODS ('stored', 'deflated', 'bzip2')
+        compresslevel: Optional codec-specific compression level
+        workers: Number of compression threads (default: CPU count)
+    """
     base_path = Path(pdf_dir)
-    with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for uuid_dir in base_path.iterdir():
-            if not uuid_dir.is_dir():
-                continue
-                
-            # Find all PDFs in this UUID directory
-            for pdf_file in uuid_dir.glob('**/*.pdf'):
-                # Create archive path relative to base_path
-                arcname = pdf_file.relative_to(base_path)
-                zipf.write(pdf_file, arcname)
-    
-    print(f"Created PDF archive at {output_file}")
+    compress_type = COMPRESSION_METHODS[compression]
+    workers = workers or os.cpu_count() or 1
+
+    # Opened on its own: a DeclarationStorage would initialise files in the store
+    packs = PackStore(base_path / "packs")
+    uuid_dirs = scan_document_dirs(base_path)
+    n_files = 0
+
+    with ArchiveWriter(output_file, compress_type) as archive, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        def submit_next():
+            uuid_dir = next(uuid_dirs, None)
+            if uuid_dir is not None:
+                pending.append(executor.submit(
+                    compress_directory, packs, uuid_dir, compress_type, compresslevel
+                    ))
+
+        # Keep a couple of directories per worker in flight
+        for _ in range(2 * workers):
+            submit_next()
+
+        while pending:
+            members = pending.popleft().result()
+            submit_next()
+            for member in members:
+                archive.write(member)
+                n_files += 1
+    packs.close()
+
+    print(f"Created PDF archive at {output_file} ({n_files} files, {compression})")
 
 if __name__ == "__main__":
     p = argparse.ArgumentParser(
@@ -27,7 +248,19 @@ if __name__ == "__main__":
 
     p.add_argument('--pdf_dir', type=str)
     p.add_argument('--outpath', type=str)
+    p.add_argument('--compression', choices=list(COMPRESSION_METHODS), default='stored',
+                   help='Archive codec. Scanned PDFs barely compress, so defaults to stored.')
+    p.add_argument('--compresslevel', type=int, default=None,
+                   help='Optional compression level for deflated/bzip2')
+    p.add_argument('--workers', type=int, default=None,
+                   help='Number of compression threads (default: CPU count)')
 
     args = p.parse_args()
 
-    create_pdf_archive(args.pdf_dir, args.outpath)
+    create_pdf_archive(
+        args.pdf_dir,
+        args.outpath,
+        compression=args.compression,
+        compresslevel=args.compresslevel,
+        workers=args.workers
+        )
@@ -4,7 +4,8 @@ Populate FEMA Declaration IDs for disaster declarations by querying the FEMA API
 
 This script:
 1. Goes through all disaster declarations in a specified directory
-2. For each declaration, queries the OpenFEMA API to find matching records
+2. For each declaration, queries the OpenFEMA API (or a local mirror of it,
+   see `fema_agent.openfema`) to find matching records
 3. Updates the declaration with the matching FEMA declaration ID if found
 4. Reports unprocessed declarations for manual review
 """
@@ -14,75 +15,20 @@ import datetime
 import json
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
 import requests
 
+from fema_agent import instrument
+from fema_agent.openfema import DeclarationMirror
+from fema_agent.states import resolve_state
 from fema_agent.storage import DeclarationStorage
 
-STATE_ABBREVIATIONS = {
-    'alabama': 'AL', 'alaska': 'AK', 'arizona': 'AZ', 'arkansas': 'AR',
-    'california': 'CA', 'colorado': 'CO', 'connecticut': 'CT', 'delaware': 'DE',
-    'district of columbia': 'DC', 'florida': 'FL', 'georgia': 'GA', 'hawaii': 'HI',
-    'idaho': 'ID', 'illinois': 'IL', 'indiana': 'IN', 'iowa': 'IA',
-    'kansas': 'KS', 'kentucky': 'KY', 'louisiana': 'LA', 'maine': 'ME',
-    'maryland': 'MD', 'massachusetts': 'MA', 'michigan': 'MI', 'minnesota': 'MN',
-    'mississippi': 'MS', 'missouri': 'MO', 'montana': 'MT', 'nebraska': 'NE',
-    'nevada': 'NV', 'new hampshire': 'NH', 'new jersey': 'NJ', 'new mexico': 'NM',
-    'new york': 'NY', 'north carolina': 'NC', 'north dakota': 'ND', 'ohio': 'OH',
-    'oklahoma': 'OK', 'oregon': 'OR', 'pennsylvania': 'PA', 'rhode island': 'RI',
-    'south carolina': 'SC', 'south dakota': 'SD', 'tennessee': 'TN', 'texas': 'TX',
-    'utah': 'UT', 'vermont': 'VT', 'virginia': 'VA', 'washington': 'WA',
-    'west virginia': 'WV', 'wisconsin': 'WI', 'wyoming': 'WY',
-
-     # American Samoa, Guam, etc are treated like states in the FEMA db
-    'american samoa': 'AS',
-    'u.s. territory of guam': 'GU',
-    'northern mariana islands': 'MP'
-
-}
-
-TRIBES_TO_STATE = {
-    'oglala sioux tribe': 'SD',
-    'soboba band of luiseno indians': 'CA',
-    'navajo nation': 'AZ',
-    "tohono o'odham nation": 'AZ',
-    'ponca tribe of nebraska': 'NE',
-    'cahuilla band of indians': 'CA',
-    'sac & fox tribe of the mississippi of iowa': 'IA',
-    'confederated tribes of the colville reservation': 'WA',
-    'havasupai tribe': 'AZ',
-    'la jolla band of luiseno indians': 'CA'
-}
-
-
 def parse_state(state_str: str) -> str | None:
-    name = state_str.lower().strip()
-    
-    # Remove known prefixes
-    PREFIXES = [
-        'commonwealth of the ', 'commonwealth of ',
-        'the state of ', 'state of '
-        ]
-    for prefix in PREFIXES:
-        if name.startswith(prefix):
-            name = name.replace(prefix, '', 1)
-            break  # only one prefix should apply
-    
-    # Remove trailing " state" if present
-    if name.endswith(' state'):
-        name = name.replace(' state', '', 1)
-
-    name_clean = name.strip()
-
-    # Try mapping to abbreviations, flagging if they don't exist
-    if name_clean in STATE_ABBREVIATIONS:
-        return STATE_ABBREVIATIONS[name_clean]
-    elif name_clean in TRIBES_TO_STATE:
-        return TRIBES_TO_STATE[name_clean]
-    else:
-        return None
+    """Map a state or tribal government name to its two-letter state code (see `fema_agent.states`)"""
+    return resolve_state(state_str)
 
 
 def parse_date(date_str: str) -> Optional[datetime.datetime]:
@@ -98,17 +44,26 @@ def parse_date(date_str: str) -> Optional[datetime.datetime]:
         return None
 
 
-def search_fema_declarations(state: str, incident_date: datetime.datetime) -> List[Dict]:
+def search_fema_declarations(
+        state: str,
+        incident_date: datetime.datetime,
+        mirror: Optional[DeclarationMirror] = None
+        ) -> List[Dict]:
     """
     Search the FEMA API for declarations matching the state and incident date.
     
     Args:
         state: The state or tribal name
         incident_date: The incident date
+        mirror: Optional local declarations mirror to query instead of the API
         
     Returns:
         A list of matching declaration records
     """
+    if mirror is not None:
+        with instrument.timer('mirror_query'):
+            return mirror.search(state, incident_date, window_days=3)
+
     # Build the API query
     base_url = "https://www.fema.gov/api/open/v2/DisasterDeclarationsSummaries"
     
@@ -130,9 +85,11 @@ def search_fema_declarations(state: str, incident_date: datetime.datetime) -> Li
     }
     
     try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        with instrument.timer('http'):
+            response = requests.get(base_url, params=params)
+            response.raise_for_status()
+            data = response.json()
+        instrument.count('http_requests')
         return data.get("DisasterDeclarationsSummaries", [])
     except requests.RequestException as e:
         print(f"Error querying FEMA API: {e}")
@@ -167,6 +124,7 @@ def extract_unique_disasters(declaration_summaries: List[Dict]) -> List[Dict]:
             'incidentType': record.get('incidentType', ''),
             'declarationTitle': record.get('declarationTitle', ''),
             'declarationDate': record.get('declarationDate', ''),
+            'declarationType': record.get('declarationType', ''),
             'disasterNumber': disaster_id
         }
     
@@ -221,22 +179,282 @@ def choose_matching_declaration(doc_metadata: Dict, declarations: List[Dict]) ->
             print("Please enter a number.")
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Populate FEMA Declaration IDs for disaster declarations")
-    parser.add_argument("declaration_dir", help="Directory containing declaration documents")
-    parser.add_argument("--dry-run", action="store_true", help="Don't actually update declaration IDs, just show what would happen")
-    parser.add_argument("--auto-match", action="store_true", help="Automatically match declarations without prompting if only one match is found")
-    parser.add_argument("--verbose", "-v", action="store_true", help="Show detailed logs")
-    
-    args = parser.parse_args()
-    
-    # Initialize storage
-    storage = DeclarationStorage(args.declaration_dir)
-    
-    # Get all documents
-    all_documents = storage.get_all_documents()
-    print(f"Found {len(all_documents)} documents in {args.declaration_dir}")
-    
+# Form incident types (lowercased) mapped to the OpenFEMA `incidentType` values they correspond to
+INCIDENT_TYPE_ALIASES = {
+    'drought': {'drought'},
+    'earthquake': {'earthquake'},
+    'explosion': {'other', 'human cause', 'chemical'},
+    'fire': {'fire'},
+    'flood': {'flood', 'coastal storm', 'dam/levee break'},
+    'hurricane': {'hurricane', 'typhoon', 'tropical storm', 'coastal storm'},
+    'landslide': {'mud/landslide'},
+    'mudslide': {'mud/landslide'},
+    'severe storm': {'severe storm', 'severe ice storm', 'coastal storm'},
+    'snowstorm': {'snowstorm', 'winter storm'},
+    'straight-line winds': {'severe storm'},
+    'tidal wave': {'tsunami', 'coastal storm'},
+    'tornado': {'tornado', 'severe storm'},
+    'tropical depression': {'tropical storm', 'hurricane'},
+    'tropical storm': {'tropical storm', 'hurricane', 'coastal storm'},
+    'tsunami': {'tsunami'},
+    'volcanic eruption': {'volcanic eruption'},
+    'winter storm': {'winter storm', 'snowstorm', 'severe ice storm', 'freezing'},
+    'other': {'other'},
+}
+
+# Relative weight of each scoring signal; they sum to one
+SCORE_WEIGHTS = {
+    'date': 0.4,
+    'incident_type': 0.35,
+    'declaration_type': 0.25,
+}
+
+def expected_declaration_type(request_purpose) -> Optional[str]:
+    """Map the form's request purpose to an OpenFEMA declaration type (DR or EM)"""
+    if not isinstance(request_purpose, str):
+        return None
+    purpose = request_purpose.lower()
+    if 'major disaster' in purpose:
+        return 'DR'
+    if 'emergency' in purpose:
+        return 'EM'
+    return None
+
+def score_candidate(doc_metadata: Dict, incident_date: datetime.datetime, declaration: Dict) -> Dict[str, float]:
+    """
+    Score how well a candidate declaration matches a document.
+
+    Each signal is in [0, 1]; signals that can't be computed because the form
+    is missing the relevant field score a neutral 0.5.
+
+    Args:
+        doc_metadata: The document metadata
+        incident_date: The parsed incident beginning date of the document
+        declaration: A candidate declaration (see `extract_unique_disasters`)
+
+    Returns:
+        Dictionary with the individual signal scores and the weighted `total`
+    """
+    scores = {}
+
+    # Date distance: 1.0 for the same day, decaying with each day of difference
+    begin = parse_date((declaration.get('incidentBeginDate') or '')[:10])
+    if begin is None:
+        scores['date'] = 0.5
+    else:
+        scores['date'] = 1 / (1 + abs((begin - incident_date).days))
+
+    # Incident type overlap between the form's checkboxes and the declaration
+    form_types = doc_metadata.get('incident_type') or []
+    if isinstance(form_types, str):
+        form_types = [form_types]
+    candidate_types = set()
+    for form_type in form_types:
+        candidate_types |= INCIDENT_TYPE_ALIASES.get(str(form_type).lower().strip(), set())
+    declared_type = (declaration.get('incidentType') or '').lower()
+    if not candidate_types or not declared_type:
+        scores['incident_type'] = 0.5
+    else:
+        scores['incident_type'] = 1.0 if declared_type in candidate_types else 0.0
+
+    # Declaration type vs. the form's request purpose
+    expected_type = expected_declaration_type(doc_metadata.get('request_purpose'))
+    declared = declaration.get('declarationType')
+    if not expected_type or not declared:
+        scores['declaration_type'] = 0.5
+    else:
+        scores['declaration_type'] = 1.0 if declared == expected_type else 0.0
+
+    scores['total'] = sum(SCORE_WEIGHTS[k] * scores[k] for k in SCORE_WEIGHTS)
+    return scores
+
+def rank_candidates(doc_metadata: Dict, incident_date: datetime.datetime, declarations: List[Dict]) -> List[Tuple[Dict, Dict[str, float]]]:
+    """Score every candidate declaration, best match first"""
+    scored = [
+        (declaration, score_candidate(doc_metadata, incident_date, declaration))
+        for declaration in declarations
+    ]
+    return sorted(scored, key=lambda pair: pair[1]['total'], reverse=True)
+
+def select_confident_match(
+        ranked: List[Tuple[Dict, Dict[str, float]]],
+        threshold: float,
+        min_margin: float
+        ) -> Optional[Dict]:
+    """
+    Pick the best-ranked declaration if it is a confident, unambiguous match.
+
+    The best candidate must score at least `threshold`, and beat the runner-up
+    (if any) by at least `min_margin`.
+    """
+    if not ranked:
+        return None
+    best, best_scores = ranked[0]
+    if best_scores['total'] < threshold:
+        return None
+    if len(ranked) > 1 and best_scores['total'] - ranked[1][1]['total'] < min_margin:
+        return None
+    return best
+
+
+def prepare_document(metadata: Dict) -> Tuple[Optional[str], Optional[datetime.datetime], Optional[str]]:
+    """
+    Extract the state code and incident date needed to match a document.
+
+    Returns:
+        Tuple of (state, incident_date, reason); `reason` explains why the
+        document can't be matched and is None on success
+    """
+    state_str = metadata.get("state_or_tribe")
+    incident_date_str = metadata.get("incident_period_beginning_date")
+
+    if not state_str or not incident_date_str:
+        return None, None, "Missing state or incident date"
+
+    state = parse_state(state_str)
+    if not state:
+        return None, None, f"Unable to parse state: {state_str}"
+
+    incident_date = parse_date(incident_date_str)
+    if not incident_date:
+        return None, None, f"Invalid date format: {incident_date_str}"
+
+    return state, incident_date, None
+
+def match_document(
+        doc_id: str,
+        metadata: Dict,
+        threshold: float,
+        min_margin: float,
+        mirror: Optional[DeclarationMirror] = None
+        ) -> Dict:
+    """
+    Find and score candidate declarations for a single document, without prompting.
+
+    Returns:
+        Result dictionary with the chosen declaration (if confident), the
+        ranked candidates and a reason when no match was chosen
+    """
+    result = {'doc_id': doc_id, 'metadata': metadata, 'chosen': None, 'candidates': [], 'reason': None}
+
+    state, incident_date, reason = prepare_document(metadata)
+    if reason:
+        result['reason'] = reason
+        return result
+
+    declarations = search_fema_declarations(state, incident_date, mirror=mirror)
+    if not declarations:
+        result['reason'] = "No matching declarations found"
+        return result
+
+    ranked = rank_candidates(metadata, incident_date, extract_unique_disasters(declarations))
+    result['candidates'] = [
+        {**declaration, 'scores': scores} for declaration, scores in ranked
+    ]
+    result['chosen'] = select_confident_match(ranked, threshold, min_margin)
+    if result['chosen'] is None:
+        result['reason'] = "Ambiguous or low-confidence match"
+    return result
+
+def run_batch(
+        storage: DeclarationStorage,
+        all_documents: Dict,
+        review_queue_path: str,
+        threshold: float = 0.75,
+        min_margin: float = 0.1,
+        workers: int = 8,
+        mirror: Optional[DeclarationMirror] = None,
+        dry_run: bool = False,
+        verbose: bool = False
+        ) -> Tuple[List, List]:
+    """
+    Match all documents concurrently and without prompting.
+
+    Confident matches are written to storage; ambiguous or low-confidence
+    documents are appended to a JSONL review queue along with their scored
+    candidates, so the run never blocks on user input.
+
+    Returns:
+        Tuple of (matched, unprocessed) lists
+    """
+    matched = []
+    unprocessed = []
+
+    pending = {}
+    for doc_id, doc_info in all_documents.items():
+        try:
+            metadata = storage.get_document_metadata(doc_id)
+        except ValueError:
+            unprocessed.append((doc_id, doc_info, "Missing metadata"))
+            continue
+        if metadata.get("fema_declaration_id"):
+            if verbose:
+                print(f"Document {doc_id} already has FEMA declaration ID: {metadata['fema_declaration_id']}")
+            continue
+        pending[doc_id] = metadata
+
+    print(f"Matching {len(pending)} documents with {workers} workers...")
+
+    n_queued = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            open(review_queue_path, 'a') as review_queue:
+        futures = [
+            executor.submit(match_document, doc_id, metadata, threshold, min_margin, mirror)
+            for doc_id, metadata in pending.items()
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            doc_id, metadata = result['doc_id'], result['metadata']
+            chosen = result['chosen']
+
+            if chosen is None:
+                unprocessed.append((doc_id, metadata, result['reason']))
+                if result['candidates']:
+                    review_queue.write(json.dumps({
+                        'doc_id': doc_id,
+                        'original_filename': metadata.get('original_filename'),
+                        'state_or_tribe': metadata.get('state_or_tribe'),
+                        'incident_period_beginning_date': metadata.get('incident_period_beginning_date'),
+                        'incident_type': metadata.get('incident_type'),
+                        'request_purpose': metadata.get('request_purpose'),
+                        'reason': result['reason'],
+                        'candidates': result['candidates'],
+                    }) + '\n')
+                    n_queued += 1
+                continue
+
+            fema_id = chosen.get("disasterNumber")
+            score = result['candidates'][0]['scores']['total']
+            if dry_run:
+                print(f"  [DRY RUN] Would update {doc_id} with FEMA declaration ID: {fema_id} (score {score:.2f})")
+                matched.append((doc_id, metadata, fema_id))
+                continue
+            try:
+                storage.update_declaration_id(doc_id, fema_id)
+                if verbose:
+                    print(f"  Updated {doc_id} with FEMA declaration ID: {fema_id} (score {score:.2f})")
+                matched.append((doc_id, metadata, fema_id))
+            except Exception as e:
+                unprocessed.append((doc_id, metadata, f"Error updating: {e}"))
+
+    print(f"Queued {n_queued} documents for review in {review_queue_path}")
+    return matched, unprocessed
+
+
+def run_interactive(
+        storage: DeclarationStorage,
+        all_documents: Dict,
+        auto_match: bool = False,
+        mirror: Optional[DeclarationMirror] = None,
+        dry_run: bool = False,
+        verbose: bool = False
+        ) -> Tuple[List, List]:
+    """
+    Match documents one at a time, prompting whenever there are multiple candidates.
+
+    Returns:
+        Tuple of (matched, unprocessed) lists
+    """
     # Track unprocessed documents
     unprocessed = []
     matched = []
@@ -252,7 +470,7 @@ def main():
         
         # Skip if already has FEMA declaration ID
         if metadata.get("fema_declaration_id"):
-            if args.verbose:
+            if verbose:
                 print(f"Document {doc_id} already has FEMA declaration ID: {metadata['fema_declaration_id']}")
             continue
         
@@ -283,7 +501,7 @@ def main():
         print(f"  State: {state}, Incident Date: {incident_date}")
         
         # Search FEMA API for matching declarations
-        declarations = search_fema_declarations(state, incident_date)
+        declarations = search_fema_declarations(state, incident_date, mirror=mirror)
         
         if not declarations:
             print(f"  No matching FEMA declarations found for {doc_id}")
@@ -296,7 +514,7 @@ def main():
         
         # Choose matching declaration
         chosen_declaration = None
-        if args.auto_match and len(declarations) == 1:
+        if auto_match and len(declarations) == 1:
             chosen_declaration = declarations[0]
             print(f"  Auto-matched to {chosen_declaration['disasterNumber']} - {chosen_declaration['declarationTitle']}")
         else:
@@ -309,7 +527,7 @@ def main():
         
         # Update declaration ID
         fema_id = chosen_declaration.get("disasterNumber")
-        if not args.dry_run:
+        if not dry_run:
             try:
                 storage.update_declaration_id(doc_id, fema_id)
                 print(f"  Updated {doc_id} with FEMA declaration ID: {fema_id}")
@@ -320,6 +538,62 @@ def main():
         else:
             print(f"  [DRY RUN] Would update {doc_id} with FEMA declaration ID: {fema_id}")
             matched.append((doc_id, metadata, fema_id))
+
+    return matched, unprocessed
+
+def main():
+    parser = argparse.ArgumentParser(description="Populate FEMA Declaration IDs for disaster declarations")
+    parser.add_argument("declaration_dir", help="Directory containing declaration documents")
+    parser.add_argument("--dry-run", action="store_true", help="Don't actually update declaration IDs, just show what would happen")
+    parser.add_argument("--auto-match", action="store_true", help="Automatically match declarations without prompting if only one match is found")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show detailed logs")
+    parser.add_argument("--mirror", help="Path to a local OpenFEMA mirror (see `python -m fema_agent.openfema download`) to query instead of the API")
+    parser.add_argument("--batch", action="store_true", help="Match without prompting: score candidates, accept confident matches and queue the rest for review")
+    parser.add_argument("--confidence-threshold", type=float, default=0.75, help="Minimum candidate score to accept a match in batch mode")
+    parser.add_argument("--min-margin", type=float, default=0.1, help="Minimum score lead over the runner-up to accept a match in batch mode")
+    parser.add_argument("--workers", type=int, default=8, help="Number of documents to match concurrently in batch mode")
+    parser.add_argument("--review-queue", default="declaration_review_queue.jsonl", help="JSONL file to which ambiguous documents are appended in batch mode")
+    instrument.add_profile_arguments(parser)
+    
+    args = parser.parse_args()
+    instrument.start_profiling(args)
+    
+    # Initialize storage
+    storage = DeclarationStorage(args.declaration_dir)
+
+    mirror = None
+    if args.mirror:
+        if not Path(args.mirror).exists():
+            print(f"Error: OpenFEMA mirror {args.mirror} not found")
+            return 1
+        mirror = DeclarationMirror(args.mirror)
+        print(f"Using local OpenFEMA mirror with {mirror.count()} records")
+    
+    # Get all documents
+    all_documents = storage.get_all_documents()
+    print(f"Found {len(all_documents)} documents in {args.declaration_dir}")
+    
+    if args.batch:
+        matched, unprocessed = run_batch(
+            storage,
+            all_documents,
+            args.review_queue,
+            threshold=args.confidence_threshold,
+            min_margin=args.min_margin,
+            workers=args.workers,
+            mirror=mirror,
+            dry_run=args.dry_run,
+            verbose=args.verbose
+        )
+    else:
+        matched, unprocessed = run_interactive(
+            storage,
+            all_documents,
+            auto_match=args.auto_match,
+            mirror=mirror,
+            dry_run=args.dry_run,
+            verbose=args.verbose
+        )
     
     # Summary
     print("\n" + "="*80)
@@ -7,6 +7,7 @@ import argparse
 import json
 from pathlib import Path
 
+from fema_agent import instrument
 from fema_agent.storage import DeclarationStorage
 
 def update_storage_from_json(
@@ -29,7 +30,7 @@ def update_storage_from_json(
     storage = DeclarationStorage(storage_dir)
     
     # Load the JSON data
-    with open(json_path, "r") as f:
+    with instrument.timer('json_io'), open(json_path, "r") as f:
         data = json.load(f)
     
     # Process each document
@@ -85,8 +86,10 @@ def main():
                       help="Record that the fields are human-verified and to be considered ground truth.")
     parser.add_argument("--dry-run", action="store_true", 
                       help="Don't actually update storage, just print what would be updated")
+    instrument.add_profile_arguments(parser)
     
     args = parser.parse_args()
+    instrument.start_profiling(args)
     
     try:
         count = update_storage_from_json(
@@ -13,6 +13,7 @@ from collections import defaultdict
 import multiprocessing as mp
 from functools import partial
 
+from fema_agent import instrument
 from fema_agent.storage import DeclarationStorage
 from fema_agent.pull_pda import search_fema_pda_reports, fetch_report_details
 
@@ -95,7 +96,8 @@ def process_document(doc_id, info, storage_dir, force=False, delay=0.1):
             report_text = fetch_report_details(report['full_url'])
             
         if report_text:
-            # Store the report text in metadata
+            # Store the report text in metadata; the document's lock keeps
+            # changes other runs made since it was read above
             storage.store_pda_report(
                 doc_id,
                 report_text,
@@ -164,8 +166,12 @@ def process_storage_directory_parallel(storage_dir, force=False, workers=None, d
     
     # Process documents in parallel
     with mp.Pool(workers) as pool:
+        # Timers in the workers aren't reported; their time is almost all HTTP
+        with instrument.timer('http'):
+            pool_results = pool.starmap(worker_func, tasks)
+
         results = []
-        for i, result in enumerate(pool.starmap(worker_func, tasks), 1):
+        for i, result in enumerate(pool_results, 1):
             doc_id, doc_result = result
             results.append(doc_result)
             
@@ -358,8 +364,10 @@ def main():
     parser.add_argument('storage_dir', help='Path to the storage directory')
     parser.add_argument('--force', action='store_true', help='Re-fetch reports even if they already exist')
     parser.add_argument('--output', help='Path to save skipped documents report (default: print to console)')
+    instrument.add_profile_arguments(parser)
     
     args = parser.parse_args()
+    instrument.start_profiling(args)
     
     storage_dir = args.storage_dir
     if not os.path.isdir(storage_dir):
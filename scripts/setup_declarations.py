@@ -1,24 +1,49 @@
 import argparse
 import datetime
+import os
+import re
+import shutil
+import threading
 import zipfile
 import json
 
-from pathlib import Path
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
 
-def extract_pdfs(pdf_archive, output_dir):
-    """Extract PDFs from archive, creating UUID directory structure"""
-    output_path = Path(output_dir)
-    
-    with zipfile.ZipFile(pdf_archive, 'r') as zipf:
-        print(f"Extracting PDFs from {pdf_archive}...")
-        zipf.extractall(path=output_path)
-    
-    print(f"PDFs extracted successfully to {output_path.parent}")
-    return True
+from fema_agent.storage import FLAT, LAYOUTS, document_relpath, read_layout, scan_document_dirs
+
+def member_destination(output_path, member_name, layout=FLAT):
+    """
+    Resolve the storage path for an archive member, rejecting unsafe names
+
+    Members are named `<uuid>/...`; the UUID directory is placed according to
+    the storage layout.
+    """
+    parts = PurePosixPath(member_name).parts
+    if not parts or PurePosixPath(member_name).is_absolute() or '..' in parts:
+        raise ValueError(f"Refusing to extract unsafe archive member: {member_name}")
+    return output_path.joinpath(document_relpath(parts[0], layout), *parts[1:])
+
+def group_members_by_directory(zipf):
+    """Map each UUID directory in an archive to its member names, using only the central directory"""
+    by_directory = defaultdict(list)
+    for info in zipf.infolist():
+        if not info.is_dir():
+            by_directory[PurePosixPath(info.filename).parts[0]].append(info.filename)
+    return by_directory
+
+def _copy_member(zipf, name, output_path, layout=FLAT):
+    """Stream a single archive member to its location in the storage layout"""
+    dest = member_destination(output_path, name, layout)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with zipf.open(name) as src, open(dest, 'wb') as out:
+        shutil.copyfileobj(src, out, length=1024 * 1024)
 
 def inflate_metadata(jsonl_file, output_dir):
     """Inflate metadata into existing UUID directory structure"""
     output_path = Path(output_dir)
+    layout = read_layout(output_path)
     count = 0
     
     print(f"Inflating metadata from {jsonl_file}...")
@@ -30,7 +55,7 @@ def inflate_metadata(jsonl_file, output_dir):
             if not uuid:
                 continue
                 
-            uuid_dir = output_path / uuid
+            uuid_dir = output_path / document_relpath(uuid, layout)
             
             # Skip if directory doesn't exist (PDF might be missing)
             if not uuid_dir.exists():
@@ -60,10 +85,7 @@ def create_registry(output_dir):
     }
     
     # Scan directories to build registry
-    for uuid_dir in output_path.iterdir():
-        if not uuid_dir.is_dir():
-            continue
-            
+    for uuid_dir in scan_document_dirs(output_path):
         metadata_path = uuid_dir / "metadata.json"
         if not metadata_path.exists():
             print(f"Warning: No metadata found for {uuid_dir.name}, skipping in registry")
@@ -115,24 +137,165 @@ def create_registry(output_dir):
     print(f"Created registry with {len(registry['documents'])} documents")
     return len(registry["documents"])
 
-def setup_repository(pdf_archive, jsonl_file, destination=None):
+def registry_entry(uuid, metadata, member_names, layout=FLAT):
+    """
+    Build a registry entry from a document's metadata and its archive members
+
+    Page paths come from the archive listing itself, so no filesystem
+    probing is needed. Paths are relative to the storage root, matching
+    `DeclarationStorage.update_registry`.
+    """
+    page_pattern = re.compile(r"^page_(\d+)\.pdf$")
+    files = {PurePosixPath(name).name for name in member_names}
+    doc_dir = document_relpath(uuid, layout).as_posix()
+    page_numbers = {
+        int(match.group(1)) for match in map(page_pattern.match, files) if match
+    }
+
+    doc_info = {
+        "original_filename": metadata.get("original_filename", f"unknown_{uuid}.pdf"),
+        "import_date": metadata.get("import_date", datetime.datetime.now().isoformat()),
+        "page_count": metadata.get("page_count", 0),
+        "file_path": f"{doc_dir}/all.pdf"
+    }
+
+    # Pages are contiguous from page_1; stop at the first gap
+    pages = []
+    page_dict = {}
+    page_num = 1
+    while page_num in page_numbers:
+        rel_path = f"{doc_dir}/page_{page_num}.pdf"
+        pages.append(rel_path)
+        page_dict[f"page_{page_num}"] = rel_path
+        page_num += 1
+
+    if pages:
+        doc_info["pages"] = pages
+        doc_info.update(page_dict)
+
+    return doc_info
+
+def build_repository(pdf_archive, jsonl_file, output_dir, workers=None, layout=FLAT):
+    """
+    Extract PDFs, inflate metadata and build the registry in a single pass
+
+    The archive's central directory tells us which files each document has,
+    so metadata lines are streamed from the JSONL and each document is
+    extracted and given its `metadata.json` by a worker thread while its
+    registry entry is assembled in memory. The registry is written once at
+    the end, with no second walk over the output directory.
+
+    Args:
+        layout: Storage layout, `FLAT` (`<uuid>/`) or `SHARDED` (`ab/cd/<uuid>/`)
+
+    Returns:
+        Number of documents in the registry
+    """
+    output_path = Path(output_dir)
+    workers = workers or os.cpu_count() or 1
+
+    with zipfile.ZipFile(pdf_archive, 'r') as zipf:
+        members = group_members_by_directory(zipf)
+
+    if layout != FLAT:
+        with open(output_path / "layout.json", 'w') as f:
+            json.dump({"layout": layout}, f, indent=2)
+
+    # One archive handle per worker thread, closed once the pool is done
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def setup_document(uuid, member_names, metadata):
+        zipf = getattr(local, 'zipf', None)
+        if zipf is None:
+            zipf = local.zipf = zipfile.ZipFile(pdf_archive, 'r')
+            with handles_lock:
+                handles.append(zipf)
+
+        for name in member_names:
+            _copy_member(zipf, name, output_path, layout)
+
+        if metadata is None:
+            return uuid, None
+
+        doc_info = registry_entry(uuid, metadata, member_names, layout)
+        # Exported metadata carries the paths of the layout it came from
+        for key in ("file_path", "pages", *(k for k in doc_info if re.match(r"^page_\d+$", k))):
+            if key in metadata and key in doc_info:
+                metadata[key] = doc_info[key]
+
+        with open(output_path / document_relpath(uuid, layout) / "metadata.json", 'w') as mf:
+            json.dump(metadata, mf, indent=2)
+
+        return uuid, doc_info
+
+    registry = {
+        "documents": {},
+        "last_updated": datetime.datetime.now().isoformat()
+    }
+
+    print(f"Setting up repository from {pdf_archive} and {jsonl_file}...")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+
+            def collect(block_until):
+                while len(pending) > block_until:
+                    uuid, doc_info = pending.popleft().result()
+                    if doc_info is not None:
+                        registry["documents"][uuid] = doc_info
+
+            with open(jsonl_file, 'r') as f:
+                for line in f:
+                    metadata = json.loads(line)
+                    uuid = metadata.pop('uuid', None)
+
+                    if not uuid:
+                        continue
+
+                    member_names = members.pop(uuid, None)
+                    if member_names is None:
+                        print(f"Warning: No PDFs for {uuid} in archive, skipping metadata")
+                        continue
+
+                    pending.append(executor.submit(setup_document, uuid, member_names, metadata))
+                    collect(block_until=4 * workers)
+
+            # Documents in the archive without metadata are extracted but not registered
+            for uuid, member_names in members.items():
+                print(f"Warning: No metadata found for {uuid}, skipping in registry")
+                pending.append(executor.submit(setup_document, uuid, member_names, None))
+
+            collect(block_until=0)
+    finally:
+        for zipf in handles:
+            zipf.close()
+
+    with open(output_path / "registry.json", 'w') as f:
+        json.dump(registry, f, indent=2)
+
+    print(f"Created registry with {len(registry['documents'])} documents")
+    return len(registry["documents"])
+
+def setup_repository(pdf_archive, jsonl_file, destination=None, workers=None, layout=FLAT):
     """Set up repository data from archives, PDFs first then metadata"""
     output_dir = destination if destination else "data/processed/all-declarations"
     # Create base directory if it doesn't exist
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     
-    # 1. Extract PDFs if provided (creates directory structure)
     if pdf_archive and Path(pdf_archive).exists():
-        extract_pdfs(pdf_archive, output_dir)
+        # Extract PDFs, inflate metadata and build the registry in one pass
+        build_repository(pdf_archive, jsonl_file, output_dir, workers=workers, layout=layout)
     else:
         print("No PDF archive provided or file not found.")
         print(f"Expecting directory structure in {output_dir}")
-    
-    # 2. Inflate metadata into existing structure
-    inflate_metadata(jsonl_file, output_dir)
 
-    # 3. Create registry.json file
-    create_registry(output_dir)
+        # 1. Inflate metadata into existing structure
+        inflate_metadata(jsonl_file, output_dir)
+
+        # 2. Create registry.json file
+        create_registry(output_dir)
     
     print("Setup complete! You can now use the repository.")
 
@@ -145,6 +308,11 @@ if __name__ == "__main__":
             help="Path in which the data will be setup. Defaults to data/processed/all-declarations",
             default="data/processed/all-declarations"
             )
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of extraction threads (default: CPU count)")
+    parser.add_argument("--layout", choices=LAYOUTS, default=FLAT,
+                        help="Storage layout: flat (<uuid>/) or sharded (ab/cd/<uuid>/). Defaults to flat.")
     args = parser.parse_args()
     
-    setup_repository(args.pdf_archive, args.jsonl_file, destination=args.destination)
+    setup_repository(args.pdf_archive, args.jsonl_file, destination=args.destination, workers=args.workers,
+                     layout=args.layout)
@@ -0,0 +1,502 @@
+"""
+Parse stored declarations through a provider's batch API.
+
+For backfills where latency doesn't matter, every page request is written
+to one JSONL job file in the OpenAI batch format, submitted as a single
+batch job, and polled until the provider has answered it (within 24 hours,
+at batch pricing and outside the synchronous rate limits). Each request's
+`custom_id` is `<uuid>:page_<N>`, so answers are mapped back to their
+document and page, whatever order they come back in.
+
+A request is the same page prompt, page PDF and output schema as the
+synchronous page ops (`parse.build_parse_op`), written as the body of an
+OpenAI chat completion with the PDF as a `file` content part. Bodies go to
+the provider as-is, without litellm's per-provider translation, so only
+providers whose batch endpoint takes that format are supported
+(`BATCH_PROVIDERS`). Failed requests are
+resubmitted in a smaller batch; fields that fail validation are re-asked
+synchronously, as in `parse.parse_dataset`.
+
+The job's state is saved next to the output (`<outpath>.batch.json`), so an
+interrupted run picks up polling the same job instead of resubmitting it.
+
+Backends:
+
+- `LitellmBatchBackend` submits through litellm's files and batches API, to
+  OpenAI or Azure OpenAI
+- `LocalBatchBackend` is a file-based stand-in, answering each job in a
+  local directory with `mock_llm.build_completion`, so the whole flow runs
+  without network access
+
+    python -m fema_agent.parse --storage-dir declarations --outpath results.json --model openai/gpt-4o-mini --batch
+    python -m fema_agent.parse --storage-dir declarations --outpath results.json --model openai/mock --batch-dir batches
+"""
+
+import base64
+import json
+import os
+import time
+import uuid
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fema_agent import forms, instrument, parse, telemetry, validate
+from fema_agent.forms.form import Form
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# litellm providers whose batch API takes OpenAI chat completion bodies
+BATCH_PROVIDERS = ("openai", "azure")
+COMPLETION_WINDOW = "24h"
+
+# Seconds between status checks of a submitted job
+POLL_INTERVAL = 60
+
+# Times the failed requests of a job are resubmitted as a new job
+BATCH_RETRIES = 1
+
+# Job states after which the provider won't answer any more requests
+TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+# Same framing DocETL gives page ops, so batch and synchronous answers match
+SYSTEM_PROMPT = (
+    "You are a helpful assistant, helping the user make sense of their data. "
+    "The result should be a structured output that you will send back to the user, "
+    "with the `send_output` function."
+)
+
+def custom_id(doc_id: str, page: int) -> str:
+    return f"{doc_id}:page_{page}"
+
+def split_custom_id(request_id: str) -> Tuple[str, int]:
+    """Document UUID and page number of a request's `custom_id`"""
+    doc_id, page = request_id.rsplit(":page_", 1)
+    return doc_id, int(page)
+
+def has_page_file(document: Dict[str, Any], page: int) -> bool:
+    """Whether a dataset document has a PDF on disk for a page"""
+    page_path = document.get(f"page_{page}")
+    return bool(page_path) and Path(page_path).exists()
+
+def pdf_part(encoded: str, filename: str) -> Dict[str, Any]:
+    """A base64-encoded PDF as a chat message content part"""
+    return {"type": "file", "file": {"filename": filename, "file_data": f"data:application/pdf;base64,{encoded}"}}
+
+def output_tool(fields: Dict[str, Any], model: str) -> Dict[str, Any]:
+    """The `send_output` function the model answers a page's fields through"""
+    from docetl.operations.utils.validation import convert_val
+
+    properties = {field_name: convert_val(field.to_schema_string(), model) for field_name, field in fields.items()}
+    return {
+        "type": "function",
+        "function": {
+            "name": "send_output",
+            "description": "Send output back to the user",
+            "parameters": {"type": "object", "properties": properties, "required": list(properties)},
+        },
+    }
+
+def build_request(document: Dict[str, Any], page: int, model: str, form: Form,
+                  include_checkboxes: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    One line of a batch job file: a page's prompt, PDF and output schema
+
+    Args:
+        document: Dataset document with absolute `page_N` paths
+        page: Form page number
+        model: Model name as the provider knows it (no litellm prefix)
+        form: Form the document is
+        include_checkboxes: Whether to ask for the page's checkbox fields
+
+    Returns:
+        The request, or None if the document has no file for the page
+    """
+    if not has_page_file(document, page):
+        return None
+    with instrument.timer('pdf_io'), open(document[f"page_{page}"], "rb") as f:
+        encoded = base64.b64encode(f.read()).decode("utf-8")
+
+    fields = parse.page_fields(page, include_checkboxes, form=form)
+    prompt = parse.build_prompt(page, include_checkboxes=include_checkboxes, fields=list(fields), form=form)
+    return {
+        "custom_id": custom_id(document["uuid"], page),
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": [
+                    pdf_part(encoded, f"page_{page}.pdf"),
+                    {"type": "text", "text": prompt},
+                ]},
+            ],
+            "tools": [output_tool(fields, model)],
+            "tool_choice": {"type": "function", "function": {"name": "send_output"}},
+        },
+    }
+
+def parse_answer(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Field values from a batch response body (a chat completion)
+
+    Raises:
+        ValueError: If the response has no readable JSON answer
+    """
+    message = body["choices"][0]["message"]
+    tool_calls = message.get("tool_calls") or []
+    content = tool_calls[0]["function"]["arguments"] if tool_calls else (message.get("content") or "")
+    content = content.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    try:
+        answer = json.loads(content)
+    except json.JSONDecodeError:
+        raise ValueError("Unable to parse response to JSON!")
+    if not isinstance(answer, dict):
+        raise ValueError("Response is not a JSON object!")
+    return answer
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for a provider's batch API
+
+    Each job is a directory holding the submitted `input.jsonl`, a
+    `status.json`, and once polled, the answers in `output.jsonl`. Answers
+    come from `mock_llm.build_completion`, seeded by each request, so runs
+    are deterministic.
+
+    Args:
+        directory: Directory to keep the jobs in
+    """
+    provider = "local"
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def _job_dir(self, batch_id: str) -> Path:
+        return self.directory / batch_id
+
+    def submit(self, requests_path) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        job_dir = self._job_dir(batch_id)
+        job_dir.mkdir(parents=True)
+        (job_dir / "input.jsonl").write_bytes(Path(requests_path).read_bytes())
+        (job_dir / "status.json").write_text(json.dumps({"status": "validating"}))
+        return batch_id
+
+    def poll(self, batch_id: str) -> str:
+        """The job's state; the first poll of a new job answers it"""
+        from fema_agent.mock_llm import build_completion
+
+        job_dir = self._job_dir(batch_id)
+        status = json.loads((job_dir / "status.json").read_text())["status"]
+        if status in TERMINAL_STATES:
+            return status
+
+        with open(job_dir / "input.jsonl") as requests, open(job_dir / "output.jsonl", "w") as output:
+            for line in requests:
+                request = json.loads(line)
+                output.write(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": build_completion(request["body"])},
+                    "error": None,
+                }) + "\n")
+        (job_dir / "status.json").write_text(json.dumps({"status": "completed"}))
+        return "completed"
+
+    def results(self, batch_id: str) -> Iterator[Dict[str, Any]]:
+        output_path = self._job_dir(batch_id) / "output.jsonl"
+        if not output_path.exists():
+            return
+        with open(output_path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+class LitellmBatchBackend:
+    """
+    A provider's batch API, through litellm's files and batches endpoints
+
+    Args:
+        provider: litellm provider name, one of `BATCH_PROVIDERS`
+
+    Raises:
+        ValueError: If the provider isn't in `BATCH_PROVIDERS`
+    """
+    def __init__(self, provider: str = "openai"):
+        if provider not in BATCH_PROVIDERS:
+            raise ValueError(f"Batch jobs can't be sent to {provider} (supported: {', '.join(BATCH_PROVIDERS)})")
+        self.provider = provider
+        self._files = {}  # Batch ID -> (output file ID, error file ID)
+
+    def submit(self, requests_path) -> str:
+        import litellm
+
+        with open(requests_path, "rb") as f:
+            requests_file = litellm.create_file(file=f, purpose="batch", custom_llm_provider=self.provider)
+        batch = litellm.create_batch(
+            completion_window=COMPLETION_WINDOW,
+            endpoint=BATCH_ENDPOINT,
+            input_file_id=requests_file.id,
+            custom_llm_provider=self.provider,
+            )
+        return batch.id
+
+    def poll(self, batch_id: str) -> str:
+        import litellm
+
+        batch = litellm.retrieve_batch(batch_id=batch_id, custom_llm_provider=self.provider)
+        self._files[batch_id] = (batch.output_file_id, batch.error_file_id)
+        return batch.status
+
+    def results(self, batch_id: str) -> Iterator[Dict[str, Any]]:
+        import litellm
+
+        if batch_id not in self._files:
+            self.poll(batch_id)
+        for file_id in self._files[batch_id]:
+            if not file_id:
+                continue
+            content = litellm.file_content(file_id=file_id, custom_llm_provider=self.provider)
+            for line in content.text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+def provider_model(model: str) -> Tuple[str, str]:
+    """
+    Resolve a litellm model string to its provider and the provider's model name
+
+    Raises:
+        ValueError: If litellm can't tell which provider serves the model
+    """
+    import litellm
+
+    try:
+        name, provider, _, _ = litellm.get_llm_provider(model)
+    except litellm.exceptions.BadRequestError:
+        raise ValueError(f"litellm doesn't know which provider serves {model}")
+    return provider, name
+
+def check_batch_provider(model: str) -> str:
+    """
+    The provider a model's batch jobs would go to, if they can be sent there
+
+    Raises:
+        ValueError: If the model's provider isn't in `BATCH_PROVIDERS`
+    """
+    provider, _ = provider_model(model)
+    if provider not in BATCH_PROVIDERS:
+        raise ValueError(f"{model} is served by {provider}, which has no supported batch API "
+                         f"(supported: {', '.join(BATCH_PROVIDERS)})")
+    return provider
+
+def wait_for(backend, batch_ids: Sequence[str], poll_interval: float = POLL_INTERVAL) -> Dict[str, str]:
+    """
+    Poll jobs until every one has finished
+
+    Returns:
+        Dictionary mapping each job to its final state
+    """
+    states = {}
+    while True:
+        for batch_id in batch_ids:
+            if states.get(batch_id) not in TERMINAL_STATES:
+                states[batch_id] = backend.poll(batch_id)
+        pending = [batch_id for batch_id in batch_ids if states[batch_id] not in TERMINAL_STATES]
+        if not pending:
+            return states
+        print(f"Waiting on {len(pending)} batch jobs ({', '.join(sorted(set(states.values())))}); "
+              f"checking again in {poll_interval:g}s")
+        with instrument.timer('batch_wait'):
+            time.sleep(poll_interval)
+
+def _load_state(state_path: Path) -> Dict[str, Any]:
+    if state_path.exists():
+        with open(state_path) as f:
+            return json.load(f)
+    return {"jobs": []}
+
+def _save_state(state_path: Path, state: Dict[str, Any]):
+    with instrument.timer('json_io'), open(state_path, "w") as f:
+        json.dump(state, f, indent=2)
+
+def parse_dataset_batch(
+        dataset_path: Path,
+        output_path: str,
+        model: str,
+        backend=None,
+        api_base: Optional[str] = None,
+        checkbox_detection: bool = False,
+        reasks: int = validate.REASKS,
+        poll_interval: float = POLL_INTERVAL,
+        retries: int = BATCH_RETRIES,
+        escalate_model: Optional[str] = None
+        ) -> List[Dict[str, Any]]:
+    """
+    Parse a dataset with one batch job of page requests
+
+    Args:
+        dataset_path: Path to the dataset JSON file
+        output_path: Path where results will be saved; the job's state is
+            kept in `<output_path>.batch.json` until the results are written
+        model: litellm model string; its prefix picks the provider
+        backend: Batch backend (default: `LitellmBatchBackend` for the model's
+            provider)
+        api_base: Optional endpoint for the synchronous re-asks and checkbox
+            model calls
+        checkbox_detection: Read checkbox fields from the page images instead
+            of asking for them in the batch (see `parse.parse_dataset`)
+        reasks: Times the fields that fail validation are re-requested,
+            synchronously
+        poll_interval: Seconds between status checks
+        retries: Times failed requests are resubmitted as a new job
+        escalate_model: Stronger model to re-parse the low-confidence fields
+            with, synchronously
+
+    Returns:
+        List of parsed results, in dataset order
+    """
+    provider, provider_model_name = provider_model(model)
+    backend = backend or LitellmBatchBackend(provider)
+    include_checkboxes = not checkbox_detection
+
+    with instrument.timer('json_io'), open(dataset_path) as f:
+        dataset = json.load(f)
+    documents = {document["uuid"]: document for document in dataset}
+    document_forms = {doc_id: forms.document_form(document) for doc_id, document in documents.items()}
+
+    state_path = Path(f"{output_path}.batch.json")
+    state = _load_state(state_path)
+    if state["jobs"]:
+        print(f"Resuming {len(state['jobs'])} batch jobs from {state_path}")
+    else:
+        requests_path = state_path.with_suffix(".requests.jsonl")
+        n_requests = 0
+        with open(requests_path, "w") as f:
+            for doc_id, document in documents.items():
+                form = document_forms[doc_id]
+                for page in form.pages:
+                    request = build_request(document, page, provider_model_name, form, include_checkboxes)
+                    if request is None:
+                        print(f"Warning: {doc_id} has no page {page}; skipping it")
+                        continue
+                    f.write(json.dumps(request) + "\n")
+                    n_requests += 1
+        batch_id = backend.submit(requests_path)
+        # The job file holds every page PDF; the provider has its own copy now
+        requests_path.unlink()
+        state["jobs"].append({"batch_id": batch_id, "requests": n_requests, "submitted": time.time()})
+        _save_state(state_path, state)
+        instrument.count('batch_requests', n_requests)
+        print(f"Submitted {n_requests} page requests as batch {batch_id} ({backend.provider})")
+
+    expected = [
+        (doc_id, page)
+        for doc_id, document in documents.items()
+        for page in document_forms[doc_id].pages
+        if has_page_file(document, page)
+    ]
+    answers = {}  # (uuid, page) -> field values
+    errors = {}   # custom_id -> error of its latest attempt
+    while True:
+        # Every job is read again, so a resumed run also has the answers of
+        # jobs collected before it was interrupted; later jobs are retries
+        wait_for(backend, [job["batch_id"] for job in state["jobs"]], poll_interval)
+        for job in state["jobs"]:
+            finished = time.time()
+            for result in backend.results(job["batch_id"]):
+                doc_id, page = split_custom_id(result["custom_id"])
+                if (doc_id, page) in answers:
+                    continue
+                response = result.get("response") or {}
+                try:
+                    if result.get("error") or response.get("status_code") != 200:
+                        raise ValueError(result.get("error") or f"HTTP {response.get('status_code')}")
+                    answers[doc_id, page] = parse_answer(response["body"])
+                except (ValueError, KeyError, IndexError) as e:
+                    errors[result["custom_id"]] = str(e)
+                    continue
+                if telemetry.enabled():
+                    usage = response["body"].get("usage") or {}
+                    telemetry.write_span("parse.batch", job["submitted"], finished, {
+                        "fema.uuid": doc_id, "fema.page": page, "fema.batch_id": job["batch_id"],
+                        "gen_ai.request.model": model,
+                        "gen_ai.usage.input_tokens": usage.get("prompt_tokens"),
+                        "gen_ai.usage.output_tokens": usage.get("completion_tokens"),
+                        })
+
+        # Requests the provider never answered (e.g. the job expired) failed too
+        failed = {
+            custom_id(doc_id, page): errors.get(custom_id(doc_id, page), "no response")
+            for doc_id, page in expected
+            if (doc_id, page) not in answers
+        }
+        retried = len(state["jobs"]) - 1
+        if not failed or retried >= retries:
+            break
+
+        retry_path = state_path.with_suffix(f".retry_{retried}.jsonl")
+        n_requests = 0
+        with open(retry_path, "w") as f:
+            for request_id in failed:
+                doc_id, page = split_custom_id(request_id)
+                request = build_request(documents[doc_id], page, provider_model_name, document_forms[doc_id],
+                                        include_checkboxes)
+                if request is None:
+                    print(f"Warning: {doc_id} has no page {page} any more; not resubmitting it")
+                    continue
+                f.write(json.dumps(request) + "\n")
+                n_requests += 1
+        if not n_requests:
+            retry_path.unlink()
+            break
+
+        print(f"Resubmitting {n_requests} failed page requests ({retried + 1}/{retries})")
+        instrument.count('batch_requests_retried', n_requests)
+        batch_id = backend.submit(retry_path)
+        retry_path.unlink()
+        state["jobs"].append({"batch_id": batch_id, "requests": n_requests, "submitted": time.time()})
+        _save_state(state_path, state)
+
+    for request_id, error in failed.items():
+        print(f"Batch request {request_id} failed: {error}")
+    instrument.count('batch_requests_failed', len(failed))
+
+    results = []
+    for doc_id, document in documents.items():
+        # Seeded without the form's fields, so a page that failed leaves its
+        # fields missing rather than holding values from an earlier parse
+        form_fields = document_forms[doc_id].fields
+        result = {key: value for key, value in document.items() if key not in form_fields}
+        for page in document_forms[doc_id].pages:
+            fields = parse.page_fields(page, include_checkboxes, form=document_forms[doc_id])
+            answer = answers.get((doc_id, page), {})
+            result.update({name: answer[name] for name in fields if name in answer})
+        results.append(result)
+
+    # Checkbox readings, validation and re-asks run per form, as in parse_dataset
+    for form_number in {form.form_number for form in document_forms.values()}:
+        form = forms.get_form(form_number)
+        form_results = [result for result in results if document_forms[result["uuid"]] is form]
+        if checkbox_detection:
+            parse.add_checkbox_readings(form_results, form.pages, model, api_base=api_base, form=form)
+        parse.reask_invalid_fields(
+            form_results, form.pages, model, dataset_name="batch", api_base=api_base,
+            include_checkboxes=include_checkboxes, reasks=reasks, form=form
+            )
+        if escalate_model:
+            parse.escalate_low_confidence(
+                form_results, form.pages, escalate_model, dataset_name="batch", api_base=api_base,
+                include_checkboxes=include_checkboxes, form=form
+                )
+            parse.reask_invalid_fields(
+                form_results, form.pages, escalate_model, dataset_name="batch", api_base=api_base,
+                include_checkboxes=include_checkboxes, reasks=0, form=form
+                )
+
+    with instrument.timer('json_io'), open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+    # The job is done; a later run with the same output submits a new one
+    os.replace(state_path, state_path.with_suffix(".done.json"))
+    return results
@@ -0,0 +1,289 @@
+"""
+Split a combined PDF of many declaration requests into stored documents.
+
+Our source data comes as large combined PDFs (e.g. the 2017-2019
+governmentattic.org release) holding one FEMA Form 010-0-13 after another,
+often with cover letters and attachments between them. Rather than
+hand-splitting these into one PDF per request and adding each with
+`storage add`, this module reads the bundle directly:
+
+1. Each page's text layer is checked for the first-page header of every
+   registered form (`Form.header_phrases`; for FEMA Form 010-0-13, "REQUEST
+   FOR PRESIDENTIAL DISASTER DECLARATION" over "MAJOR DISASTER OR
+   EMERGENCY"). Words are matched loosely to tolerate OCR errors, and only
+   capitalized words count, so letters that mention a declaration request in
+   running text don't start a document. The best-matching form is recorded
+   as the document's `form_number`.
+2. A document runs from one header page to the page before the next, so
+   letters and attachments after a form stay with it. Pages before the first
+   form are skipped.
+3. Every document's `all.pdf` and `page_N.pdf` files are written straight
+   from the bundle into storage, and the registry is updated once.
+
+Both the header scan and the writing are spread over worker processes by
+page range, each opening the bundle itself. Scanned bundles need a text
+layer first (e.g. `ocrmypdf`).
+
+    python -m fema_agent.bundle all-declarations.pdf --storage-dir declarations --dry-run
+"""
+
+import argparse
+import os
+import re
+import uuid
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from difflib import get_close_matches
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from fema_agent import forms, instrument
+
+# Characters of a page's text searched for the header
+HEADER_CHARS = 600
+
+# Similarity for an OCR'd word to match a header word, and share of each
+# phrase's words that must match
+WORD_SIMILARITY = 0.8
+MIN_PHRASE_MATCH = 0.75
+
+# Pages per task when scanning for headers
+SCAN_CHUNK_PAGES = 200
+
+@dataclass
+class BundleDocument:
+    """A declaration request found in a bundle, as 0-based page indices"""
+    start: int
+    end: int
+    form_number: str = forms.DEFAULT_FORM_NUMBER
+
+    @property
+    def page_count(self) -> int:
+        return self.end - self.start + 1
+
+    def filename(self, bundle_path) -> str:
+        """Name the document would have had split by hand, with 1-based pages"""
+        return f"{Path(bundle_path).stem}_pages_{self.start + 1}-{self.end + 1}.pdf"
+
+def header_score(text: str, phrases: List[str]) -> float:
+    """
+    How well a page's text matches a form's first-page header
+
+    Args:
+        text: The page's text
+        phrases: The form's header phrases, all in capitals
+
+    Returns:
+        Share of words matched in the worse-matched header phrase (0 to 1)
+    """
+    words = re.findall(r"[A-Z]{2,}", text[:HEADER_CHARS])
+    if not words or not phrases:
+        return 0.0
+    scores = []
+    for phrase in phrases:
+        phrase_words = phrase.split()
+        matched = sum(bool(get_close_matches(word, words, n=1, cutoff=WORD_SIMILARITY)) for word in phrase_words)
+        scores.append(matched / len(phrase_words))
+    return min(scores)
+
+def page_form(text: str) -> Optional[str]:
+    """
+    The registered form whose first-page header a page matches best
+
+    Returns:
+        The form's number, or None if the page isn't a form's first page
+    """
+    scores = {number: header_score(text, form.header_phrases) for number, form in forms.FORMS.items()}
+    best = max(scores, key=scores.get, default=None)
+    return best if best is not None and scores[best] >= MIN_PHRASE_MATCH else None
+
+def _scan_pages(bundle_path: str, start: int, end: int) -> List[Tuple[int, bool, Optional[str]]]:
+    """
+    Check pages [start, end) of a bundle for the forms' headers
+
+    Returns:
+        List of (page index, has text, number of the form starting on the
+        page or None)
+    """
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(bundle_path)
+    try:
+        results = []
+        for index in range(start, end):
+            page = pdf[index]
+            text = page.get_textpage().get_text_range()
+            results.append((index, bool(text.strip()), page_form(text)))
+        return results
+    finally:
+        pdf.close()
+
+def find_documents(bundle_path, workers: int = 1) -> Tuple[List[BundleDocument], int, int]:
+    """
+    Find the declaration requests in a bundle
+
+    Args:
+        bundle_path: Path to the combined PDF
+        workers: Worker processes scanning page ranges
+
+    Returns:
+        Tuple of (documents, pages skipped before the first form, pages
+        without a text layer)
+    """
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(str(bundle_path))
+    total_pages = len(pdf)
+    pdf.close()
+
+    ranges = [(start, min(start + SCAN_CHUNK_PAGES, total_pages))
+              for start in range(0, total_pages, SCAN_CHUNK_PAGES)]
+    with instrument.timer('bundle_scan'):
+        if workers > 1 and len(ranges) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunks = list(executor.map(_scan_pages, *zip(*((str(bundle_path), s, e) for s, e in ranges))))
+        else:
+            chunks = [_scan_pages(str(bundle_path), s, e) for s, e in ranges]
+    pages = [page for chunk in chunks for page in chunk]
+
+    starts = [(index, form_number) for index, _, form_number in pages if form_number]
+    documents = [
+        BundleDocument(
+            start=start,
+            end=(starts[i + 1][0] - 1 if i + 1 < len(starts) else total_pages - 1),
+            form_number=form_number,
+            )
+        for i, (start, form_number) in enumerate(starts)
+        ]
+    without_text = sum(not has_text for _, has_text, _ in pages)
+    skipped = starts[0][0] if starts else total_pages
+    return documents, skipped, without_text
+
+def _write_documents(bundle_path: str, jobs: List[Tuple[str, str, int, int]]) -> int:
+    """
+    Write documents' `all.pdf` and page files from a bundle
+
+    Args:
+        bundle_path: Path to the combined PDF
+        jobs: List of (document directory, UUID, first page index, last page index)
+
+    Returns:
+        Number of pages written
+    """
+    import pypdfium2 as pdfium
+
+    source = pdfium.PdfDocument(bundle_path)
+    written = 0
+    try:
+        for doc_dir, _, start, end in jobs:
+            doc_dir = Path(doc_dir)
+            doc_dir.mkdir(parents=True, exist_ok=True)
+            indices = list(range(start, end + 1))
+
+            document = pdfium.PdfDocument.new()
+            document.import_pages(source, indices)
+            document.save(doc_dir / "all.pdf")
+            document.close()
+
+            for page_number, index in enumerate(indices, 1):
+                page = pdfium.PdfDocument.new()
+                page.import_pages(source, [index])
+                page.save(doc_dir / f"page_{page_number}.pdf")
+                page.close()
+            written += len(indices)
+    finally:
+        source.close()
+    return written
+
+def ingest_bundle(bundle_path, storage, workers: Optional[int] = None, metadata=None,
+                  documents: Optional[List[BundleDocument]] = None) -> List[Tuple[str, BundleDocument]]:
+    """
+    Split a bundle into documents and add them to storage
+
+    Args:
+        bundle_path: Path to the combined PDF
+        storage: `DeclarationStorage` to add the documents to
+        workers: Worker processes (default: CPU count)
+        metadata: Optional initial metadata for every document
+        documents: Documents already found with `find_documents` (found
+            here if None)
+
+    Returns:
+        List of (document UUID, BundleDocument), in bundle order
+    """
+    from fema_agent.storage import document_relpath
+
+    bundle_path = Path(bundle_path)
+    workers = workers or os.cpu_count() or 1
+    if documents is None:
+        documents, _, _ = find_documents(bundle_path, workers=workers)
+
+    jobs = []
+    for document in documents:
+        doc_id = str(uuid.uuid4())
+        doc_dir = storage.base_dir / document_relpath(doc_id, storage.layout)
+        jobs.append((str(doc_dir), doc_id, document.start, document.end))
+
+    # Deal documents out round-robin so every worker gets a similar share of pages
+    batches = [jobs[i::workers] for i in range(workers) if jobs[i::workers]]
+    with instrument.timer('pdf_split'):
+        if len(batches) > 1:
+            with ProcessPoolExecutor(max_workers=len(batches)) as executor:
+                pages = sum(executor.map(_write_documents, [str(bundle_path)] * len(batches), batches))
+        else:
+            pages = sum(_write_documents(str(bundle_path), batch) for batch in batches)
+    instrument.count('pages_split', pages)
+
+    new_documents = {}
+    for (_, doc_id, _, _), document in zip(jobs, documents):
+        new_documents[doc_id] = storage.new_document_metadata(
+            doc_id,
+            document.filename(bundle_path),
+            document.page_count,
+            {"bundle": bundle_path.name, "bundle_pages": [document.start + 1, document.end + 1], **(metadata or {})},
+            form_number=document.form_number,
+            )
+    storage.register_documents(new_documents)
+
+    return [(doc_id, document) for (_, doc_id, _, _), document in zip(jobs, documents)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split a combined PDF of declaration requests into stored documents")
+    parser.add_argument('bundle', help='Combined PDF with a text layer')
+    parser.add_argument('--storage-dir', type=str, required=True,
+                        help='Path to the storage directory to add the documents to')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes scanning and writing page ranges (default: CPU count)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only list the documents found, without storing them')
+    instrument.add_profile_arguments(parser)
+
+    args = parser.parse_args(argv)
+    instrument.start_profiling(args)
+
+    workers = args.workers or os.cpu_count() or 1
+    documents, skipped, without_text = find_documents(args.bundle, workers=workers)
+    print(f"Found {len(documents)} declaration requests in {args.bundle}")
+    if skipped:
+        print(f"Skipped {skipped} pages before the first request")
+    if without_text:
+        print(f"Warning: {without_text} pages have no text layer; OCR the bundle so their headers can be found")
+
+    if args.dry_run:
+        for document in documents:
+            print(f"  pages {document.start + 1}-{document.end + 1} ({document.page_count} pages, "
+                  f"form {document.form_number})")
+        return 0
+
+    from fema_agent.storage import DeclarationStorage
+
+    storage = DeclarationStorage(args.storage_dir)
+    added = ingest_bundle(args.bundle, storage, workers=workers, documents=documents)
+    for doc_id, document in added:
+        print(f"  pages {document.start + 1}-{document.end + 1} → {doc_id}")
+    print(f"Added {len(added)} documents to {args.storage_dir}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
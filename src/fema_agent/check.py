@@ -1,17 +1,22 @@
 import argparse
 import json
 
-import pandas as pd
+from typing import TYPE_CHECKING
 
-from fema_agent.forms.fema_010_0_13 import FEMA_FORM_010_0_13
+from fema_agent import forms, instrument
+
+# pandas is imported where it's used, so `--help` and load errors stay fast
+if TYPE_CHECKING:
+    import pandas as pd
 
 def load_data(ground_truth_path: str, attempt_path: str):
     """Load ground truth and attempt data from JSON files."""
-    with open(ground_truth_path) as f:
-        ground_truth = json.load(f)
+    with instrument.timer('json_io'):
+        with open(ground_truth_path) as f:
+            ground_truth = json.load(f)
 
-    with open(attempt_path) as f:
-        attempt = json.load(f)
+        with open(attempt_path) as f:
+            attempt = json.load(f)
         
     return ground_truth, attempt
 
@@ -52,7 +57,9 @@ def preprocess_strings(string: str):
     # remove newlines, put everything in lowercase.
     return string.replace("\n", " ").lower()
 
-def check(attempt_json: list[dict], ground_truth_json: list[dict]) -> pd.DataFrame:
+def check(attempt_json: list[dict], ground_truth_json: list[dict]) -> "pd.DataFrame":
+    import pandas as pd
+
     error_count = 0
     results = []
 
@@ -62,7 +69,7 @@ def check(attempt_json: list[dict], ground_truth_json: list[dict]) -> pd.DataFra
 
     for attempt_page, ground_truth_page in zip(attempt_json, ground_truth_json):
         doc_errors = []
-        for field_name, field in FEMA_FORM_010_0_13.fields.items():
+        for field_name, field in forms.document_form(attempt_page).fields.items():
             obj = {
                 # document metadata
                 'uuid': attempt_page['uuid'],
@@ -99,7 +106,7 @@ def check(attempt_json: list[dict], ground_truth_json: list[dict]) -> pd.DataFra
     results = pd.DataFrame(results)
     return results
 
-def analyze(results: pd.DataFrame):
+def analyze(results: "pd.DataFrame"):
     total_fields = len(results)
     correct_fields = results['correct'].sum()
     overall_accuracy = correct_fields / total_fields
@@ -227,13 +234,15 @@ def analyze(results: pd.DataFrame):
 #     for error_type, percentage in error_percentages.items():
 #         print(f"{error_type}: {percentage:.1f}%")
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Evaluate FEMA form parsing against ground truth.')
     parser.add_argument('parsed_file', help='Path to the JSON file with parsed form data')
     parser.add_argument('--ground-truth', default='test_set_truth.json', 
                         help='Path to the ground truth JSON file (default: test_set_truth.json)')
+    instrument.add_profile_arguments(parser)
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    instrument.start_profiling(args)
     
     try:
         ground_truth, attempt = load_data(args.ground_truth, args.parsed_file)
@@ -244,8 +253,9 @@ def main():
         print(f"Error parsing JSON: {e}")
         return 1
     
-    results = check(attempt, ground_truth)
-    analyze(results)
+    with instrument.timer('postprocess'):
+        results = check(attempt, ground_truth)
+        analyze(results)
 
     return 0
 
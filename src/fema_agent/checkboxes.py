@@ -0,0 +1,465 @@
+"""
+Read checkbox fields from page images instead of the model.
+
+Checkbox fields (`is_boolean`) cause most of the parse errors on scanned
+forms, and each costs a share of a full-page model call. This module reads
+them locally:
+
+1. The page is rendered with pypdfium2 and the field's printed label
+   ("Individual Assistance Dates Performed") is located in the page's text
+2. The box is found left of the label as a pair of tall vertical strokes:
+   the sides of a drawn box, or the brackets of a typed "[X]"
+3. The share of dark pixels inside the box decides the field: nearly empty
+   is unchecked, clearly marked is checked, and anything in between, or a
+   box that can't be found, is left at low confidence
+
+Only the low-confidence fields go to the model, in one request per page:
+each as a small crop of the box and its label, plus the whole page once if
+some label wasn't found, with one boolean answer per field.
+
+Check how the detector does on a corpus with:
+
+    python -m fema_agent.checkboxes --storage-dir declarations --verbose
+"""
+
+import argparse
+import base64
+import io
+import json
+import re
+import tempfile
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from fema_agent import instrument, telemetry
+from fema_agent.forms.fema_010_0_13 import FEMA_FORM_010_0_13
+from fema_agent.forms.form import Form, FormFieldMetadata
+
+# Pixels per PDF point when rendering pages
+RENDER_SCALE = 3
+
+# Grayscale level below which a pixel counts as ink
+DARK_LEVEL = 128
+
+# Share of dark pixels inside a box: at most UNCHECKED_INK is empty, at least
+# CHECKED_INK is marked; scanner noise and stray strokes fall in between
+UNCHECKED_INK = 0.03
+CHECKED_INK = 0.10
+
+# Minimum height of a box's sides, relative to the label's capitals: brackets
+# and drawn boxes are taller than the text next to them, digits are not
+MIN_SIDE_HEIGHT = 1.15
+
+MIN_CONFIDENCE = 0.9
+CONFIDENT = 0.95
+LOW_CONFIDENCE = 0.5
+
+# Printed labels next to each box on FEMA Form 010-0-13, tried before the
+# start of the field's description
+CHECKBOX_LABELS = {
+    'incident_period_continuing': ['Continuing'],
+    'ia_requested': ['Individual Assistance Dates Performed'],
+    'pa_requested': ['Public Assistance Dates Performed'],
+    'debris_removal_needed': ['I anticipate the need for debris removal'],
+    'direct_federal_assistance_requested': ['I request direct Federal assistance'],
+    'snow_assistance_requested': ['I request snow assistance'],
+    'hazard_mitigation_statewide': ['Statewide'],
+    'other_agency_requirements_anticipated': ['I do anticipate requirements from Other Federal Agencies'],
+    'certification_completed': ['I certify the following'],
+}
+
+# Words of a field's description used as a fallback label
+DESCRIPTION_LABEL_WORDS = 6
+
+CHECKBOX_PROMPT = """
+These images are from a scanned page of FEMA Form 010-0-13.
+{images}
+
+For each field, is its checkbox checked (marked with an X, a check mark, or
+filled in)? Answer in JSON with one boolean key per field.
+"""
+
+CROP_LINE = 'Image {index} is cropped to the checkbox for "{description}" (key "{field_name}").'
+PAGE_LINE = 'Image {index} is the whole page. Find the checkboxes for:\n{fields}'
+
+@dataclass
+class CheckboxReading:
+    """One checkbox field read from a page image"""
+    field_name: str
+    checked: Optional[bool] = None
+    confidence: float = 0.0
+    ink: Optional[float] = None
+    label: Optional[Tuple[int, int, int, int]] = None   # Pixel box (left, top, right, bottom)
+    box: Optional[Tuple[int, int, int, int]] = None
+    source: str = 'raster'                               # "raster" or "model"
+
+def checkbox_labels(field_name: str, field_metadata: FormFieldMetadata) -> List[str]:
+    """Labels to search for a checkbox field, most specific first"""
+    words = field_metadata.description.split()[:DESCRIPTION_LABEL_WORDS]
+    fallback = re.sub(r"[.:,]+$", "", ' '.join(words))
+    return CHECKBOX_LABELS.get(field_name, []) + [fallback]
+
+def _label_boxes(textpage, label: str, page_height: float) -> List[Tuple[Tuple[int, int, int, int], int]]:
+    """
+    Locate every occurrence of a label in a page's text
+
+    Returns:
+        List of (pixel box (left, top, right, bottom), pixel height of the
+        label's first character)
+    """
+    boxes = []
+    searcher = textpage.search(label, match_case=True)
+    while (match := searcher.get_next()) is not None:
+        start, count = match
+        chars = [textpage.get_charbox(i) for i in range(start, start + count)]
+        chars = [c for c in chars if c[2] > c[0] and c[3] > c[1]]
+        if not chars:
+            continue
+        left = chars[0][0]
+        right = max(c[2] for c in chars)
+        bottom = min(c[1] for c in chars)
+        top = max(c[3] for c in chars)
+        box = (
+            int(left * RENDER_SCALE), int((page_height - top) * RENDER_SCALE),
+            int(right * RENDER_SCALE), int((page_height - bottom) * RENDER_SCALE)
+            )
+        boxes.append((box, int((chars[0][3] - chars[0][1]) * RENDER_SCALE)))
+    return boxes
+
+def _longest_runs(dark) -> Tuple[Any, Any]:
+    """Length and end row of the longest vertical run of ink in each column"""
+    import numpy as np
+
+    rows, cols = dark.shape
+    run = np.zeros(cols, dtype=int)
+    longest = np.zeros(cols, dtype=int)
+    end = np.zeros(cols, dtype=int)
+    for row in range(rows):
+        run = np.where(dark[row], run + 1, 0)
+        longer = run > longest
+        longest = np.where(longer, run, longest)
+        end = np.where(longer, row + 1, end)
+    return longest, end
+
+def find_box(dark, label: Tuple[int, int, int, int], height: int) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Find a checkbox just left of a label
+
+    Scanning leftwards from the label, the box's right side is the first
+    column group with a vertical stroke taller than the label's capitals
+    (which rules out digits like the "10." of a field number), and its left
+    side the next one, no further than two label heights.
+
+    Args:
+        dark: Boolean ink mask of the rendered page
+        label: Pixel box (left, top, right, bottom) of the label
+        height: Pixel height of the label's first character
+
+    Returns:
+        Pixel box (left, top, right, bottom) of the checkbox, or None
+    """
+    left, top, _, bottom = label
+    if height <= 0:
+        return None
+
+    region_top = max(0, top - height)
+    region_left = max(0, left - 4 * height)
+    region_right = left - max(1, height // 8)
+    if region_right <= region_left:
+        return None
+    region = dark[region_top:bottom + height, region_left:region_right]
+
+    longest, end = _longest_runs(region)
+    tall = longest >= MIN_SIDE_HEIGHT * height
+
+    # Groups of adjacent tall columns, right to left, as (first column, last column)
+    groups = []
+    col = region.shape[1] - 1
+    while col >= 0:
+        if tall[col]:
+            last = col
+            while col >= 0 and tall[col]:
+                col -= 1
+            groups.append((col + 1, last))
+        col -= 1
+
+    for (right_first, right_last), (left_first, left_last) in zip(groups, groups[1:]):
+        width = right_first - left_last
+        if width > 2 * height:
+            break
+        if width < height // 3:
+            continue
+        # Both sides should span the same rows
+        right_col = right_first + int(longest[right_first:right_last + 1].argmax())
+        left_col = left_first + int(longest[left_first:left_last + 1].argmax())
+        right_span = (end[right_col] - longest[right_col], end[right_col])
+        left_span = (end[left_col] - longest[left_col], end[left_col])
+        overlap = min(right_span[1], left_span[1]) - max(right_span[0], left_span[0])
+        if overlap < 0.8 * max(longest[right_col], longest[left_col]):
+            continue
+        box_top = max(right_span[0], left_span[0])
+        return (
+            region_left + left_first, region_top + box_top,
+            region_left + right_last + 1, region_top + box_top + overlap
+            )
+    return None
+
+def ink_ratio(dark, box: Tuple[int, int, int, int]) -> float:
+    """Share of dark pixels inside a box, away from its sides"""
+    left, top, right, bottom = box
+    pad_x = max(2, (right - left) // 5)
+    pad_y = max(2, (bottom - top) // 5)
+    interior = dark[top + pad_y:bottom - pad_y, left + pad_x:right - pad_x]
+    if interior.size == 0:
+        return 0.0
+    return float(interior.mean())
+
+def classify(ink: float) -> Tuple[bool, float]:
+    """Checked state and confidence for a box's ink ratio"""
+    if ink <= UNCHECKED_INK:
+        return False, CONFIDENT
+    if ink >= CHECKED_INK:
+        return True, CONFIDENT
+    return ink >= (UNCHECKED_INK + CHECKED_INK) / 2, LOW_CONFIDENCE
+
+def read_page_checkboxes(pdf_page, page: int, form: Form = FEMA_FORM_010_0_13) -> Tuple[Dict[str, CheckboxReading], Any]:
+    """
+    Read every checkbox field on a page
+
+    Args:
+        pdf_page: pypdfium2 page
+        page: Form page number
+        form: Form whose checkbox fields to read
+
+    Returns:
+        Tuple of (field name -> reading, rendered grayscale page as a NumPy array)
+    """
+    image = pdf_page.render(scale=RENDER_SCALE, grayscale=True).to_numpy()
+    if image.ndim == 3:
+        image = image[..., 0]
+    dark = image < DARK_LEVEL
+    page_height = pdf_page.get_height()
+    textpage = pdf_page.get_textpage()
+
+    readings = {}
+    for field_name, field_metadata in form.get_fields_for_page(page).items():
+        if not field_metadata.is_boolean:
+            continue
+        reading = readings[field_name] = CheckboxReading(field_name)
+        for label in checkbox_labels(field_name, field_metadata):
+            for label_box, height in _label_boxes(textpage, label, page_height):
+                if reading.label is None:
+                    reading.label = label_box
+                box = find_box(dark, label_box, height)
+                if box is None:
+                    continue
+                reading.label, reading.box = label_box, box
+                reading.ink = ink_ratio(dark, box)
+                reading.checked, reading.confidence = classify(reading.ink)
+                break
+            if reading.box is not None:
+                break
+    return readings, image
+
+def _crop(image, reading: CheckboxReading):
+    """Crop a page image to a checkbox and its label, or keep the whole page"""
+    if reading.label is None:
+        return image
+    left, top, right, bottom = reading.label
+    if reading.box is not None:
+        left, top = min(left, reading.box[0]), min(top, reading.box[1])
+        bottom = max(bottom, reading.box[3])
+    margin = 3 * (bottom - top)
+    rows, cols = image.shape
+    return image[max(0, top - margin):min(rows, bottom + margin),
+                 max(0, left - 2 * margin):min(cols, right + margin)]
+
+def _png_data_url(image) -> str:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+def _parse_checked(content: str, field_names: List[str]) -> Dict[str, bool]:
+    content = re.sub(r"^```(?:json)?|```$", "", content.strip()).strip()
+    try:
+        answers = json.loads(content)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(answers, dict):
+        return {}
+    return {name: answers[name] for name in field_names if isinstance(answers.get(name), bool)}
+
+def _describe(description: str) -> str:
+    return ' '.join(description.split())
+
+def ask_model(image, readings: List[CheckboxReading], descriptions: Dict[str, str], model: str,
+              api_base: Optional[str] = None, page: Optional[int] = None) -> Dict[str, bool]:
+    """
+    Ask the model whether a page's unclear checkboxes are checked, in one request
+
+    Boxes whose label was found are sent as crops; if any label wasn't, the
+    whole page is sent once for those fields.
+
+    Args:
+        image: Rendered grayscale page
+        readings: The fields' raster readings, whose labels and boxes locate the crops
+        descriptions: Field descriptions shown to the model, by field name
+        model: Any litellm model string
+        api_base: Optional endpoint to send the call to
+        page: Form page number, for telemetry
+
+    Returns:
+        Dictionary mapping each field the model answered to its answer
+    """
+    from litellm import completion
+
+    lines, images = [], []
+    for reading in readings:
+        if reading.label is not None:
+            images.append(_crop(image, reading))
+            lines.append(CROP_LINE.format(index=len(images), field_name=reading.field_name,
+                                          description=_describe(descriptions[reading.field_name])))
+    unlabeled = [reading.field_name for reading in readings if reading.label is None]
+    if unlabeled:
+        images.append(image)
+        lines.append(PAGE_LINE.format(index=len(images), fields='\n'.join(
+            f'- "{_describe(descriptions[name])}" (key "{name}")' for name in unlabeled
+            )))
+
+    field_names = [reading.field_name for reading in readings]
+    kwargs = {
+        'model': model,
+        'messages': [{'role': 'user', 'content': [
+            {'type': 'text', 'text': CHECKBOX_PROMPT.format(images='\n'.join(lines))},
+            *({'type': 'image_url', 'image_url': {'url': _png_data_url(crop)}} for crop in images),
+            ]}],
+        'response_format': {'type': 'json_schema', 'json_schema': {
+            'name': 'checkboxes',
+            'schema': {
+                'type': 'object',
+                'properties': {name: {'type': 'boolean'} for name in field_names},
+                'required': field_names,
+            },
+        }},
+        }
+    if api_base is not None:
+        kwargs['api_base'] = api_base
+    if telemetry.enabled():
+        kwargs['metadata'] = telemetry.litellm_metadata(
+            'parse.checkbox', **{'fema.page': page, 'fema.fields': field_names}
+            )
+
+    try:
+        with instrument.timer('llm_wait'):
+            response = completion(**kwargs)
+    except Exception as e:
+        print(f"Error asking {model} about {', '.join(field_names)}: {e}")
+        return {}
+    return _parse_checked(response.choices[0].message.content or '', field_names)
+
+def read_checkboxes(page_path, page: int, form: Form = FEMA_FORM_010_0_13,
+                    model: Optional[str] = None, api_base: Optional[str] = None,
+                    min_confidence: float = MIN_CONFIDENCE) -> Dict[str, CheckboxReading]:
+    """
+    Read a page's checkbox fields, asking the model only about unclear boxes
+
+    Args:
+        page_path: Path to the single-page PDF
+        page: Form page number
+        form: Form whose checkbox fields to read
+        model: Model for boxes read with less than `min_confidence` (if None,
+            they're left as read)
+        api_base: Optional endpoint to send model calls to
+        min_confidence: Confidence below which a box goes to the model
+
+    Returns:
+        Dictionary mapping field name to its reading
+    """
+    import pypdfium2 as pdfium
+
+    page_fields = form.get_fields_for_page(page)
+    try:
+        with instrument.timer('checkboxes'):
+            pdf = pdfium.PdfDocument(page_path)
+            readings, image = read_page_checkboxes(pdf[0], page, form)
+    except Exception as e:
+        print(f"Error reading the checkboxes of {page_path}: {e}")
+        return {name: CheckboxReading(name) for name, field in page_fields.items() if field.is_boolean}
+
+    unclear = [reading for reading in readings.values() if reading.confidence < min_confidence]
+    instrument.count('checkboxes_raster', len(readings) - len(unclear))
+    if model is None or not unclear:
+        return readings
+
+    instrument.count('checkboxes_llm', len(unclear))
+    descriptions = {reading.field_name: page_fields[reading.field_name].description for reading in unclear}
+    answers = ask_model(image, unclear, descriptions, model, api_base=api_base, page=page)
+    for reading in unclear:
+        if reading.field_name in answers:
+            reading.checked, reading.confidence, reading.source = answers[reading.field_name], CONFIDENT, 'model'
+    return readings
+
+def read_document_checkboxes(document: Dict[str, Any], form: Form = FEMA_FORM_010_0_13,
+                             **kwargs) -> Dict[str, CheckboxReading]:
+    """
+    Read the checkbox fields on every page of a document
+
+    Args:
+        document: Document metadata with absolute `page_N` paths, as in the
+            DocETL dataset built by `parse.create_docetl_dataset_from_storage`
+        form: Form whose checkbox fields to read
+        **kwargs: Passed on to `read_checkboxes`
+
+    Returns:
+        Dictionary mapping field name to its reading
+    """
+    readings = {}
+    for page in sorted(form.fields_by_page):
+        page_fields = form.get_fields_for_page(page)
+        if not any(field.is_boolean for field in page_fields.values()):
+            continue
+        page_path = document.get(f"page_{page}")
+        if page_path:
+            readings.update(read_checkboxes(page_path, page, form, **kwargs))
+        else:
+            readings.update({
+                name: CheckboxReading(name) for name, field in page_fields.items() if field.is_boolean
+            })
+    return readings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report how many checkbox fields can be read from page images")
+    parser.add_argument('--storage-dir', type=str, required=True,
+                        help='Path to the storage directory containing declarations')
+    parser.add_argument('--min-confidence', type=float, default=MIN_CONFIDENCE,
+                        help='Confidence below which a box would be sent to the model')
+    parser.add_argument('--verbose', action='store_true', help='Print every reading')
+
+    args = parser.parse_args(argv)
+
+    from fema_agent.parse import create_docetl_dataset_from_storage
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _, dataset = create_docetl_dataset_from_storage(args.storage_dir, temp_dir=temp_dir)
+
+    n_fields = n_confident = 0
+    for document in dataset:
+        readings = read_document_checkboxes(document, min_confidence=args.min_confidence)
+        for field_name, reading in readings.items():
+            n_fields += 1
+            n_confident += reading.confidence >= args.min_confidence
+            if args.verbose:
+                ink = '-' if reading.ink is None else f"{reading.ink:.3f}"
+                print(f"{document['uuid']} {field_name:<40} checked={reading.checked!s:<5} "
+                      f"ink={ink:<6} confidence={reading.confidence:.2f}")
+
+    share = n_confident / n_fields if n_fields else 0
+    print(f"Checkbox fields read from page images: {n_confident}/{n_fields} ({share:.0%}) "
+          f"across {len(dataset)} documents; the rest would go to the model")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,56 @@
+"""
+Unified `fema-agent` command line.
+
+Each subcommand is one of the package's module CLIs, so these are equivalent:
+
+    fema-agent parse --storage-dir declarations --outpath results.json
+    python -m fema_agent.parse --storage-dir declarations --outpath results.json
+
+Only the module for the chosen subcommand is imported, so `fema-agent --help`
+and the lightweight subcommands start without loading DocETL or litellm.
+"""
+
+import importlib
+import sys
+
+# Subcommand -> (module, one-line description)
+COMMANDS = {
+    'storage': ('fema_agent.storage', 'Add, list, update and export stored declarations'),
+    'bundle': ('fema_agent.bundle', 'Split a combined PDF of declaration requests into stored documents'),
+    'parse': ('fema_agent.parse', 'Parse stored declaration forms with DocETL'),
+    'text-layer': ('fema_agent.text_layer', 'Report how many form pages can be read without a model'),
+    'checkboxes': ('fema_agent.checkboxes', 'Report how many checkbox fields can be read from page images'),
+    'check': ('fema_agent.check', 'Evaluate parsed forms against ground truth'),
+    'fill': ('fema_agent.simple_form_fill', 'Fill forms from PDA reports with an LLM'),
+    'pda': ('fema_agent.pull_pda', 'Search for and fetch FEMA PDA reports'),
+    'openfema': ('fema_agent.openfema', 'Download and search a local OpenFEMA declarations mirror'),
+    'telemetry': ('fema_agent.telemetry', 'Summarize an LLM call telemetry file'),
+    'mock-llm': ('fema_agent.mock_llm', 'Run the local mock LLM server'),
+}
+
+def usage() -> str:
+    lines = ["usage: fema-agent <command> [options]", "", "commands:"]
+    for name, (_, description) in COMMANDS.items():
+        lines.append(f"  {name:<12}{description}")
+    lines += ["", "Run `fema-agent <command> --help` for a command's options."]
+    return '\n'.join(lines)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0 if argv else 1
+
+    command, args = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f"fema-agent: unknown command '{command}'\n\n{usage()}", file=sys.stderr)
+        return 2
+
+    module = importlib.import_module(COMMANDS[command][0])
+    # Make argparse usage and errors read `fema-agent <command>`
+    sys.argv[0] = f"fema-agent {command}"
+    return module.main(args)
+
+if __name__ == "__main__":
+    exit(main())
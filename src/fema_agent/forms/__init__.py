@@ -0,0 +1,42 @@
+"""
+Registry of the forms the package can parse, keyed by `Form.form_number`.
+
+Each stored document records its form under `form_number`; documents from
+before forms were recorded are FEMA Form 010-0-13. Add a form by defining it
+like `fema_010_0_13` and registering it:
+
+    from fema_agent.forms import register_form
+    register_form(create_my_form())
+"""
+
+from typing import Any, Dict
+
+from fema_agent.forms.fema_010_0_13 import FEMA_FORM_010_0_13
+from fema_agent.forms.form import Form, FormFieldMetadata, FormMetadataItem
+
+FORMS: Dict[str, Form] = {}
+
+# Form of documents that don't record one
+DEFAULT_FORM_NUMBER = FEMA_FORM_010_0_13.form_number
+
+def register_form(form: Form) -> Form:
+    """Add a form to the registry, replacing any with the same form number"""
+    FORMS[form.form_number] = form
+    return form
+
+def get_form(form_number: str = DEFAULT_FORM_NUMBER) -> Form:
+    """
+    Look up a registered form
+
+    Raises:
+        ValueError: If no form has this number
+    """
+    if form_number not in FORMS:
+        raise ValueError(f"Unknown form {form_number!r}! Registered forms: {', '.join(FORMS)}")
+    return FORMS[form_number]
+
+def document_form(document: Dict[str, Any]) -> Form:
+    """The form of a stored document, from its `form_number` metadata"""
+    return get_form(document.get('form_number') or DEFAULT_FORM_NUMBER)
+
+register_form(FEMA_FORM_010_0_13)
@@ -6,7 +6,11 @@ def create_fema_form_010_0_13() -> Form:
     """
     form = Form(
         name="Request for Presidential Disaster Declaration",
-        form_number="010-0-13"
+        form_number="010-0-13",
+        header_phrases=[
+            "REQUEST FOR PRESIDENTIAL DISASTER DECLARATION",
+            "MAJOR DISASTER OR EMERGENCY",
+        ]
     )
     
     # Add form metadata
@@ -40,6 +40,14 @@ class Form:
     form_number: str
     form_metadata: Dict[str, FormMetadataItem] = field(default_factory=dict)
     fields_by_page: Dict[int, Dict[str, FormFieldMetadata]] = field(default_factory=dict)
+    # Capitalized phrases printed at the top of the form's first page, used to
+    # find the form in combined PDFs (see `fema_agent.bundle`)
+    header_phrases: List[str] = field(default_factory=list)
+
+    @property
+    def pages(self) -> List[int]:
+        """Page numbers that have fields"""
+        return sorted(self.fields_by_page)
     
     @property
     def fields(self) -> Dict[str, FormFieldMetadata]:
@@ -0,0 +1,192 @@
+"""
+Stage timers, counters and optional profiling for the command-line tools.
+
+Code paths wrap their work in a stage timer:
+
+    with instrument.timer('json_io'):
+        registry = json.load(f)
+
+Timers nest: each stage is charged only its self time, so a registry write
+inside a PDF split counts towards `json_io` rather than towards both. Timers
+are cheap enough to leave on; the totals are only reported when a CLI is run
+with `--profile`, which also captures a cProfile (or pyinstrument) profile:
+
+    python -m fema_agent.parse --storage-dir declarations --outpath out.json --profile
+    python -m fema_agent.parse --storage-dir declarations --outpath out.json --profile pyinstrument --profile-output parse.html
+
+Timings cover the current process. Work fanned out to a `multiprocessing`
+pool is charged to the stage wrapping the pool in the parent; work on a
+thread pool is summed across threads, so those stages can add up to more
+than the wall clock.
+"""
+
+import atexit
+import collections
+import contextlib
+import threading
+import time
+
+from typing import Optional
+
+# Stages reported by every CLI, in pipeline order
+STAGES = ('pdf_split', 'json_io', 'http', 'llm_wait', 'postprocess')
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+_lock = threading.Lock()
+_local = threading.local()
+_seconds = collections.defaultdict(float)
+_calls = collections.defaultdict(int)
+_counters = collections.defaultdict(int)
+_start = time.perf_counter()
+
+@contextlib.contextmanager
+def timer(stage: str):
+    """
+    Time a block of work and charge its self time to `stage`
+
+    Args:
+        stage: Stage name, usually one of `STAGES`
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+
+    # Each frame is [stage, time spent in nested timers]
+    frame = [stage, 0.0]
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        if stack:
+            stack[-1][1] += elapsed
+        with _lock:
+            _seconds[stage] += elapsed - frame[1]
+            _calls[stage] += 1
+
+def count(name: str, n: int = 1) -> None:
+    """Add `n` to the counter `name` (documents processed, HTTP requests, ...)"""
+    with _lock:
+        _counters[name] += n
+
+def reset() -> None:
+    """Clear all timers and counters and restart the wall clock"""
+    global _start
+    with _lock:
+        _seconds.clear()
+        _calls.clear()
+        _counters.clear()
+        _start = time.perf_counter()
+
+def snapshot() -> dict:
+    """
+    Current totals
+
+    Returns:
+        Dictionary with `wall_seconds`, `stages` (stage -> {calls, seconds})
+        and `counters`
+    """
+    with _lock:
+        return {
+            'wall_seconds': time.perf_counter() - _start,
+            'stages': {
+                stage: {'calls': _calls[stage], 'seconds': _seconds[stage]}
+                for stage in _seconds
+            },
+            'counters': dict(_counters),
+        }
+
+def report() -> None:
+    """Print the per-stage breakdown of wall-clock time"""
+    totals = snapshot()
+    wall = totals['wall_seconds']
+    stages = totals['stages']
+    ordered = [s for s in STAGES if s in stages] + sorted(s for s in stages if s not in STAGES)
+    timed = sum(stages[s]['seconds'] for s in ordered)
+
+    print(f"\nStage breakdown ({wall:.2f}s wall clock):")
+    print(f"  {'stage':<14}{'calls':>8}{'seconds':>11}{'% wall':>9}")
+    for stage in ordered:
+        seconds = stages[stage]['seconds']
+        print(f"  {stage:<14}{stages[stage]['calls']:>8}{seconds:>11.2f}{100 * seconds / wall:>8.1f}%")
+    other = max(0.0, wall - timed)
+    print(f"  {'other':<14}{'':>8}{other:>11.2f}{100 * other / wall:>8.1f}%")
+
+    if totals['counters']:
+        print("Counters:")
+        for name, value in sorted(totals['counters'].items()):
+            print(f"  {name}: {value}")
+
+def add_profile_arguments(parser) -> None:
+    """Add the `--profile` and `--profile-output` options to a CLI parser"""
+    parser.add_argument('--profile', nargs='?', const='cprofile', default=None, choices=PROFILERS,
+                        help='Print a per-stage time breakdown and profile the run '
+                             '(cprofile by default, or pyinstrument)')
+    parser.add_argument('--profile-output', type=str, default=None,
+                        help='Write the profile to this file (.prof for cprofile, .html for '
+                             'pyinstrument) instead of printing the top functions')
+
+def start_profiling(args, top: int = 25) -> None:
+    """
+    Start profiling if the CLI was run with `--profile`
+
+    The profile and the stage breakdown are reported when the process exits,
+    however `main` returns.
+
+    Args:
+        args: Parsed arguments from a parser set up by `add_profile_arguments`
+        top: Number of functions to print from the cProfile profile
+    """
+    if not getattr(args, 'profile', None):
+        return
+
+    reset()
+    stop = _start_pyinstrument(args.profile_output) if args.profile == 'pyinstrument' else None
+    if stop is None:
+        stop = _start_cprofile(args.profile_output, top)
+
+    def finish():
+        stop()
+        report()
+
+    atexit.register(finish)
+
+def _start_cprofile(output: Optional[str], top: int):
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    def stop():
+        profiler.disable()
+        if output:
+            profiler.dump_stats(output)
+            print(f"\ncProfile profile written to {output} (view with: python -m pstats {output})")
+        else:
+            print(f"\nTop {top} functions by cumulative time:")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(top)
+    return stop
+
+def _start_pyinstrument(output: Optional[str]):
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        print("pyinstrument is not installed; falling back to cProfile")
+        return None
+
+    profiler = Profiler()
+    profiler.start()
+
+    def stop():
+        profiler.stop()
+        if output:
+            with open(output, 'w') as f:
+                f.write(profiler.output_html())
+            print(f"\npyinstrument profile written to {output}")
+        else:
+            print(profiler.output_text(unicode=True, color=False))
+    return stop
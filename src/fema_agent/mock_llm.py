@@ -0,0 +1,346 @@
+"""
+Local, deterministic mock of an OpenAI-compatible chat completions endpoint.
+
+Answers every request with JSON that conforms to the schema the caller sent:
+as a tool call for DocETL's structured output (the per-page schemas from
+`get_field_schema_dict`), or as a fenced JSON message for `response_format`
+requests (the chunk schemas from `simple_form_fill.build_json_schema`, whose
+DocETL-style type strings are understood too). Latency, server errors and
+rate limits are tunable, so rate limiting, retries and concurrency can be
+load-tested on a machine with no network access.
+
+Point the pipeline at it with an `openai/` model and the server's base URL:
+
+    python -m fema_agent.mock_llm --port 8765 --latency 0.5 --requests-per-minute 60
+    python -m fema_agent.parse ... --model openai/mock --api-base http://127.0.0.1:8765/v1
+"""
+
+import argparse
+import base64
+import collections
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# Rough token accounting for the `usage` block: ~4 characters per token, and
+# a flat per-image cost in the ballpark of what Gemini charges per PDF page
+CHARS_PER_TOKEN = 4
+TOKENS_PER_IMAGE = 258
+
+PDF_DATA_URL_PREFIX = "data:application/pdf;base64,"
+PDF_PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?!s)")
+
+WORDS = "storm flood county damage roads shelter debris emergency assistance response".split()
+
+@dataclass
+class MockLLMConfig:
+    """Behaviour of the mock server"""
+    latency: float = 0.5                         # Mean seconds before each response
+    jitter: float = 0.1                          # Uniform +/- seconds added to the latency
+    error_rate: float = 0.0                      # Fraction of requests failed with HTTP 500
+    rate_limit_rate: float = 0.0                 # Fraction of requests rejected with HTTP 429
+    requests_per_minute: Optional[int] = None    # Sliding-window quota; excess requests get HTTP 429
+    seed: int = 0                                # Seed for latency, error and 429 draws
+
+def schema_from_type_string(type_string: str) -> dict:
+    """
+    Convert a DocETL-style type string ("boolean", "list[enum[a, b]]", ...)
+    to JSON schema, for callers that pass those strings through unconverted
+    """
+    value = type_string.strip()
+    lowered = value.lower()
+    if lowered in ('bool', 'boolean'):
+        return {"type": "boolean"}
+    if lowered in ('int', 'integer'):
+        return {"type": "integer"}
+    if lowered in ('float', 'number'):
+        return {"type": "number"}
+    if lowered.startswith('list[') and value.endswith(']'):
+        return {"type": "array", "items": schema_from_type_string(value[5:-1])}
+    if lowered.startswith('enum[') and value.endswith(']'):
+        return {"type": "string", "enum": [v.strip() for v in value[5:-1].split(',')]}
+    return {"type": "string"}
+
+def fake_value(schema: dict, rng: random.Random, name: str = ''):
+    """
+    Draw a value conforming to a (subset of) JSON schema
+
+    `name` is the property being filled; string properties named like dates
+    get "YYYY-MM-DD" values.
+    """
+    schema_type = schema.get("type", "string")
+    if schema_type not in ("object", "array", "string", "boolean", "integer", "number"):
+        schema = schema_from_type_string(schema_type)
+        schema_type = schema["type"]
+
+    if schema_type == "object":
+        return {
+            key: fake_value(subschema, rng, name=key)
+            for key, subschema in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        items = schema.get("items", {"type": "string"})
+        if "enum" in items:
+            return rng.sample(items["enum"], k=rng.randint(1, min(2, len(items["enum"]))))
+        return [fake_value(items, rng) for _ in range(rng.randint(1, 3))]
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if schema_type == "boolean":
+        return rng.random() < 0.5
+    if schema_type == "integer":
+        return rng.randint(0, 1000)
+    if schema_type == "number":
+        return round(rng.uniform(0, 1000), 2)
+    if rng.random() < 0.25:
+        return ""
+    if name.endswith('date'):
+        return f"{rng.randint(2017, 2019)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))
+
+def _image_pages(part: dict) -> int:
+    """Pages of an image or file part: a PDF sent as a data URL counts each of its pages"""
+    url = (part.get("image_url") or {}).get("url", "") or (part.get("file") or {}).get("file_data", "")
+    if not url.startswith(PDF_DATA_URL_PREFIX):
+        return 1
+    try:
+        data = base64.b64decode(url[len(PDF_DATA_URL_PREFIX):])
+    except ValueError:
+        return 1
+    return max(1, len(PDF_PAGE_PATTERN.findall(data)))
+
+def _count_tokens(messages) -> int:
+    tokens = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            tokens += len(content) // CHARS_PER_TOKEN
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                tokens += len(part.get("text", "")) // CHARS_PER_TOKEN
+            else:
+                tokens += TOKENS_PER_IMAGE * _image_pages(part)
+    return tokens
+
+def _response_schema(response_format: dict) -> dict:
+    """Pull the JSON schema out of an OpenAI-style `response_format`"""
+    json_schema = response_format.get("json_schema") or {}
+    return json_schema.get("schema", json_schema)
+
+def build_completion(request: dict) -> dict:
+    """
+    Build a chat completion answering a request
+
+    The answer is seeded from a hash of the request's messages, so identical
+    requests always receive identical answers.
+    """
+    body = json.dumps(request.get("messages", []), sort_keys=True).encode()
+    rng = random.Random(hashlib.sha256(body).digest())
+
+    tools = request.get("tools") or []
+    if tools:
+        function = tools[0]["function"]
+        arguments = json.dumps(fake_value(function.get("parameters", {}), rng))
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": f"call_{rng.getrandbits(64):016x}",
+                "type": "function",
+                "function": {"name": function["name"], "arguments": arguments},
+            }],
+        }
+        finish_reason = "tool_calls"
+        completion_text = arguments
+    else:
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") in ("json_schema", "json_object"):
+            answer = fake_value(_response_schema(response_format) or {"type": "object"}, rng)
+            completion_text = f"```json\n{json.dumps(answer, indent=2)}\n```"
+        else:
+            completion_text = ' '.join(rng.choice(WORDS) for _ in range(20))
+        message = {"role": "assistant", "content": completion_text}
+        finish_reason = "stop"
+
+    prompt_tokens = _count_tokens(request.get("messages", []))
+    completion_tokens = len(completion_text) // CHARS_PER_TOKEN
+    return {
+        "id": f"chatcmpl-{rng.getrandbits(64):016x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: MockLLMConfig):
+        super().__init__(address, MockLLMHandler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.recent_requests = collections.deque()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": 0, "completed": 0, "rate_limited": 0, "errors": 0,
+                          "input_tokens": 0, "output_tokens": 0}
+
+    def admit(self):
+        """
+        Decide how to answer the next request
+
+        Returns:
+            Tuple of (HTTP status, delay in seconds)
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.stats["requests"] += 1
+
+            # Seeded draws happen for every request, so the sequence of
+            # latencies and injected failures doesn't depend on the quota
+            injected_429 = self.rng.random() < self.config.rate_limit_rate
+            injected_500 = self.rng.random() < self.config.error_rate
+            delay = self.config.latency + self.rng.uniform(-self.config.jitter, self.config.jitter)
+
+            over_quota = False
+            if self.config.requests_per_minute:
+                while self.recent_requests and now - self.recent_requests[0] > 60:
+                    self.recent_requests.popleft()
+                over_quota = len(self.recent_requests) >= self.config.requests_per_minute
+                if not over_quota:
+                    self.recent_requests.append(now)
+
+            if over_quota or injected_429:
+                self.stats["rate_limited"] += 1
+                return 429, 0.0
+            if injected_500:
+                self.stats["errors"] += 1
+                return 500, max(0.0, delay)
+            return 200, max(0.0, delay)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status: int, payload: dict, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            with self.server.lock:
+                self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        if not re.search(r"/chat/completions/?$", self.path):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        status, delay = self.server.admit()
+        time.sleep(delay)
+
+        if status == 429:
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit exceeded (mock)", "type": "rate_limit_error",
+                           "code": "rate_limit_exceeded"}},
+                headers={"Retry-After": "1"}
+                )
+        elif status == 500:
+            self._send_json(
+                500,
+                {"error": {"message": "Internal server error (mock)", "type": "server_error"}}
+                )
+        else:
+            response = build_completion(request)
+            with self.server.lock:
+                self.server.stats["completed"] += 1
+                self.server.stats["input_tokens"] += response["usage"]["prompt_tokens"]
+                self.server.stats["output_tokens"] += response["usage"]["completion_tokens"]
+            self._send_json(200, response)
+
+    def log_message(self, format, *args):
+        # One line per request would swamp load-test output
+        pass
+
+def start_mock_server(config: Optional[MockLLMConfig] = None, host: str = "127.0.0.1", port: int = 0) -> MockLLMServer:
+    """
+    Start a mock server on a background thread
+
+    Args:
+        config: Latency, error and rate limit settings
+        host: Interface to bind
+        port: Port to bind (0 picks a free port)
+
+    Returns:
+        The running server; its `base_url` is the litellm `api_base`
+    """
+    server = MockLLMServer((host, port), config or MockLLMConfig())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock LLM server")
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to bind')
+    parser.add_argument('--port', type=int, default=8765, help='Port to bind')
+    parser.add_argument('--latency', type=float, default=0.5, help='Mean response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.1, help='Uniform +/- latency jitter in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests failed with HTTP 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                        help='Fraction of requests randomly rejected with HTTP 429')
+    parser.add_argument('--requests-per-minute', type=int, default=None,
+                        help='Quota over a sliding one-minute window; excess requests get HTTP 429')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for latency and failure draws')
+
+    args = parser.parse_args(argv)
+
+    config = MockLLMConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        requests_per_minute=args.requests_per_minute,
+        seed=args.seed
+        )
+    server = MockLLMServer((args.host, args.port), config)
+    print(f"Mock LLM server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nServed {server.stats}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
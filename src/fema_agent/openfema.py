@@ -0,0 +1,213 @@
+"""
+Local mirror of the OpenFEMA DisasterDeclarationsSummaries dataset.
+
+The full dataset is bulk-downloaded page by page into a SQLite table indexed
+on (state, incidentBeginDate), so declaration matching can be answered with
+local interval queries instead of one HTTP request per document.
+"""
+
+import argparse
+import datetime
+import json
+import sqlite3
+import threading
+
+from pathlib import Path
+from typing import Dict, List
+
+import requests
+
+OPENFEMA_URL = "https://www.fema.gov/api/open/v2/DisasterDeclarationsSummaries"
+
+# Largest page size the OpenFEMA API accepts
+PAGE_SIZE = 10000
+
+# ISO timestamps are compared on their first 19 characters (YYYY-MM-DDTHH:MM:SS),
+# since OpenFEMA appends milliseconds and a "Z" suffix
+ISO_PREFIX_LENGTH = 19
+
+class DeclarationMirror:
+    def __init__(self, db_path="data/openfema/declarations.db"):
+        """Open (and create if needed) the local declarations mirror"""
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Lookups may come from several matcher threads; they share one
+        # connection and take turns through a lock
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.setup_database()
+
+    def setup_database(self):
+        """Create the declarations table and its lookup index"""
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS declarations (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                incident_begin_date TEXT,
+                disaster_number INTEGER,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_declarations_state_begin
+                ON declarations (state, incident_begin_date);
+            CREATE TABLE IF NOT EXISTS mirror_info (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.conn.commit()
+
+    def download(self, page_size: int = PAGE_SIZE, verbose: bool = True) -> int:
+        """
+        Bulk-download every declaration summary into the local mirror
+
+        Args:
+            page_size: Number of records to request per page
+            verbose: Whether to print progress
+
+        Returns:
+            Number of records stored
+        """
+        session = requests.Session()
+        skip = 0
+        total = None
+        stored = 0
+
+        with self.conn:
+            self.conn.execute("DELETE FROM declarations")
+
+            while total is None or skip < total:
+                params = {
+                    "$top": str(page_size),
+                    "$skip": str(skip),
+                    "$orderby": "id",
+                    "$inlinecount": "allpages",
+                }
+                response = session.get(OPENFEMA_URL, params=params)
+                response.raise_for_status()
+                data = response.json()
+
+                if total is None:
+                    total = data.get("metadata", {}).get("count", 0)
+
+                records = data.get("DisasterDeclarationsSummaries", [])
+                if not records:
+                    break
+
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO declarations VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            record["id"],
+                            record.get("state", ""),
+                            (record.get("incidentBeginDate") or "")[:ISO_PREFIX_LENGTH],
+                            record.get("disasterNumber"),
+                            json.dumps(record),
+                        )
+                        for record in records
+                    ]
+                )
+                stored += len(records)
+                skip += len(records)
+
+                if verbose:
+                    print(f"\rDownloaded {stored}/{total} declaration records", end='')
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO mirror_info VALUES ('last_downloaded', ?)",
+                (datetime.datetime.now().isoformat(),)
+            )
+
+        if verbose:
+            print()
+        return stored
+
+    def search(self, state: str, incident_date: datetime.datetime, window_days: int = 3) -> List[Dict]:
+        """
+        Find declarations for a state whose incident began within a window of a date
+
+        Mirrors the filter used against the live API: records are matched on
+        state and on an incidentBeginDate within `window_days` either side.
+
+        Returns:
+            Matching declaration records, most recent incident first
+        """
+        start = (incident_date - datetime.timedelta(days=window_days)).isoformat()
+        end = (incident_date + datetime.timedelta(days=window_days)).isoformat()
+
+        with self.lock:
+            rows = self.conn.execute(
+                """
+                SELECT record FROM declarations
+                WHERE state = ? AND incident_begin_date BETWEEN ? AND ?
+                ORDER BY incident_begin_date DESC
+                """,
+                (state, start[:ISO_PREFIX_LENGTH], end[:ISO_PREFIX_LENGTH])
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self) -> int:
+        """Number of declaration records in the mirror"""
+        return self.conn.execute("SELECT COUNT(*) FROM declarations").fetchone()[0]
+
+    def last_downloaded(self):
+        """Timestamp of the last completed download, or None"""
+        row = self.conn.execute(
+            "SELECT value FROM mirror_info WHERE key = 'last_downloaded'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local mirror of OpenFEMA disaster declaration summaries")
+
+    base_parser = argparse.ArgumentParser(add_help=False)
+    base_parser.add_argument('--db', default='data/openfema/declarations.db',
+                             help='Path to the SQLite mirror.')
+
+    subparsers = parser.add_subparsers(dest="command", required=True, help="Command to execute")
+
+    download_parser = subparsers.add_parser("download", parents=[base_parser],
+                                            help="Bulk-download all declaration summaries")
+    download_parser.add_argument("--page-size", type=int, default=PAGE_SIZE,
+                                 help="Records per API request")
+
+    search_parser = subparsers.add_parser("search", parents=[base_parser],
+                                          help="Search the local mirror")
+    search_parser.add_argument("state", help="Two-letter state code (e.g. VT)")
+    search_parser.add_argument("incident_date", help="Incident date (YYYY-MM-DD)")
+    search_parser.add_argument("--window-days", type=int, default=3,
+                               help="Days either side of the incident date to match")
+
+    subparsers.add_parser("info", parents=[base_parser], help="Show mirror status")
+
+    args = parser.parse_args(argv)
+
+    mirror = DeclarationMirror(args.db)
+
+    if args.command == "download":
+        try:
+            count = mirror.download(page_size=args.page_size)
+        except requests.RequestException as e:
+            print(f"Error downloading from OpenFEMA: {e}")
+            return 1
+        print(f"Stored {count} declaration records in {args.db}")
+
+    elif args.command == "search":
+        incident_date = datetime.datetime.strptime(args.incident_date, "%Y-%m-%d")
+        records = mirror.search(args.state, incident_date, window_days=args.window_days)
+        print(f"Found {len(records)} records:")
+        for record in records:
+            print(f"  {record.get('femaDeclarationString')} - {record.get('declarationTitle')} "
+                  f"({record.get('incidentBeginDate')})")
+
+    elif args.command == "info":
+        print(f"Records: {mirror.count()}")
+        print(f"Last downloaded: {mirror.last_downloaded() or 'never'}")
+
+    mirror.close()
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
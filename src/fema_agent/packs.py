@@ -0,0 +1,183 @@
+"""
+Append-only pack files for document PDFs.
+
+A corpus stored as loose files has an `all.pdf` and a `page_N.pdf` per page
+for every document: millions of small files, slow to back up, archive and
+scan. Packed, a document's PDFs are appended to its shard's pack file
+(`packs/<ab>.pack`, shared by every UUID starting with `ab`) and located
+through the shard's offset index (`packs/<ab>.index.jsonl`):
+
+    {"doc_id": "ab12...", "name": "page_1.pdf", "offset": 1048576, "length": 51234}
+
+Packs are only ever appended to: a blob is written and flushed before its
+index line, so an interrupted append leaves unindexed bytes at the end of
+the pack and nothing else. Packing a file again appends a new copy, and the
+last index entry wins.
+
+Reads memory-map the pack and return zero-copy slices of it. Code that needs
+a path (PyPDF2, DocETL) gets a copy materialized under the system temporary
+directory, see `DeclarationStorage.get_page_path`.
+"""
+
+import json
+import mmap
+import os
+import tempfile
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fema_agent import instrument
+
+# Packed files are materialized here when a caller needs a path
+MATERIALIZE_DIR = Path(tempfile.gettempdir()) / "fema-agent-packs"
+
+class PackStore:
+    """
+    The pack files of a storage directory
+
+    Args:
+        directory: Directory holding the `.pack` and `.index.jsonl` files
+    """
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        # Shard -> (mmap, size mapped, {(doc_id, name): (offset, length)}, index size read)
+        self._shards = {}
+
+    @staticmethod
+    def shard(doc_id: str) -> str:
+        return doc_id[:2]
+
+    def pack_path(self, shard: str) -> Path:
+        return self.directory / f"{shard}.pack"
+
+    def index_path(self, shard: str) -> Path:
+        return self.directory / f"{shard}.index.jsonl"
+
+    def add(self, doc_id: str, files: Dict[str, Path]) -> int:
+        """
+        Append files to a document's shard pack
+
+        The caller must hold a lock covering the shard (see
+        `DeclarationStorage.pack_document`), so appends don't interleave.
+
+        Args:
+            doc_id: UUID of the document
+            files: Files to pack, by the name they're read back with
+
+        Returns:
+            Number of bytes appended
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        shard = self.shard(doc_id)
+        entries = []
+        with instrument.timer('pack_io'), open(self.pack_path(shard), "ab") as pack:
+            for name, path in files.items():
+                data = Path(path).read_bytes()
+                entries.append({"doc_id": doc_id, "name": name, "offset": pack.tell(), "length": len(data)})
+                pack.write(data)
+            pack.flush()
+            os.fsync(pack.fileno())
+
+        with instrument.timer('pack_io'), open(self.index_path(shard), "a") as index:
+            for entry in entries:
+                index.write(json.dumps(entry) + "\n")
+            index.flush()
+            os.fsync(index.fileno())
+        return sum(entry["length"] for entry in entries)
+
+    def _load(self, shard: str):
+        """Map a shard's pack, re-reading its index if the pack or the index has grown"""
+        pack_path = self.pack_path(shard)
+        index_path = self.index_path(shard)
+        if not pack_path.exists():
+            return None
+        size = pack_path.stat().st_size
+        # The index is written after the pack, so a read between the two sees
+        # the grown pack with the old index: both sizes key the cache
+        index_size = index_path.stat().st_size if index_path.exists() else 0
+        cached = self._shards.get(shard)
+        if cached is not None and cached[1] == size and cached[3] == index_size:
+            return cached
+        # A stale map is left to be closed once no slices of it remain
+        if size == 0 or index_size == 0:
+            return None
+
+        offsets = {}
+        with instrument.timer('pack_io'), open(index_path, "r") as index:
+            for line in index:
+                # Ignore a final line that's still being written
+                if not line.endswith("\n"):
+                    continue
+                entry = json.loads(line)
+                offsets[entry["doc_id"], entry["name"]] = (entry["offset"], entry["length"])
+        with open(pack_path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._shards[shard] = (mapped, size, offsets, index_size)
+        return self._shards[shard]
+
+    def read(self, doc_id: str, name: str) -> Optional[memoryview]:
+        """
+        A packed file's bytes, as a zero-copy slice of the mapped pack
+
+        Returns:
+            The file's bytes, or None if it isn't packed
+        """
+        loaded = self._load(self.shard(doc_id))
+        if loaded is None or (doc_id, name) not in loaded[2]:
+            return None
+        mapped, _, offsets, _ = loaded
+        offset, length = offsets[doc_id, name]
+        return memoryview(mapped)[offset: offset + length]
+
+    def names(self, doc_id: str) -> List[str]:
+        """Names of a document's packed files"""
+        loaded = self._load(self.shard(doc_id))
+        if loaded is None:
+            return []
+        return sorted(name for (packed_id, name) in loaded[2] if packed_id == doc_id)
+
+    def materialize(self, doc_id: str, name: str) -> Optional[Path]:
+        """
+        Copy a packed file out to the temporary directory, for callers that need a path
+
+        Copies are reused while they're the same size as the packed file.
+
+        Returns:
+            Path of the copy, or None if the file isn't packed
+        """
+        data = self.read(doc_id, name)
+        if data is None:
+            return None
+        path = MATERIALIZE_DIR / doc_id / name
+        if path.exists() and path.stat().st_size == len(data):
+            return path
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{name}.", suffix=".tmp")
+        with instrument.timer('pack_io'), os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        instrument.count('pack_files_materialized')
+        return path
+
+    def stats(self) -> Tuple[int, int, int]:
+        """Tuple of (pack files, packed files, bytes) across every shard"""
+        packs, files, size = 0, 0, 0
+        for pack_path in sorted(self.directory.glob("*.pack")):
+            loaded = self._load(pack_path.name[:-len(".pack")])
+            if loaded is None:
+                continue
+            packs += 1
+            files += len(loaded[2])
+            size += loaded[1]
+        return packs, files, size
+
+    def close(self):
+        for mapped, _, _, _ in self._shards.values():
+            try:
+                mapped.close()
+            except BufferError:
+                # Slices handed out by `read` are still in use
+                pass
+        self._shards = {}
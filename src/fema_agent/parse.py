@@ -5,51 +5,302 @@ import time
 import os
 import re
 
+from collections import defaultdict
 from pathlib import Path
-from typing import Any, Optional
-
-from docetl.api import Pipeline, Dataset, MapOp, ReduceOp, PipelineStep, PipelineOutput
-
-from docetl.operations.code_operations import CodeMapOperation
+from typing import TYPE_CHECKING, Any, Optional, Sequence
 
+from fema_agent import checkboxes, forms, instrument, telemetry, text_layer, validate
 from fema_agent.forms.fema_010_0_13 import FEMA_FORM_010_0_13
+from fema_agent.forms.form import Form
 from fema_agent.storage import DeclarationStorage
 
-def field_display(page: int) -> str:
+# DocETL (and litellm and pandas under it) takes seconds to import, so it's
+# only imported by the functions that build and run pipelines
+if TYPE_CHECKING:
+    from docetl.api import MapOp, ParallelMapOp
+
+# How page prompts are split into requests:
+# - page: one request per page asking for every field (the default)
+# - map: one MapOp per field group, run one after the other
+# - parallel_map: one ParallelMapOp per page, whose field groups run concurrently
+# - document: one request per document, sending its whole PDF and asking for
+#   the fields of every page at once
+SHARD_MODES = ('page', 'map', 'parallel_map', 'document')
+
+# Maximum number of short fields per field group
+FIELD_GROUP_SIZE = 6
+
+# Times a failed field group is re-run on its own
+GROUP_RETRIES = 2
+
+# Fields whose answers run to paragraphs; each gets a field group of its own
+FREE_TEXT_FIELDS = (
+    'damage_description',
+    'resource_description',
+    'ia_programs_needed_per_area',
+    'pa_programs_needed_per_area',
+)
+
+# Instructions ending every page and document prompt
+FORMAT_INSTRUCTIONS = """
+Format all dates as "YYYY-MM-DD". If no day information is available,
+format as "YYYY-MM".
+
+If the form field is empty, return the empty string. Do NOT return
+the field description in place of the empty string, when no data is available.
+"""
+
+# Ops already built, by form, pages and options (see `page_ops` and `document_op`)
+_OPS = {}
+
+def page_fields(page: int, include_checkboxes: bool = True, fields: Optional[Sequence[str]] = None,
+                form: Form = FEMA_FORM_010_0_13) -> dict:
+    """Fields of a form page, optionally only some of them or leaving out the checkbox fields"""
+    return {
+        field_name: field
+        for field_name, field in form.get_fields_for_page(page).items()
+        if (include_checkboxes or not field.is_boolean) and (fields is None or field_name in fields)
+    }
+
+def without_page_fields(documents: Sequence[dict], pages: Sequence[int],
+                        form: Form = FEMA_FORM_010_0_13) -> list[dict]:
+    """
+    Documents without the values of some form pages' fields
+
+    Values stored by an earlier parse (`--update-storage`) would pass for
+    this run's answers, so the fields being parsed start out missing, and a
+    failed request leaves them missing rather than stale.
+    """
+    fields = {name for page in pages for name in page_fields(page, form=form)}
+    return [{key: value for key, value in document.items() if key not in fields} for document in documents]
+
+def field_groups(page: int, group_size: int = FIELD_GROUP_SIZE, include_checkboxes: bool = True,
+                 form: Form = FEMA_FORM_010_0_13) -> list[list[str]]:
+    """
+    Split a page's fields into groups, each asked for in its own request.
+
+    Free-text fields get a group each, so their long answers don't slow down
+    or fail the short fields; the rest are chunked in form order.
+
+    Args:
+        page: Form page number
+        group_size: Maximum number of short fields per group
+        include_checkboxes: Whether to include the page's checkbox fields
+        form: Form the page belongs to
+
+    Returns:
+        List of field name groups
+    """
+    names = list(page_fields(page, include_checkboxes, form=form))
+    short = [name for name in names if name not in FREE_TEXT_FIELDS]
+    groups = [short[i:i + group_size] for i in range(0, len(short), group_size)]
+    return groups + [[name] for name in names if name in FREE_TEXT_FIELDS]
+
+def field_display(page: int, include_checkboxes: bool = True, fields: Optional[Sequence[str]] = None,
+                  form: Form = FEMA_FORM_010_0_13) -> str:
     fields = [
         f' - {field_name} ({field.field_number}): {field.description}'
-        for field_name, field in FEMA_FORM_010_0_13.get_fields_for_page(page).items()
+        for field_name, field in page_fields(page, include_checkboxes, fields, form).items()
     ]
     return '\n'.join(fields)
 
-def build_prompt(page: int, additional_instructions: Optional[str] = None) -> str:
+def build_prompt(page: int, additional_instructions: Optional[str] = None,
+                 include_checkboxes: bool = True, fields: Optional[Sequence[str]] = None,
+                 form: Form = FEMA_FORM_010_0_13) -> str:
     base_prompt = f"""
 Extract the following information from this FEMA form page.
 
 Here are the form field keystrings and descriptions on this
 page for you to parse:
-{field_display(page)}
+{field_display(page, include_checkboxes, fields, form)}
+""" + FORMAT_INSTRUCTIONS
+    prompt = base_prompt
+    if additional_instructions:
+        prompt += '\n\n' + additional_instructions
+    return prompt
 
-Format all dates as "YYYY-MM-DD". If no day information is available,
-format as "YYYY-MM".
+def build_document_prompt(pages: Sequence[int], additional_instructions: Optional[str] = None,
+                          include_checkboxes: bool = True, form: Form = FEMA_FORM_010_0_13) -> str:
+    """Prompt asking for the fields of several pages of a whole-document PDF"""
+    field_lists = '\n\n'.join(
+        f"Page {page}:\n{field_display(page, include_checkboxes, form=form)}" for page in pages
+        )
+    prompt = f"""
+Extract the following information from this FEMA form.
 
-If the form field is empty, return the empty string. Do NOT return
-the field description in place of the empty string, when no data is available.
-"""
-    prompt = base_prompt
+Here are the form field keystrings and descriptions on each
+page for you to parse:
+{field_lists}
+""" + FORMAT_INSTRUCTIONS
     if additional_instructions:
         prompt += '\n\n' + additional_instructions
     return prompt
 
+def _completion_kwargs(page: Optional[int], fields, api_base: Optional[str] = None, group: Optional[int] = None,
+                       span_name: str = "parse.page", form: Form = FEMA_FORM_010_0_13):
+    """litellm kwargs for a page (or whole-document) op"""
+    litellm_completion_kwargs = {"api_base": api_base} if api_base else {}
+    if telemetry.enabled():
+        # Tag each call with its page; the telemetry callback finds the
+        # document from the PDF sent (see `telemetry.register_document_file`)
+        attributes = {"fema.form": form.form_number, "fema.fields": list(fields)}
+        if page is not None:
+            attributes["fema.page"] = page
+        if group is not None:
+            attributes["fema.field_group"] = group
+        litellm_completion_kwargs["metadata"] = telemetry.litellm_metadata(span_name, **attributes)
+    return litellm_completion_kwargs
 
-def build_parse_op(page: int) -> MapOp:
+def build_parse_op(
+        page: int,
+        api_base: Optional[str] = None,
+        include_checkboxes: bool = True,
+        fields: Optional[Sequence[str]] = None,
+        group: Optional[int] = None,
+        form: Form = FEMA_FORM_010_0_13
+        ) -> "MapOp":
+    """
+    Build the op parsing a page, or one field group of it
+
+    Args:
+        page: Form page number
+        api_base: Optional endpoint to send model calls to
+        include_checkboxes: Whether to ask for the page's checkbox fields
+        fields: Only ask for these fields (default: all of the page's fields)
+        group: Index of the field group, which names the op; a group op skips
+            the documents it fails on instead of failing the pipeline
+        form: Form the page belongs to
+    """
+    from docetl.api import MapOp
+
+    fields = page_fields(page, include_checkboxes, fields, form)
+    litellm_completion_kwargs = _completion_kwargs(page, fields, api_base, group, form=form)
     op = MapOp(
-        name=f'parse_page_{page}',
+        name=f'parse_page_{page}' if group is None else f'parse_page_{page}_group_{group}',
+        type='map',
+        validate=[],
+        skip_on_error=group is not None,
+        pdf_url_key=f"page_{page}",
+        prompt=build_prompt(page, None, include_checkboxes, list(fields), form),
+        output={"schema": {field_name: field.to_schema_string() for field_name, field in fields.items()}},
+        litellm_completion_kwargs=litellm_completion_kwargs
+        )
+    return op
+
+def page_ops(form: Form, pages: Sequence[int], api_base: Optional[str] = None,
+             include_checkboxes: bool = True) -> list:
+    """
+    The ops parsing each of a form's pages, built once per form and options
+
+    Chunked and text-layer runs parse many subsets of a corpus with the same
+    pages, so the ops are reused rather than rebuilt for every pipeline.
+    """
+    ops = []
+    for page in pages:
+        key = (form.form_number, page, api_base, include_checkboxes, telemetry.enabled())
+        if key not in _OPS:
+            _OPS[key] = build_parse_op(page, api_base=api_base, include_checkboxes=include_checkboxes, form=form)
+        ops.append(_OPS[key])
+    return ops
+
+def build_document_op(pages: Sequence[int], api_base: Optional[str] = None,
+                      include_checkboxes: bool = True, form: Form = FEMA_FORM_010_0_13) -> "MapOp":
+    """
+    Build the op parsing several pages of a document in one request
+
+    The document's whole PDF (`file_path`) is sent once, with one prompt
+    listing every page's fields and a combined output schema, instead of a
+    request per page repeating the instructions.
+
+    Args:
+        pages: Form pages whose fields to ask for
+        api_base: Optional endpoint to send model calls to
+        include_checkboxes: Whether to ask for the pages' checkbox fields
+        form: Form the document is
+    """
+    from docetl.api import MapOp
+
+    fields = {
+        field_name: field
+        for page in pages
+        for field_name, field in page_fields(page, include_checkboxes, form=form).items()
+    }
+    litellm_completion_kwargs = _completion_kwargs(None, fields, api_base, span_name="parse.document", form=form)
+    return MapOp(
+        name='parse_document',
+        type='map',
+        validate=[],
+        pdf_url_key="file_path",
+        prompt=build_document_prompt(pages, None, include_checkboxes, form),
+        output={"schema": {field_name: field.to_schema_string() for field_name, field in fields.items()}},
+        litellm_completion_kwargs=litellm_completion_kwargs
+        )
+
+def document_op(form: Form, pages: Sequence[int], api_base: Optional[str] = None,
+                include_checkboxes: bool = True) -> "MapOp":
+    """The op parsing a form's pages a document at a time, built once per form and options"""
+    key = (form.form_number, 'document', tuple(pages), api_base, include_checkboxes, telemetry.enabled())
+    if key not in _OPS:
+        _OPS[key] = build_document_op(pages, api_base=api_base, include_checkboxes=include_checkboxes, form=form)
+    return _OPS[key]
+
+def build_reask_op(page: int, fields: Sequence[str], api_base: Optional[str] = None,
+                   include_checkboxes: bool = True, form: Form = FEMA_FORM_010_0_13) -> "MapOp":
+    """
+    Build an op asking again for some of a page's fields, after invalid answers
+
+    The prompt is the page's prompt followed by each document's
+    `validation_feedback`, so it shares its prefix (and any provider prompt
+    cache) with the first request; only `fields` are in the output schema.
+
+    Args:
+        page: Form page number
+        fields: The fields to ask for again
+        api_base: Optional endpoint to send model calls to
+        include_checkboxes: Whether the page's prompt listed its checkbox fields
+        form: Form the page belongs to
+    """
+    from docetl.api import MapOp
+
+    output_fields = page_fields(page, fields=fields, form=form)
+    litellm_completion_kwargs = _completion_kwargs(page, output_fields, api_base, span_name="parse.reask", form=form)
+    op = MapOp(
+        name=f'reask_page_{page}',
         type='map',
         validate=[],
+        skip_on_error=True,
         pdf_url_key=f"page_{page}",
-        prompt=build_prompt(page),
-        output={"schema": FEMA_FORM_010_0_13.get_field_schema_dict(page=page)}
+        prompt=build_prompt(page, "{{ input.validation_feedback }}", include_checkboxes, form=form),
+        output={"schema": {field_name: field.to_schema_string() for field_name, field in output_fields.items()}},
+        litellm_completion_kwargs=litellm_completion_kwargs
+        )
+    return op
+
+def build_parallel_parse_op(page: int, groups: list[list[str]], api_base: Optional[str] = None,
+                            form: Form = FEMA_FORM_010_0_13) -> "ParallelMapOp":
+    """
+    Build an op asking for each of a page's field groups in concurrent requests
+
+    Args:
+        page: Form page number
+        groups: Field groups, e.g. from `field_groups`
+        api_base: Optional endpoint to send model calls to
+        form: Form the page belongs to
+    """
+    from docetl.api import ParallelMapOp
+
+    fields = page_fields(page, fields=[name for group in groups for name in group], form=form)
+    litellm_completion_kwargs = _completion_kwargs(page, fields, api_base, form=form)
+    op = ParallelMapOp(
+        name=f'parse_page_{page}',
+        type='parallel_map',
+        pdf_url_key=f"page_{page}",
+        prompts=[
+            {"prompt": build_prompt(page, fields=group, form=form), "output_keys": group}
+            for group in groups
+        ],
+        output={"schema": {field_name: field.to_schema_string() for field_name, field in fields.items()}},
+        litellm_completion_kwargs=litellm_completion_kwargs
         )
     return op
 
@@ -88,11 +339,19 @@ def create_docetl_dataset_from_storage(storage_dir: str, temp_dir: str | None =
                 is_page_number = bool(re.match(r"\Apage_\d+\Z", key))
                 if key in ["file_path", "pages"] or is_page_number:
                     if key == "file_path" and value:
-                        metadata_copy[key] = str(storage_dir_path / value)
+                        file_path = storage_dir_path / value
+                        if not file_path.exists():
+                            # Whole-document requests send `all.pdf`, which may be packed too
+                            file_path = storage.get_document_path(doc_id).absolute()
+                        metadata_copy[key] = str(file_path)
                     elif key == "pages" and value:
                         metadata_copy[key] = [str(storage_dir_path / p) for p in value]
                     elif key.startswith("page_") and value:
-                        metadata_copy[key] = str(storage_dir_path / value)
+                        page_path = storage_dir_path / value
+                        if not page_path.exists():
+                            # Packed documents' pages are copied out of the pack
+                            page_path = storage.get_page_path(doc_id, int(key[len("page_"):])).absolute()
+                        metadata_copy[key] = str(page_path)
             
             dataset.append(metadata_copy)
         except Exception as e:
@@ -109,33 +368,33 @@ def create_docetl_dataset_from_storage(storage_dir: str, temp_dir: str | None =
         temp_file.close()
     
     # Save dataset
-    with open(dataset_path, 'w') as f:
+    with instrument.timer('json_io'), open(dataset_path, 'w') as f:
         json.dump(dataset, f, indent=2)
     
     return dataset_path, dataset
 
-def parse_dataset(
+def run_pipeline(
+        ops: list,
         dataset_path: Path,
         output_path: str,
         model: str,
         dataset_name: str = "dataset"
         ) -> list[dict[str, Any]]:
     """
-    Parse a dataset using DocETL pipeline.
-    
+    Run DocETL ops over a dataset in a single pipeline step.
+
     Args:
+        ops: DocETL operations, run in order
         dataset_path: Path to the dataset JSON file
-        output_path: Path where results will be saved
-        model: Model name to use for parsing
+        output_path: Path where DocETL writes the results
+        model: Default model for the ops
         dataset_name: Name to use for the dataset in the pipeline
-        
+
     Returns:
-        List of parsed results
+        List of results
     """
-    # Create operations for each page
-    PAGES_IN_FEMA_010_0_13 = 4
-    ops = [build_parse_op(i + 1) for i in range(PAGES_IN_FEMA_010_0_13)]
-    
+    from docetl.api import Pipeline, Dataset, PipelineStep, PipelineOutput
+
     # Define dataset
     datasets = {
         dataset_name: Dataset(type="file", path=str(dataset_path))
@@ -163,12 +422,605 @@ def parse_dataset(
         default_model=model
     )
     
-    pipeline.run()
+    if telemetry.enabled():
+        # DocETL passes no per-item metadata to litellm, so calls are matched
+        # to documents by the PDFs they send
+        with instrument.timer('json_io'), open(dataset_path) as f:
+            documents = json.load(f)
+        pdf_keys = {op.pdf_url_key for op in ops if getattr(op, 'pdf_url_key', None)}
+        for document in documents:
+            for key in pdf_keys:
+                if document.get(key):
+                    telemetry.register_document_file(document[key], document['uuid'])
+
+    # DocETL writes its own output, so the pipeline's file I/O is charged to the LLM wait
+    with instrument.timer('llm_wait'):
+        pipeline.run()
     
     # Load and return results
-    with open(output_path) as f:
+    with instrument.timer('json_io'), open(output_path) as f:
         return json.load(f)
 
+def parse_dataset(
+        dataset_path: Path,
+        output_path: str,
+        model: str,
+        dataset_name: str = "dataset",
+        api_base: Optional[str] = None,
+        pages: Optional[Sequence[int]] = None,
+        use_text_layer: bool = False,
+        min_confidence: float = text_layer.MIN_CONFIDENCE,
+        checkbox_detection: bool = False,
+        shard_mode: str = 'page',
+        group_size: int = FIELD_GROUP_SIZE,
+        group_retries: int = GROUP_RETRIES,
+        reasks: int = validate.REASKS,
+        form: Optional[Form] = None,
+        escalate_model: Optional[str] = None
+        ) -> list[dict[str, Any]]:
+    """
+    Parse a dataset using DocETL pipeline.
+
+    Every document is parsed with the ops of its own form (see
+    `forms.document_form`). A DocETL op applies to every document in its
+    dataset, so a dataset mixing forms is split by form and each part runs
+    its own pipelines; the results are merged back in dataset order.
+    Values of the parsed pages' fields already in the dataset are dropped
+    first (see `without_page_fields`).
+    
+    Args:
+        dataset_path: Path to the dataset JSON file
+        output_path: Path where results will be saved
+        model: Model name to use for parsing (any litellm model string)
+        dataset_name: Name to use for the dataset in the pipeline
+        api_base: Optional endpoint to send model calls to, e.g. a local
+            OpenAI-compatible server such as `fema_agent.mock_llm`
+        pages: Form pages to parse (default: all of them)
+        use_text_layer: Read pages from their AcroForm or text layer first,
+            and only send the pages that can't be read confidently to the model
+        min_confidence: Minimum confidence for every field on a page for the
+            text layer's values to be used (only with `use_text_layer`)
+        checkbox_detection: Read checkbox fields from the page images with
+            `checkboxes.read_checkboxes` instead of the page prompts; only
+            boxes that can't be read confidently are sent to the model, as
+            small cropped requests
+        shard_mode: One of `SHARD_MODES`: a request per page, per field
+            group (see `parse_field_groups`), or per document
+        group_size: Maximum number of short fields per field group
+        group_retries: Times a failed field group is re-run on its own
+        reasks: Times the fields that fail validation are re-requested on
+            their own (see `reask_invalid_fields`); 0 only records the errors
+        form: Form every document in the dataset is (default: read from each
+            document's `form_number`)
+        escalate_model: Stronger model to re-parse the fields `model` answered
+            with low confidence (see `escalate_low_confidence`)
+        
+    Returns:
+        List of parsed results
+    """
+    if shard_mode not in SHARD_MODES:
+        raise ValueError(f"Unknown shard mode {shard_mode!r}! Allowable options: {SHARD_MODES}")
+    options = dict(
+        api_base=api_base, pages=pages, use_text_layer=use_text_layer,
+        min_confidence=min_confidence, checkbox_detection=checkbox_detection,
+        shard_mode=shard_mode, group_size=group_size,
+        group_retries=group_retries, reasks=reasks, escalate_model=escalate_model
+        )
+
+    with instrument.timer('json_io'), open(dataset_path) as f:
+        dataset = json.load(f)
+    if form is None:
+        by_form = defaultdict(list)
+        for document in dataset:
+            by_form[forms.document_form(document).form_number].append(document)
+        if len(by_form) <= 1:
+            form = forms.get_form(next(iter(by_form), forms.DEFAULT_FORM_NUMBER))
+        else:
+            return parse_forms_separately(dataset, by_form, output_path, model, dataset_name, **options)
+
+    if use_text_layer:
+        return parse_dataset_with_text_layer(
+            dataset_path, output_path, model, dataset_name=dataset_name,
+            api_base=api_base, min_confidence=min_confidence,
+            checkbox_detection=checkbox_detection, shard_mode=shard_mode,
+            group_size=group_size, group_retries=group_retries, reasks=reasks,
+            form=form, escalate_model=escalate_model
+            )
+
+    # Create operations for each page
+    if pages is None:
+        pages = form.pages
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        stripped = without_page_fields(dataset, pages, form)
+        if stripped != dataset:
+            dataset_path = Path(temp_dir) / f"{dataset_name}_input.json"
+            with instrument.timer('json_io'), open(dataset_path, 'w') as f:
+                json.dump(stripped, f)
+
+        if shard_mode == 'page':
+            ops = page_ops(form, pages, api_base=api_base, include_checkboxes=not checkbox_detection)
+            results = run_pipeline(ops, dataset_path, output_path, model, dataset_name)
+        elif shard_mode == 'document':
+            ops = [document_op(form, pages, api_base=api_base, include_checkboxes=not checkbox_detection)]
+            results = run_pipeline(ops, dataset_path, output_path, model, dataset_name)
+        else:
+            results = parse_field_groups(
+                dataset_path, output_path, model, pages, dataset_name=dataset_name,
+                api_base=api_base, include_checkboxes=not checkbox_detection,
+                parallel=shard_mode == 'parallel_map', group_size=group_size,
+                group_retries=group_retries, form=form
+                )
+
+    if checkbox_detection:
+        add_checkbox_readings(results, pages, model, api_base=api_base, form=form)
+    reask_invalid_fields(
+        results, pages, model, dataset_name=dataset_name, api_base=api_base,
+        include_checkboxes=not checkbox_detection, reasks=reasks, form=form
+        )
+    if escalate_model:
+        escalate_low_confidence(
+            results, pages, escalate_model, dataset_name=dataset_name, api_base=api_base,
+            include_checkboxes=not checkbox_detection, form=form
+            )
+        # Record what's still invalid after the stronger model's answers
+        reask_invalid_fields(
+            results, pages, escalate_model, dataset_name=dataset_name, api_base=api_base,
+            include_checkboxes=not checkbox_detection, reasks=0, form=form
+            )
+    with instrument.timer('json_io'), open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+def parse_forms_separately(
+        dataset: list[dict[str, Any]],
+        by_form: dict[str, list[dict[str, Any]]],
+        output_path: str,
+        model: str,
+        dataset_name: str = "dataset",
+        **options
+        ) -> list[dict[str, Any]]:
+    """
+    Parse a dataset mixing forms, each form's documents with that form's ops
+
+    Args:
+        dataset: Documents of the dataset
+        by_form: The same documents, by form number
+        output_path: Path where the merged results will be saved
+        model: Model name to use for parsing
+        dataset_name: Name prefix for each form's dataset
+        options: Other `parse_dataset` arguments, applied to every form
+
+    Returns:
+        List of parsed results, in dataset order
+    """
+    form_results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for form_number, documents in by_form.items():
+            form = forms.get_form(form_number)
+            form_name = f"{dataset_name}_{re.sub(r'[^A-Za-z0-9]+', '_', form_number)}"
+            form_path = Path(temp_dir) / f"{form_name}.json"
+            with instrument.timer('json_io'), open(form_path, 'w') as f:
+                json.dump(documents, f)
+
+            print(f"Parsing {len(documents)} documents of form {form_number}")
+            for result in parse_dataset(
+                    form_path, str(Path(temp_dir) / f"{form_name}_results.json"), model,
+                    dataset_name=form_name, form=form, **options
+                    ):
+                form_results[result['uuid']] = result
+
+    results = [form_results[document['uuid']] for document in dataset if document['uuid'] in form_results]
+    with instrument.timer('json_io'), open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+def parse_field_groups(
+        dataset_path: Path,
+        output_path: str,
+        model: str,
+        pages: Sequence[int],
+        dataset_name: str = "dataset",
+        api_base: Optional[str] = None,
+        include_checkboxes: bool = True,
+        parallel: bool = False,
+        group_size: int = FIELD_GROUP_SIZE,
+        group_retries: int = GROUP_RETRIES,
+        form: Form = FEMA_FORM_010_0_13
+        ) -> list[dict[str, Any]]:
+    """
+    Parse a dataset with each page's fields split into groups, a request each.
+
+    The groups (see `field_groups`) run either as one MapOp each, or, with
+    `parallel`, as one ParallelMapOp per page whose groups are requested
+    concurrently; their answers are merged per document. A group whose
+    fields are missing from a document's result afterwards, because its
+    request failed, is re-run on its own for just those documents, rather
+    than the whole page. (DocETL fails a ParallelMapOp as a whole when one
+    of its requests fails, so there every group of that page is re-run.)
+    Values of the parsed fields already in the dataset, from an earlier
+    `--update-storage`, are dropped first, so a failed group leaves its
+    fields missing rather than stale.
+
+    Args:
+        dataset_path: Path to the dataset JSON file
+        output_path: Path where results will be saved
+        model: Model name to use for parsing
+        pages: Form pages to parse
+        dataset_name: Name to use for the dataset in the pipelines
+        api_base: Optional endpoint to send model calls to
+        include_checkboxes: Whether to ask for the pages' checkbox fields
+        parallel: Request each page's groups concurrently
+        group_size: Maximum number of short fields per field group
+        group_retries: Times a failed field group is re-run on its own
+        form: Form the documents are
+
+    Returns:
+        List of parsed results, in dataset order
+    """
+    with instrument.timer('json_io'), open(dataset_path) as f:
+        dataset = json.load(f)
+
+    groups = {page: field_groups(page, group_size, include_checkboxes, form) for page in pages}
+    # Values stored by an earlier parse would pass for this run's answers, so
+    # the fields being parsed start out missing
+    parsed = {name for page_groups in groups.values() for fields in page_groups for name in fields}
+    results = [{key: value for key, value in document.items() if key not in parsed} for document in dataset]
+
+    def merge(outputs, fields):
+        outputs = {result['uuid']: result for result in outputs}
+        for result in results:
+            answer = outputs.get(result['uuid'], {})
+            result.update({name: answer[name] for name in fields if name in answer})
+
+    # Each op runs in its own pipeline, so a document dropped by one op
+    # (DocETL skips items an op fails on) still reaches the others
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for page, page_groups in groups.items():
+            if parallel:
+                ops = [(build_parallel_parse_op(page, page_groups, api_base=api_base, form=form),
+                        [name for fields in page_groups for name in fields])]
+            else:
+                ops = [
+                    (build_parse_op(page, api_base=api_base, include_checkboxes=include_checkboxes,
+                                    fields=fields, group=i, form=form), fields)
+                    for i, fields in enumerate(page_groups)
+                ]
+            for op, fields in ops:
+                try:
+                    outputs = run_pipeline(
+                        [op], dataset_path, str(Path(temp_dir) / f"{op.name}.json"), model,
+                        dataset_name=f"{dataset_name}_{op.name}"
+                        )
+                except Exception as e:
+                    # A parallel_map op fails as a whole; the retries below re-run its groups one by one
+                    print(f"{op.name} failed ({type(e).__name__}: {e}); its field groups will be retried")
+                    continue
+                merge(outputs, fields)
+
+        for attempt in range(group_retries):
+            failed = [
+                (page, i, fields, [result for result in results if any(name not in result for name in fields)])
+                for page, page_groups in groups.items()
+                for i, fields in enumerate(page_groups)
+            ]
+            failed = [group for group in failed if group[3]]
+            if not failed:
+                break
+
+            for page, i, fields, documents in failed:
+                print(f"Retrying page {page} field group {i} ({', '.join(fields)}) "
+                      f"for {len(documents)} documents ({attempt + 1}/{group_retries})")
+                instrument.count('field_group_retries', len(documents))
+                retry_path = Path(temp_dir) / f"{dataset_name}_page_{page}_group_{i}_retry.json"
+                with instrument.timer('json_io'), open(retry_path, 'w') as f:
+                    json.dump(documents, f)
+                op = build_parse_op(page, api_base=api_base, include_checkboxes=include_checkboxes,
+                                    fields=fields, group=i, form=form)
+                try:
+                    outputs = run_pipeline(
+                        [op], retry_path, str(retry_path.with_suffix('.results.json')), model,
+                        dataset_name=f"{dataset_name}_{op.name}_retry"
+                        )
+                except Exception as e:
+                    print(f"Retry of page {page} field group {i} failed: {e}")
+                    continue
+                merge(outputs, fields)
+
+    with instrument.timer('json_io'), open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+def reask_invalid_fields(
+        results: list[dict[str, Any]],
+        pages: Sequence[int],
+        model: str,
+        dataset_name: str = "dataset",
+        api_base: Optional[str] = None,
+        include_checkboxes: bool = True,
+        reasks: int = validate.REASKS,
+        form: Form = FEMA_FORM_010_0_13
+        ) -> None:
+    """
+    Validate parsed results and re-request only their invalid fields.
+
+    Each result's page values are checked against their field metadata with
+    `validate.validate_fields` and converted in place where possible (e.g.
+    "Jan 12, 2018" to "2018-01-12"). Documents are grouped by page and by the
+    fields they got wrong, and each group is asked again for just those
+    fields, told what was wrong with its answers, up to `reasks` times.
+    Fields still invalid afterwards are recorded under `validation_errors`.
+
+    Args:
+        results: Parsed results with absolute `page_N` paths, updated in place
+        pages: Form pages that were parsed
+        model: Model to re-ask
+        dataset_name: Name prefix for the re-ask datasets
+        api_base: Optional endpoint to send model calls to
+        include_checkboxes: Whether the pages' checkbox fields were parsed
+        reasks: Times to re-request the invalid fields
+        form: Form the results are
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for attempt in range(reasks + 1):
+            errors_by_document = {}
+            invalid = defaultdict(list)  # (page, invalid fields) -> [(result, errors)]
+            with instrument.timer('postprocess'):
+                for result in results:
+                    document_errors = errors_by_document[result['uuid']] = {}
+                    for page in pages:
+                        fields = page_fields(page, include_checkboxes, form=form)
+                        values = {name: result[name] for name in fields if name in result}
+                        checked, errors = validate.validate_fields(values, fields)
+                        result.update(checked)
+                        if errors:
+                            document_errors.update(errors)
+                            invalid[(page, tuple(errors))].append((result, errors))
+            if not invalid or attempt == reasks:
+                break
+
+            for i, ((page, fields), items) in enumerate(invalid.items()):
+                print(f"Re-asking for {', '.join(fields)} on page {page} of {len(items)} documents "
+                      f"({attempt + 1}/{reasks})")
+                instrument.count('fields_reasked', len(fields) * len(items))
+                reask_path = Path(temp_dir) / f"{dataset_name}_reask_{attempt}_{i}.json"
+                documents = [
+                    {**result, 'validation_feedback': validate.reask_instructions(errors, result)}
+                    for result, errors in items
+                ]
+                with instrument.timer('json_io'), open(reask_path, 'w') as f:
+                    json.dump(documents, f)
+                op = build_reask_op(page, fields, api_base=api_base, include_checkboxes=include_checkboxes,
+                                    form=form)
+                try:
+                    outputs = run_pipeline(
+                        [op], reask_path, str(reask_path.with_suffix('.results.json')), model,
+                        dataset_name=f"{dataset_name}_reask_{attempt}_{i}"
+                        )
+                except Exception as e:
+                    print(f"Re-asking for {', '.join(fields)} on page {page} failed: {e}")
+                    continue
+                outputs = {output['uuid']: output for output in outputs}
+                for result, _ in items:
+                    answer = outputs.get(result['uuid'], {})
+                    result.update({name: answer[name] for name in fields if name in answer})
+
+    for result in results:
+        result['validation_errors'] = errors_by_document.get(result['uuid'], {})
+
+def escalate_low_confidence(
+        results: list[dict[str, Any]],
+        pages: Sequence[int],
+        model: str,
+        dataset_name: str = "dataset",
+        api_base: Optional[str] = None,
+        include_checkboxes: bool = True,
+        form: Form = FEMA_FORM_010_0_13
+        ) -> None:
+    """
+    Re-parse the fields of parsed results that are probably wrong with a stronger model.
+
+    Each result's page values are scored with `validate.low_confidence_fields`
+    (invalid, missing, or the field's label echoed back). Documents are
+    grouped by page and by the fields flagged, and each group asks `model`
+    for just those fields, so the stronger model only sees the pages and
+    fields the cheaper one got wrong. A failed request keeps the earlier
+    answers. Each result records the fields sent to `model` under
+    `escalated_fields`.
+
+    Args:
+        results: Parsed results with absolute `page_N` paths, updated in place
+        pages: Form pages that were parsed
+        model: Stronger model to re-parse the flagged fields with
+        dataset_name: Name prefix for the escalation datasets
+        api_base: Optional endpoint to send model calls to
+        include_checkboxes: Whether the pages' checkbox fields were parsed
+        form: Form the results are
+    """
+    flagged = defaultdict(list)  # (page, flagged fields) -> results
+    with instrument.timer('postprocess'):
+        for result in results:
+            result.setdefault('escalated_fields', [])
+            for page in pages:
+                fields = page_fields(page, include_checkboxes, form=form)
+                values = {name: result[name] for name in fields if name in result}
+                low_confidence = validate.low_confidence_fields(values, fields)
+                if low_confidence:
+                    flagged[(page, tuple(low_confidence))].append(result)
+
+    n_fields = sum(len(fields) * len(items) for (_, fields), items in flagged.items())
+    n_total = len(results) * sum(len(page_fields(page, include_checkboxes, form=form)) for page in pages)
+    print(f"Escalating {n_fields}/{n_total} low-confidence fields to {model}")
+    instrument.count('fields_escalated', n_fields)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i, ((page, fields), items) in enumerate(flagged.items()):
+            escalate_path = Path(temp_dir) / f"{dataset_name}_escalate_{i}.json"
+            with instrument.timer('json_io'), open(escalate_path, 'w') as f:
+                json.dump(items, f)
+            op = build_parse_op(page, api_base=api_base, include_checkboxes=include_checkboxes,
+                                fields=fields, group=i, form=form)
+            try:
+                outputs = run_pipeline(
+                    [op], escalate_path, str(escalate_path.with_suffix('.results.json')), model,
+                    dataset_name=f"{dataset_name}_escalate_{i}"
+                    )
+            except Exception as e:
+                print(f"Escalating {', '.join(fields)} on page {page} failed: {e}")
+                continue
+            outputs = {output['uuid']: output for output in outputs}
+            for result in items:
+                answer = outputs.get(result['uuid'])
+                if answer is None:
+                    continue
+                result.update({name: answer[name] for name in fields if name in answer})
+                result['escalated_fields'] += [name for name in fields if name in answer]
+
+def add_checkbox_readings(
+        results: list[dict[str, Any]],
+        pages: Sequence[int],
+        model: str,
+        api_base: Optional[str] = None,
+        form: Form = FEMA_FORM_010_0_13
+        ) -> None:
+    """
+    Fill in the checkbox fields of parsed results from their page images.
+
+    Each result records the checkbox fields the model had to answer under
+    `checkbox_model_fields`.
+
+    Args:
+        results: Parsed results with absolute `page_N` paths, updated in place
+        pages: Form pages whose checkbox fields to read
+        model: Model for boxes that can't be read confidently
+        api_base: Optional endpoint to send model calls to
+        form: Form the results are
+    """
+    for result in results:
+        model_fields = []
+        for page in pages:
+            page_path = result.get(f"page_{page}")
+            if not page_path:
+                continue
+            readings = checkboxes.read_checkboxes(page_path, page, form, model=model, api_base=api_base)
+            for field_name, reading in readings.items():
+                result[field_name] = reading.checked
+                if reading.source == 'model':
+                    model_fields.append(field_name)
+        result['checkbox_model_fields'] = result.get('checkbox_model_fields', []) + model_fields
+
+def parse_dataset_with_text_layer(
+        dataset_path: Path,
+        output_path: str,
+        model: str,
+        dataset_name: str = "dataset",
+        api_base: Optional[str] = None,
+        min_confidence: float = text_layer.MIN_CONFIDENCE,
+        checkbox_detection: bool = False,
+        shard_mode: str = 'page',
+        group_size: int = FIELD_GROUP_SIZE,
+        group_retries: int = GROUP_RETRIES,
+        reasks: int = validate.REASKS,
+        form: Form = FEMA_FORM_010_0_13,
+        escalate_model: Optional[str] = None
+        ) -> list[dict[str, Any]]:
+    """
+    Parse a dataset, reading pages from their text layer where possible.
+
+    Every page is first read locally with `text_layer.extract_page`. Pages
+    whose fields are all read with at least `min_confidence` skip the model;
+    documents are grouped by the pages they still need, and each group gets a
+    DocETL pipeline with only those pages' operations. Each result records
+    the pages read locally under `text_layer_pages`, and every result's
+    values, local or not, are validated as in `reask_invalid_fields`.
+
+    Args:
+        dataset_path: Path to the dataset JSON file
+        output_path: Path where results will be saved
+        model: Model name to use for the remaining pages
+        dataset_name: Name to use for the dataset in the pipelines
+        api_base: Optional endpoint to send model calls to
+        min_confidence: Minimum confidence for every field on a page
+        checkbox_detection: Read the remaining pages' checkbox fields from
+            their page images (see `parse_dataset`)
+        shard_mode: How the remaining pages' prompts are split into requests
+        group_size: Maximum number of short fields per field group
+        group_retries: Times a failed field group is re-run on its own
+        reasks: Times the fields that fail validation are re-requested
+        form: Form the documents are
+        escalate_model: Stronger model for the remaining pages' low-confidence
+            fields
+
+    Returns:
+        List of parsed results, in dataset order
+    """
+    with instrument.timer('json_io'), open(dataset_path) as f:
+        dataset = json.load(f)
+
+    all_pages = form.pages
+    local_values = {}
+    pending = defaultdict(list)  # Pages still to parse -> documents
+    for document in dataset:
+        with instrument.timer('text_layer'):
+            extractions = text_layer.extract_document(document, form)
+        resolved = [page for page in all_pages if extractions[page].resolved(min_confidence)]
+
+        values = {'text_layer_pages': resolved}
+        for page in resolved:
+            values.update(extractions[page].values)
+        local_values[document['uuid']] = values
+
+        remaining = tuple(page for page in all_pages if page not in resolved)
+        if remaining:
+            pending[remaining].append(document)
+
+    n_local = sum(len(values['text_layer_pages']) for values in local_values.values())
+    n_pages = len(dataset) * len(all_pages)
+    instrument.count('pages_text_layer', n_local)
+    instrument.count('pages_llm', n_pages - n_local)
+    print(f"Read {n_local}/{n_pages} pages from the text layer; "
+          f"{sum(len(docs) for docs in pending.values())} documents still need the model")
+
+    model_results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i, (pages, documents) in enumerate(pending.items()):
+            group_path = Path(temp_dir) / f"{dataset_name}_group_{i}.json"
+            with instrument.timer('json_io'), open(group_path, 'w') as f:
+                json.dump(documents, f)
+
+            print(f"Parsing pages {', '.join(map(str, pages))} of {len(documents)} documents with {model}")
+            group_results = parse_dataset(
+                group_path,
+                str(Path(temp_dir) / f"{dataset_name}_group_{i}_results.json"),
+                model,
+                dataset_name=f"{dataset_name}_group_{i}",
+                api_base=api_base,
+                pages=pages,
+                checkbox_detection=checkbox_detection,
+                shard_mode=shard_mode,
+                group_size=group_size,
+                group_retries=group_retries,
+                reasks=reasks,
+                form=form,
+                escalate_model=escalate_model
+                )
+            for result in group_results:
+                model_results[result['uuid']] = result
+
+    results = [
+        {**document, **model_results.get(document['uuid'], {}), **local_values[document['uuid']]}
+        for document in without_page_fields(dataset, all_pages, form)
+    ]
+    # Validate the local values too; no model is asked again, so every result
+    # gets the `validation_errors` of all its pages
+    reask_invalid_fields(
+        results, all_pages, model, dataset_name=dataset_name, api_base=api_base,
+        include_checkboxes=not checkbox_detection, reasks=0, form=form
+        )
+    with instrument.timer('json_io'), open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
 def chunk_dataset(data_path: Path, chunk_size: int) -> list[Path]:
     """
     Create temporary dataset files by chunking a larger dataset into smaller pieces.
@@ -181,7 +1033,7 @@ def chunk_dataset(data_path: Path, chunk_size: int) -> list[Path]:
         List of paths to the temporary chunked dataset files
     """
     # Load the original dataset
-    with open(data_path) as f:
+    with instrument.timer('json_io'), open(data_path) as f:
         data = json.load(f)
     
     # If dataset is smaller than chunk_size, just return the original path
@@ -208,7 +1060,15 @@ def process_dataset_with_rate_limit(
         outpath: str,
         model: str,
         chunk_size: int = 8,
-        sleep_time: int = 60
+        sleep_time: int = 60,
+        api_base: Optional[str] = None,
+        use_text_layer: bool = False,
+        checkbox_detection: bool = False,
+        shard_mode: str = 'page',
+        group_size: int = FIELD_GROUP_SIZE,
+        group_retries: int = GROUP_RETRIES,
+        reasks: int = validate.REASKS,
+        escalate_model: Optional[str] = None
         ):
     """
     Process a dataset in chunks with pauses between chunks to avoid rate limits.
@@ -219,6 +1079,14 @@ def process_dataset_with_rate_limit(
         model: Model to use for parsing
         chunk_size: Maximum number of items to process in one batch
         sleep_time: Seconds to sleep between batches
+        api_base: Optional endpoint to send model calls to
+        use_text_layer: Skip the model for pages readable from their text layer
+        checkbox_detection: Read checkbox fields from the page images
+        shard_mode: Request each page (default) or each field group of it
+        group_size: Maximum number of short fields per field group
+        group_retries: Times a failed field group is re-run on its own
+        reasks: Times the fields that fail validation are re-requested
+        escalate_model: Stronger model to re-parse low-confidence fields with
     """
     # Split dataset into chunks
     chunk_paths = chunk_dataset(dataset_path, chunk_size)
@@ -238,7 +1106,15 @@ def process_dataset_with_rate_limit(
             dataset_path=chunk_path,
             output_path=temp_outpath,
             model=model,
-            dataset_name=f"chunk_{i}"
+            dataset_name=f"chunk_{i}",
+            api_base=api_base,
+            use_text_layer=use_text_layer,
+            checkbox_detection=checkbox_detection,
+            shard_mode=shard_mode,
+            group_size=group_size,
+            group_retries=group_retries,
+            reasks=reasks,
+            escalate_model=escalate_model
         )
         
         # Add results to combined list
@@ -247,10 +1123,11 @@ def process_dataset_with_rate_limit(
         # Sleep between chunks (except after the last one)
         if i < len(chunk_paths) - 1:
             print(f"Sleeping for {sleep_time} seconds to avoid rate limits...")
-            time.sleep(sleep_time)
+            with instrument.timer('rate_limit_sleep'):
+                time.sleep(sleep_time)
     
     # Save combined results to the final output path
-    with open(outpath, 'w') as f:
+    with instrument.timer('json_io'), open(outpath, 'w') as f:
         json.dump(all_results, f, indent=2)
     
     print(f"All chunks processed successfully. Combined results saved to {outpath}")
@@ -271,7 +1148,17 @@ def parse_storage_directory(
         temp_dir: str | None = None,
         avoid_rate_limit: bool = False,
         chunk_size: int = 8,
-        sleep_time: int = 60
+        sleep_time: int = 60,
+        api_base: str | None = None,
+        use_text_layer: bool = False,
+        checkbox_detection: bool = False,
+        shard_mode: str = 'page',
+        group_size: int = FIELD_GROUP_SIZE,
+        group_retries: int = GROUP_RETRIES,
+        reasks: int = validate.REASKS,
+        batch_backend=None,
+        poll_interval: Optional[float] = None,
+        escalate_model: Optional[str] = None
         ):
     """
     Parse all declarations in a storage directory.
@@ -284,25 +1171,69 @@ def parse_storage_directory(
         avoid_rate_limit: Whether to process in batches with delays
         chunk_size: Number of documents per batch if avoiding rate limits
         sleep_time: Seconds to sleep between batches
+        api_base: Optional endpoint to send model calls to
+        use_text_layer: Skip the model for pages readable from their text layer
+        checkbox_detection: Read checkbox fields from the page images
+        shard_mode: Request each page (default) or each field group of it
+        group_size: Maximum number of short fields per field group
+        group_retries: Times a failed field group is re-run on its own
+        reasks: Times the fields that fail validation are re-requested
+        batch_backend: Send the page requests as one job to this batch
+            backend (see `batch.parse_dataset_batch`) instead of calling the
+            model synchronously
+        poll_interval: Seconds between status checks of a batch job
+        escalate_model: Stronger model to re-parse the fields `model` answered
+            with low confidence
     """
     print(f"Creating DocETL dataset from storage directory: {storage_dir}")
     dataset_path, documents = create_docetl_dataset_from_storage(storage_dir, temp_dir)
     
     print(f"Created dataset with {len(documents)} documents at {dataset_path}")
     
-    if avoid_rate_limit:
+    if batch_backend is not None:
+        from fema_agent import batch
+
+        # A batch job isn't subject to the synchronous rate limits, so it isn't chunked
+        batch.parse_dataset_batch(
+            dataset_path=dataset_path,
+            output_path=output_path,
+            model=model,
+            backend=batch_backend,
+            api_base=api_base,
+            checkbox_detection=checkbox_detection,
+            reasks=reasks,
+            poll_interval=poll_interval if poll_interval is not None else batch.POLL_INTERVAL,
+            escalate_model=escalate_model
+        )
+    elif avoid_rate_limit:
         process_dataset_with_rate_limit(
             dataset_path=dataset_path,
             outpath=output_path,
             model=model,
             chunk_size=chunk_size,
-            sleep_time=sleep_time
+            sleep_time=sleep_time,
+            api_base=api_base,
+            use_text_layer=use_text_layer,
+            checkbox_detection=checkbox_detection,
+            shard_mode=shard_mode,
+            group_size=group_size,
+            group_retries=group_retries,
+            reasks=reasks,
+            escalate_model=escalate_model
         )
     else:
         parse_dataset(
             dataset_path=dataset_path,
             output_path=output_path,
-            model=model
+            model=model,
+            api_base=api_base,
+            use_text_layer=use_text_layer,
+            checkbox_detection=checkbox_detection,
+            shard_mode=shard_mode,
+            group_size=group_size,
+            group_retries=group_retries,
+            reasks=reasks,
+            escalate_model=escalate_model
         )
     
     print(f"Processing complete. Results saved to {output_path}")
@@ -318,6 +1249,8 @@ def parse_storage_directory(
 def update_storage_with_results(storage_dir: str, results_path: str, dry_run: bool = False):
     """
     Update the storage system with parsed results.
+
+    Only each document's form fields are written.
     
     Args:
         storage_dir: Path to the storage directory
@@ -329,50 +1262,44 @@ def update_storage_with_results(storage_dir: str, results_path: str, dry_run: bo
     """
     # Initialize storage
     storage = DeclarationStorage(storage_dir)
+    if not dry_run:
+        print(f"Recording changes as run {storage.run_id} (undo with `fema-agent storage rollback {storage.run_id}`)")
     
     # Load results
-    with open(results_path, 'r') as f:
+    with instrument.timer('json_io'), open(results_path, 'r') as f:
         results = json.load(f)
     
     updated_count = 0
     
-    # Update each document
-    for doc_data in results:
-        doc_id = doc_data.get("uuid")
-        if not doc_id:
-            print(f"Warning: Document missing UUID, skipping")
-            continue
-        
-        # Create metadata dictionary excluding storage-specific fields
-        metadata = {}
-        excluded_fields = ["uuid", "file_path", "original_filename", "page_count", 
-                          "import_date", "pages"]
-        
-        # Also exclude page_N keys
-        page_prefixes = ["page_"]
-        
-        for key, value in doc_data.items():
-            # Skip excluded fields and page paths
-            if key in excluded_fields or any(key.startswith(prefix) for prefix in page_prefixes):
+    # Update each document; the metadata writes inside are charged to json_io
+    with instrument.timer('postprocess'):
+        for doc_data in results:
+            doc_id = doc_data.get("uuid")
+            if not doc_id:
+                print(f"Warning: Document missing UUID, skipping")
                 continue
-            
-            metadata[key] = value
         
-        if dry_run:
-            print(f"Would update document {doc_id} with {len(metadata)} metadata fields")
-        else:
-            try:
-                # Update the document metadata
-                storage.update_document_metadata(doc_id, metadata)
-                updated_count += 1
-                print(f"Updated document {doc_id} with {len(metadata)} metadata fields")
-            except ValueError as e:
-                print(f"Error updating document {doc_id}: {str(e)}")
+            # Only the form's fields: storage keys, page paths, other metadata
+            # carried through the dataset and run bookkeeping
+            # (`validation_errors`, `escalated_fields`, ...) aren't parse results
+            form_fields = forms.document_form(doc_data).fields
+            metadata = {key: value for key, value in doc_data.items() if key in form_fields}
+        
+            if dry_run:
+                print(f"Would update document {doc_id} with {len(metadata)} metadata fields")
+            else:
+                try:
+                    # Update the document metadata
+                    storage.update_document_metadata(doc_id, metadata)
+                    updated_count += 1
+                    print(f"Updated document {doc_id} with {len(metadata)} metadata fields")
+                except ValueError as e:
+                    print(f"Error updating document {doc_id}: {str(e)}")
     
     return updated_count
 
 
-def main():
+def main(argv=None):
     # Set up argument parser
     parser = argparse.ArgumentParser(
         description='Parse FEMA disaster declaration forms using DocETL'
@@ -384,16 +1311,52 @@ def main():
     parser.add_argument('--outpath', type=str, required=True,
                         help='Path where output JSON will be saved')
     parser.add_argument('--model', type=str, default='gemini-2.0-flash-lite',
-                        choices=['gemini-2.0-flash', 'gemini-2.0-flash-lite', 'gemini-2.5-flash'],
-                        help='Model to use for parsing')
+                        help=('Model to use for parsing: gemini-2.0-flash, gemini-2.0-flash-lite, '
+                              'gemini-2.5-flash, or any litellm model string (e.g. openai/mock)'))
+    parser.add_argument('--api-base', type=str, default=None,
+                        help='Send model calls to this endpoint instead of the provider default '
+                             '(e.g. http://127.0.0.1:8765/v1 for fema_agent.mock_llm)')
+    parser.add_argument('--telemetry', type=str, default=None,
+                        help='Append a span per LLM call (tokens, latency, retries, cost) to this JSONL file')
     parser.add_argument('--avoid-rate-limit', action='store_true',
                         help='Process in smaller batches with pauses to avoid rate limits')
+    parser.add_argument('--text-layer', action='store_true',
+                        help='Read pages from their AcroForm fields or text layer where every field is '
+                             'found confidently, and only send the other pages to the model')
+    parser.add_argument('--checkboxes', action='store_true',
+                        help='Read checkbox fields from the page images and only ask the model about '
+                             'boxes that can\'t be read confidently')
+    parser.add_argument('--shard', type=str, choices=SHARD_MODES, default='page',
+                        help='Request each page\'s fields at once (page), split them into field groups '
+                             'run as separate ops (map) or as concurrent requests per page (parallel_map), '
+                             'or request every page of a document at once (document)')
+    parser.add_argument('--field-group-size', type=int, default=FIELD_GROUP_SIZE,
+                        help='Maximum number of short fields per field group (with --shard map or parallel_map)')
+    parser.add_argument('--reasks', type=int, default=validate.REASKS,
+                        help='Times to re-request only the fields whose answers fail validation '
+                             '(wrong type, unknown option, unreadable date); 0 only records the errors')
+    parser.add_argument('--escalate-model', type=str, default=None,
+                        help='Re-parse the fields --model answers with low confidence (invalid, missing, '
+                             'or echoing the field\'s label) with this stronger model, e.g. gemini-2.5-flash')
+    parser.add_argument('--batch', action='store_true',
+                        help='Submit every page request as one job to the provider\'s batch API and wait '
+                             'for it (cheaper, answered within 24 hours); rerun with the same --outpath to '
+                             'resume waiting on a job')
+    parser.add_argument('--batch-dir', type=str, default=None,
+                        help='Run batch jobs with the local file-based stand-in in this directory, '
+                             'answered like fema_agent.mock_llm (implies --batch)')
+    parser.add_argument('--poll-interval', type=float, default=None,
+                        help='Seconds between status checks of a batch job (default: 60)')
     parser.add_argument('--update-storage', action='store_true',
                         help='Update storage with parsed results')
     parser.add_argument('--dry-run', action='store_true',
                         help='Don\'t actually update storage (only with --update-storage)')
+    instrument.add_profile_arguments(parser)
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if (args.batch or args.batch_dir) and (args.text_layer or args.shard != 'page'):
+        parser.error('--batch sends one request per page; it can\'t be combined with --text-layer or --shard')
+    instrument.start_profiling(args)
     
     # Model mapping
     MODEL_MAPPING = {
@@ -402,15 +1365,44 @@ def main():
         'gemini-2.5-flash': 'gemini-2.5-flash-preview-04-17'
     }
 
-    model = MODEL_MAPPING[args.model]
+    model = MODEL_MAPPING.get(args.model, args.model)
+    escalate_model = MODEL_MAPPING.get(args.escalate_model, args.escalate_model)
+
+    batch_backend = None
+    if args.batch or args.batch_dir:
+        from fema_agent import batch
+
+        if args.batch_dir:
+            batch_backend = batch.LocalBatchBackend(args.batch_dir)
+        else:
+            try:
+                batch_backend = batch.LitellmBatchBackend(batch.check_batch_provider(model))
+            except ValueError as e:
+                parser.error(f'--batch: {e}')
+
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
     
     parse_storage_directory(
         args.storage_dir,
         args.outpath,
         model,
-        avoid_rate_limit=args.avoid_rate_limit
+        avoid_rate_limit=args.avoid_rate_limit,
+        api_base=args.api_base,
+        use_text_layer=args.text_layer,
+        checkbox_detection=args.checkboxes,
+        shard_mode=args.shard,
+        group_size=args.field_group_size,
+        reasks=args.reasks,
+        batch_backend=batch_backend,
+        poll_interval=args.poll_interval,
+        escalate_model=escalate_model
         )
 
+    if args.telemetry:
+        print(f"LLM call telemetry written to {args.telemetry} "
+              f"(summarize with: python -m fema_agent.telemetry {args.telemetry})")
+
     # Optionally update storage with results
     if args.update_storage:
         print("\nUpdating storage with parsed results...")
@@ -1,5 +1,7 @@
 import argparse
+import mmap
 import requests
+import tempfile
 
 from datetime import datetime
 from io import BytesIO
@@ -7,6 +9,11 @@ from io import BytesIO
 from bs4 import BeautifulSoup
 from PyPDF2 import PdfReader
 
+from fema_agent import instrument
+
+# Bytes read from the network at a time when downloading reports
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 def parse_media_item(item):
     """
     Parse a single media item to extract report information.
@@ -90,7 +97,9 @@ def _search_fema_pda_reports(search_term, page=0):
     }
 
     # Make the request to the FEMA website
-    response = requests.get(base_url, params=params)
+    with instrument.timer('http'):
+        response = requests.get(base_url, params=params)
+    instrument.count('http_requests')
     
     if response.status_code != 200:
         print(f"Error: Unable to connect to FEMA website. Status code: {response.status_code}")
@@ -122,9 +131,9 @@ def search_fema_pda_reports(state=None, year=None, disaster_num=None):
         return []
     
     response = _search_fema_pda_reports(search_term)
-    soup = BeautifulSoup(response.text, 'html.parser')
-
-    reports = parse_page(soup)
+    with instrument.timer('postprocess'):
+        soup = BeautifulSoup(response.text, 'html.parser')
+        reports = parse_page(soup)
 
     # check for multiple pages
     n_pages = count_result_pages(soup)
@@ -132,8 +141,9 @@ def search_fema_pda_reports(state=None, year=None, disaster_num=None):
     if n_pages > 1:
         for page in range(1, n_pages):
             response = _search_fema_pda_reports(search_term, page=page)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            reports.extend(parse_page(soup))
+            with instrument.timer('postprocess'):
+                soup = BeautifulSoup(response.text, 'html.parser')
+                reports.extend(parse_page(soup))
 
     if year:
         reports = list(filter(lambda x: x['datetime'].year == int(year), reports))
@@ -169,10 +179,21 @@ def format_reports(reports):
     return result
 
 def extract_text(pdf_content):
-    pdf = PdfReader(BytesIO(pdf_content))
-    text = []
-    for page in pdf.pages:
-        text.append(page.extract_text())
+    """
+    Extract the text of a PDF
+
+    Args:
+        pdf_content: The PDF's bytes, or a seekable binary stream (an open
+            file, an mmap) that's read in place
+    """
+    if isinstance(pdf_content, (bytes, bytearray)):
+        # BytesIO shares a bytes object's buffer rather than copying it
+        pdf_content = BytesIO(pdf_content)
+    with instrument.timer('pdf_text'):
+        pdf = PdfReader(pdf_content)
+        text = []
+        for page in pdf.pages:
+            text.append(page.extract_text())
 
     return '\n'.join(text)
 
@@ -181,21 +202,34 @@ def fetch_report_details(url):
     # This function could be expanded to extract more information from the PDFs
     # For now, it's a placeholder for future enhancement
     try:
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            text = extract_text(response.content).strip()
+        # Stream the PDF to a temporary file and parse it through a memory
+        # map, rather than buffering the whole response in memory
+        with tempfile.TemporaryFile() as f:
+            with instrument.timer('http'):
+                response = requests.get(url, stream=True)
+                if response.status_code == 200:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                    f.flush()
+            instrument.count('http_requests')
+            if f.tell() == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                text = extract_text(mapped).strip()
             return text
     except Exception as e:
         print(f"Error fetching report: {e}")
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Search for FEMA Preliminary Damage Assessment Reports')
     parser.add_argument('--state', help='The state name to search for')
     parser.add_argument('--disaster-num', help='The disaster number to search for (e.g., 4860)')
     parser.add_argument('--year', type=int, help='Filter reports by year')
     parser.add_argument('--download', action='store_true', help='Download the report PDFs')
+    instrument.add_profile_arguments(parser)
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    instrument.start_profiling(args)
     
     if not args.state and not args.disaster_num:
         print("Error: You must specify either --state or --disaster-num")
@@ -7,36 +7,56 @@ import argparse
 import functools
 import json
 import multiprocessing as mp
+import os
 import time
 
 import logging
 
-import litellm
-from litellm import completion
+from typing import Optional
 
-from fema_agent.forms.fema_010_0_13 import FEMA_FORM_010_0_13
+from fema_agent import forms, instrument, telemetry, validate
+from fema_agent.forms.form import Form
 from fema_agent.storage import DeclarationStorage
 
-# Set up logging to both file and stdout
+# litellm takes seconds to import, so it's imported by the functions that
+# call the model rather than here
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-# Create file handler
-file_handler = logging.FileHandler('log/form_fill.log')
-file_handler.setLevel(logging.INFO)
+LOG_PATH = 'log/form_fill.log'
+
+def setup_logging(log_path: str = LOG_PATH):
+    """
+    Log to both a file and stdout
+
+    Called by the CLI rather than at import, so importing this module doesn't
+    create or open a log file.
+
+    Args:
+        log_path: Path of the log file (its directory is created if missing)
+    """
+    if logger.handlers:
+        return
+
+    os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
 
-# Create console handler
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+    # Create file handler
+    file_handler = logging.FileHandler(log_path)
+    file_handler.setLevel(logging.INFO)
 
-# Add handlers to logger
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+    # Create console handler
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+
+    # Add handlers to logger
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
 
 PROMPT = """
 You are an ex-FEMA official working at the company Hagerty Consulting.
 Given the following preliminary damage assessment report from FEMA,
-please fill out a Request for Presidential Disaster Declaration (FEMA Form 010-0-13).
+please fill out a {form_name} (FEMA Form {form_number}).
 
 PDA Report:
 {pda_report}
@@ -47,21 +67,26 @@ Fill out the following information:
 Return this information **only**, formatted as a JSON object. Format dates as "YYYY-MM-DD".
 """
 
-def build_json_schema(n_fields: int, start=0):
-    all_fields = list(FEMA_FORM_010_0_13.fields.items())
-    selected = all_fields[start: start + n_fields]
+DEFAULT_MODEL = 'gemini/gemini-2.0-flash'
+
+def select_fields(n_fields: int, start=0, form: Optional[Form] = None):
+    all_fields = list((form or forms.get_form()).fields.items())
+    return dict(all_fields[start: start + n_fields])
+
+def fields_json_schema(fields):
     field_schema_dict = {}
-    for field_name, field in selected:
+    for field_name, field in fields.items():
         field_schema_dict[field_name] = {"type": field.to_schema_string()}
 
     return {"type": "object", "properties": field_schema_dict}
 
+def build_json_schema(n_fields: int, start=0, form: Optional[Form] = None):
+    return fields_json_schema(select_fields(n_fields, start=start, form=form))
+
 
-def get_field_info(n_fields: int, start=0) -> str:
-    all_fields = list(FEMA_FORM_010_0_13.fields.items())
-    selected = all_fields[start: start + n_fields]
+def get_field_info(n_fields: int, start=0, form: Optional[Form] = None) -> str:
     field_string_builder = []
-    for field_name, field in selected:
+    for field_name, field in select_fields(n_fields, start=start, form=form).items():
         field_str = f' - {field_name} (field {field.field_number}): {field.description}'
         field_string_builder.append(field_str)
 
@@ -69,87 +94,184 @@ def get_field_info(n_fields: int, start=0) -> str:
 
 
 def build_prompt(document, field_start_idx: int, n_fields: int):
+    form = forms.document_form(document)
     formatted = PROMPT.format(
+        form_name=form.name,
+        form_number=form.form_number,
         pda_report=document['pda_report'],
-        field_information=get_field_info(n_fields=n_fields, start=field_start_idx)
+        field_information=get_field_info(n_fields=n_fields, start=field_start_idx, form=form)
         )
     return formatted
 
-def _call_api(message, print_raw_response=False, json_schema=None):
+def _call_api(message, print_raw_response=False, json_schema=None, model=DEFAULT_MODEL, api_base=None):
+    from litellm import completion
+
+    # A single prompt, or a conversation to continue (see fill_fields)
+    messages = message if isinstance(message, list) else [{'content': message, 'role': 'user'}]
     kwargs = {
-        'model': 'gemini/gemini-2.0-flash',
-        'messages': [{'content': message, 'role': 'user'}]
+        'model': model,
+        'messages': messages
         }
+    if api_base is not None:
+        kwargs['api_base'] = api_base
     if json_schema is not None:
         kwargs['response_format'] = {
             'type': 'json_schema',
             'json_schema': json_schema,
             'strict': True
             }
-    response = completion(**kwargs)
+    with instrument.timer('llm_wait'):
+        response = completion(**kwargs)
     if print_raw_response:
         logger.info('Raw response ')
         logger.info(response.choices[0].message.content)
         logger.info('-' * 30)
     return response
 
-def call_with_retries(message: str, max_retries: int = 5, sleep_delay: float = 15, **kwargs):
+def call_with_retries(message, max_retries: int = 5, sleep_delay: float = 15,
+                      span_attributes=None, **kwargs):
+    import litellm
+
+    span = telemetry.Span('form_fill.chunk', {
+        'gen_ai.request.model': kwargs.get('model', DEFAULT_MODEL),
+        **(span_attributes or {})
+        })
     retries = 0
     while (retries < max_retries):
+        attempt_start = time.perf_counter()
         try:
             response = _call_api(message, **kwargs)
+            span.llm_seconds += time.perf_counter() - attempt_start
+            span.end(response=response)
             return response
         except litellm.exceptions.InternalServerError:
+            span.llm_seconds += time.perf_counter() - attempt_start
+            span.retries += 1
             logger.warning(f"Vertex AI server overloaded. Attempt {retries+1}/{max_retries}. Sleeping for {sleep_delay}s")
             retries += 1
             time.sleep(sleep_delay)
         except litellm.exceptions.RateLimitError:
+            span.llm_seconds += time.perf_counter() - attempt_start
+            span.retries += 1
             logger.warning(f"Rate limit hit. Attempt {retries+1}/{max_retries}. Sleeping for {sleep_delay}s")
             time.sleep(sleep_delay)
             sleep_delay *= 1.5  # Exponential backoff
+        except Exception as e:
+            span.llm_seconds += time.perf_counter() - attempt_start
+            span.end(error=f"{type(e).__name__}: {e}")
+            raise
+    span.end(error=f"Gave up after {max_retries} attempts")
     return None
 
 
 def parse(response):
-    content = response.choices[0].message.content
+    content = (response.choices[0].message.content or '').strip()
     # remove backticks/json filetype if formatted like markdown
     if content.startswith('```'):
         content = (content
            .replace('```json', '')
            .replace('```', '')
             )
+    try:
         return json.loads(content)
-    else:
-        raise ValueError("Unable to parse response to JSON!")
-
-def fill_fields(start_field_idx: int, document, n_fields: int, verbose=False):
+    except json.JSONDecodeError:
+        pass
+    # Otherwise look for a JSON object inside surrounding prose
+    start, end = content.find('{'), content.rfind('}')
+    if start != -1 and end > start:
+        try:
+            return json.loads(content[start:end + 1])
+        except json.JSONDecodeError:
+            pass
+    raise ValueError("Unable to parse response to JSON!")
+
+def fill_fields(start_field_idx: int, document, n_fields: int, verbose=False,
+                model=DEFAULT_MODEL, api_base=None, doc_id=None, reasks=validate.REASKS):
+    """
+    Fill one chunk of form fields
+
+    Answers are validated against the field metadata; the invalid fields are
+    asked for again in the same conversation, so the PDA report isn't re-sent
+    as a new request and the valid answers are kept.
+
+    Returns:
+        Dictionary of field values (invalid answers are kept if re-asking
+        doesn't fix them; fields never answered are left out)
+    """
+    fields = select_fields(n_fields, start=start_field_idx, form=forms.document_form(document))
+    field_names = list(fields)
+    messages = [{'content': build_prompt(document, field_start_idx=start_field_idx, n_fields=n_fields),
+                 'role': 'user'}]
+    span_attributes = {
+        'fema.uuid': doc_id,
+        'fema.field_chunk': f'{start_field_idx}-{start_field_idx + len(field_names) - 1}',
+        'fema.fields': field_names,
+        }
     response = call_with_retries(
-            build_prompt(document, field_start_idx=start_field_idx, n_fields=n_fields),
-            json_schema=build_json_schema(start=start_field_idx, n_fields=n_fields),
-            print_raw_response=verbose
+            messages,
+            json_schema=fields_json_schema(fields),
+            print_raw_response=verbose,
+            model=model,
+            api_base=api_base,
+            span_attributes=span_attributes
             )
-    try:
-        result = parse(response)
-        if verbose:
-            logger.info('Parsed response ')
-            logger.info(result)
-            logger.info('-' * 30)
-        return result
-    except Exception as e:
-        print(e)
-
-def fill_form(document, chunk_size: int = 10, verbose=False):
+
+    result = {}
+    pending = fields
+    for attempt in range(reasks + 1):
+        if response is None:
+            break
+        with instrument.timer('postprocess'):
+            try:
+                answer = parse(response)
+            except ValueError as e:
+                logger.warning(f"{e} Fields {', '.join(pending)}")
+                answer = {}
+            checked, errors = validate.validate_fields(answer, pending)
+        result.update(checked)
+        if not errors or attempt == reasks:
+            break
+
+        logger.warning(f"Re-asking for {', '.join(errors)} ({attempt + 1}/{reasks})")
+        instrument.count('fields_reasked', len(errors))
+        messages = messages + [
+            {'content': response.choices[0].message.content or '', 'role': 'assistant'},
+            {'content': validate.reask_instructions(errors, answer), 'role': 'user'},
+            ]
+        pending = {field_name: fields[field_name] for field_name in errors}
+        response = call_with_retries(
+                messages,
+                json_schema=fields_json_schema(pending),
+                print_raw_response=verbose,
+                model=model,
+                api_base=api_base,
+                span_attributes={**span_attributes, 'fema.fields': list(pending), 'fema.reask': attempt + 1}
+                )
+
+    if verbose:
+        logger.info('Parsed response ')
+        logger.info(result)
+        logger.info('-' * 30)
+    return result
+
+def fill_form(document, chunk_size: int = 10, verbose=False, model=DEFAULT_MODEL, api_base=None,
+              doc_id=None, reasks=validate.REASKS):
     _fill_fields = functools.partial(
             fill_fields,
             document=document,
             n_fields=chunk_size,
-            verbose=verbose
+            verbose=verbose,
+            model=model,
+            api_base=api_base,
+            doc_id=doc_id,
+            reasks=reasks
             )
 
-    N_FIELDS = len(FEMA_FORM_010_0_13.fields)
+    N_FIELDS = len(forms.document_form(document).fields)
     start_indices = list(range(0, N_FIELDS, chunk_size))
 
-    with mp.Pool(processes=mp.cpu_count()) as pool:
+    # Timers in the pool's workers aren't reported, so charge the fan-out here
+    with instrument.timer('llm_wait'), mp.Pool(processes=mp.cpu_count()) as pool:
         result_dicts = pool.map(_fill_fields, start_indices)
 
     overall_results = {}
@@ -159,8 +281,8 @@ def fill_form(document, chunk_size: int = 10, verbose=False):
 
     return overall_results
 
-if __name__ == "__main__":
-    p = argparse.ArgumentParser()
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Fill FEMA Form 010-0-13 from PDA reports with an LLM')
     p.add_argument(
         '--storage-dir', type=str, required=True,
         help='Path to directory where PDFs/metadata are stored.'
@@ -173,9 +295,32 @@ if __name__ == "__main__":
         '--fields-per-request', type=int, default=5,
         help='Number of form fields to fill in a single LLM call. Defaults to 5.'
         )
+    p.add_argument(
+        '--model', type=str, default=DEFAULT_MODEL,
+        help=f'litellm model string to fill the form with. Defaults to {DEFAULT_MODEL}.'
+        )
+    p.add_argument(
+        '--api-base', type=str, default=None,
+        help='Send model calls to this endpoint, e.g. http://127.0.0.1:8765/v1 for fema_agent.mock_llm.'
+        )
+    p.add_argument(
+        '--telemetry', type=str, default=None,
+        help='Append a span per field chunk (tokens, latency, retries, cost) to this JSONL file.'
+        )
+    p.add_argument(
+        '--reasks', type=int, default=validate.REASKS,
+        help='Times to re-request only the fields whose answers fail validation. Defaults to '
+             f'{validate.REASKS}.'
+        )
     p.add_argument('--verbose', action='store_true')
+    instrument.add_profile_arguments(p)
+
+    args = p.parse_args(argv)
+    instrument.start_profiling(args)
+    setup_logging()
 
-    args = p.parse_args()
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
 
     s = DeclarationStorage(args.storage_dir)
     docs = s.get_all_documents()
@@ -184,7 +329,11 @@ if __name__ == "__main__":
     for doc_id in docs.keys():
         doc = s.get_document_metadata(doc_id)
 
-        results = fill_form(doc, args.fields_per_request, verbose=args.verbose)
+        results = fill_form(
+            doc, args.fields_per_request, verbose=args.verbose,
+            model=args.model, api_base=args.api_base, doc_id=doc_id,
+            reasks=args.reasks
+            )
         results['uuid'] = doc_id
 
         logger.info(f'Document {doc_id} parsed.')
@@ -196,5 +345,10 @@ if __name__ == "__main__":
 
         attempts.append(results)
 
-    with open(args.outpath, 'w+') as f:
+    with instrument.timer('json_io'), open(args.outpath, 'w+') as f:
         json.dump(attempts, f)
+
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,176 @@
+"""
+Resolve free-text state and tribal government names to two-letter state codes.
+
+Names extracted from the `state_or_tribe` form field come in many spellings
+("State of Vermont", "Commonwealth of the Northern Mariana Islands",
+"Soboba Band of Luiseño Indians", "Vermon"). Names are normalized with
+precompiled patterns and looked up exactly. Unknown spellings of state and
+territory names are matched against a trigram index with an edit-distance
+check; tribe names only resolve exactly, since long tribe names that share
+most of their words ("Confederated Tribes of the ... Reservation") belong to
+different states. Lookups are memoized, so resolving the same variants
+across a large corpus is cheap.
+"""
+
+import re
+import unicodedata
+
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+
+STATE_ABBREVIATIONS = {
+    'alabama': 'AL', 'alaska': 'AK', 'arizona': 'AZ', 'arkansas': 'AR',
+    'california': 'CA', 'colorado': 'CO', 'connecticut': 'CT', 'delaware': 'DE',
+    'district of columbia': 'DC', 'florida': 'FL', 'georgia': 'GA', 'hawaii': 'HI',
+    'idaho': 'ID', 'illinois': 'IL', 'indiana': 'IN', 'iowa': 'IA',
+    'kansas': 'KS', 'kentucky': 'KY', 'louisiana': 'LA', 'maine': 'ME',
+    'maryland': 'MD', 'massachusetts': 'MA', 'michigan': 'MI', 'minnesota': 'MN',
+    'mississippi': 'MS', 'missouri': 'MO', 'montana': 'MT', 'nebraska': 'NE',
+    'nevada': 'NV', 'new hampshire': 'NH', 'new jersey': 'NJ', 'new mexico': 'NM',
+    'new york': 'NY', 'north carolina': 'NC', 'north dakota': 'ND', 'ohio': 'OH',
+    'oklahoma': 'OK', 'oregon': 'OR', 'pennsylvania': 'PA', 'rhode island': 'RI',
+    'south carolina': 'SC', 'south dakota': 'SD', 'tennessee': 'TN', 'texas': 'TX',
+    'utah': 'UT', 'vermont': 'VT', 'virginia': 'VA', 'washington': 'WA',
+    'west virginia': 'WV', 'wisconsin': 'WI', 'wyoming': 'WY',
+
+     # American Samoa, Guam, etc are treated like states in the FEMA db
+    'american samoa': 'AS',
+    'u.s. territory of guam': 'GU',
+    'northern mariana islands': 'MP'
+
+}
+
+# Tribal governments, by every spelling seen on forms; matched exactly
+TRIBES_TO_STATE = {
+    'oglala sioux tribe': 'SD',
+    'soboba band of luiseno indians': 'CA',
+    'navajo nation': 'AZ',
+    "tohono o'odham nation": 'AZ',
+    'ponca tribe of nebraska': 'NE',
+    'cahuilla band of indians': 'CA',
+    'sac & fox tribe of the mississippi of iowa': 'IA',
+    'confederated tribes of the colville reservation': 'WA',
+    'havasupai tribe': 'AZ',
+    'la jolla band of luiseno indians': 'CA'
+}
+
+# Other spellings of the territories FEMA treats as states
+TERRITORY_ALIASES = {
+    'guam': 'GU',
+    'puerto rico': 'PR',
+    'virgin islands': 'VI',
+    'u.s. virgin islands': 'VI',
+    'us virgin islands': 'VI',
+    'washington dc': 'DC',
+    'washington d.c.': 'DC',
+}
+
+# Minimum similarity (difflib ratio) for a fuzzy match to be accepted
+FUZZY_THRESHOLD = 0.85
+
+# Number of trigram-ranked candidates re-scored with the edit-distance check
+FUZZY_CANDIDATES = 5
+
+_APOSTROPHES = re.compile(r"[‘’ʼ`]")
+_PUNCTUATION = re.compile(r"[^a-z0-9&' ]+")
+_WHITESPACE = re.compile(r"\s+")
+_PREFIX = re.compile(
+    r"^(?:the )?(?:commonwealth|state|territory|government|u\.?s\.? territory) of (?:the )?"
+)
+_SUFFIX = re.compile(r" (?:state|government)$")
+
+def normalize_name(name: str) -> str:
+    """
+    Normalize a state or tribe name for lookup
+
+    Lowercases, strips accents, unifies apostrophes, removes punctuation and
+    known "State of"/"Commonwealth of the" prefixes and " state" suffixes.
+    """
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    name = _APOSTROPHES.sub("'", name.lower())
+    name = _WHITESPACE.sub(' ', name).strip()
+    name = _PREFIX.sub('', name, count=1)
+    name = _SUFFIX.sub('', name, count=1)
+    name = _PUNCTUATION.sub(' ', name)
+    return _WHITESPACE.sub(' ', name).strip()
+
+def _trigrams(name: str):
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class NameIndex:
+    """Exact and fuzzy (trigram + edit distance) lookup over known names"""
+
+    def __init__(self, names: Dict[str, str]):
+        self.exact = {}
+        self.trigrams = defaultdict(set)
+        for name, code in names.items():
+            normalized = normalize_name(name)
+            self.exact[normalized] = code
+            for trigram in _trigrams(normalized):
+                self.trigrams[trigram].add(normalized)
+
+    def lookup(self, normalized: str) -> Optional[str]:
+        """Exact lookup of an already-normalized name"""
+        return self.exact.get(normalized)
+
+    def fuzzy_lookup(self, normalized: str, threshold: float = FUZZY_THRESHOLD) -> Optional[str]:
+        """
+        Find the closest known name to an already-normalized name
+
+        Candidates sharing the most trigrams are re-scored with difflib's
+        similarity ratio; the best one is returned if it clears `threshold`.
+        """
+        shared = Counter()
+        for trigram in _trigrams(normalized):
+            shared.update(self.trigrams.get(trigram, ()))
+        if not shared:
+            return None
+
+        best_name, best_ratio = None, 0.0
+        for candidate, _ in shared.most_common(FUZZY_CANDIDATES):
+            ratio = SequenceMatcher(None, normalized, candidate).ratio()
+            if ratio > best_ratio:
+                best_name, best_ratio = candidate, ratio
+
+        if best_ratio < threshold:
+            return None
+        return self.exact[best_name]
+
+STATE_INDEX = NameIndex({**STATE_ABBREVIATIONS, **TERRITORY_ALIASES})
+TRIBE_INDEX = NameIndex(TRIBES_TO_STATE)
+
+STATE_CODES = frozenset(STATE_ABBREVIATIONS.values()) | frozenset(TERRITORY_ALIASES.values())
+
+@lru_cache(maxsize=4096)
+def resolve_state(name: str, fuzzy: bool = True) -> Optional[str]:
+    """
+    Resolve a state or tribal government name to a two-letter state code
+
+    Args:
+        name: Free-text name, e.g. as extracted from the `state_or_tribe` field
+        fuzzy: Whether to fall back to fuzzy matching for unknown spellings
+            of state and territory names
+
+    Returns:
+        Two-letter state code, or None if the name can't be resolved
+    """
+    if not isinstance(name, str) or not name.strip():
+        return None
+
+    # Already a state code
+    if name.strip().upper() in STATE_CODES:
+        return name.strip().upper()
+
+    normalized = normalize_name(name)
+    code = STATE_INDEX.lookup(normalized) or TRIBE_INDEX.lookup(normalized)
+    if code is None and fuzzy:
+        code = STATE_INDEX.fuzzy_lookup(normalized)
+    return code
+
+def resolve_states(names: Iterable[str], fuzzy: bool = True) -> Dict[str, Optional[str]]:
+    """Resolve many names at once, returning a mapping from each distinct name to its state code"""
+    return {name: resolve_state(name, fuzzy=fuzzy) for name in set(names)}
@@ -4,30 +4,177 @@ import shutil
 import argparse
 import json
 import datetime
+import mmap
 import re
+import tempfile
 
+from contextlib import contextmanager
 from pathlib import Path
-from PyPDF2 import PdfReader, PdfWriter
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, writes are still atomic
+    fcntl = None
+
+from fema_agent import forms, instrument
+from fema_agent.packs import PackStore
+
+# Pending changes after which a document's change log is compacted
+COMPACT_AFTER = 50
+
+# Marks a field that didn't exist, in rollbacks
+_MISSING = object()
+
+# Document directory layouts: `<uuid>/` directly under the storage directory,
+# or under two levels of UUID-prefix directories (`ab/cd/<uuid>/`), which
+# keeps directories small for corpora of tens of thousands of documents
+FLAT, SHARDED = "flat", "sharded"
+LAYOUTS = (FLAT, SHARDED)
+
+# Document directories are named by their UUID; anything else in the storage
+# directory (`packs/`, prefix directories, ...) isn't a document
+_DOCUMENT_DIR_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+def is_document_dir(path):
+    """Whether a path is a document directory, i.e. a directory named by a UUID"""
+    path = Path(path)
+    return bool(_DOCUMENT_DIR_PATTERN.match(path.name)) and path.is_dir()
+
+def document_relpath(doc_id, layout=FLAT):
+    """Path of a document's directory relative to the storage directory"""
+    if layout == SHARDED:
+        return Path(doc_id[:2]) / doc_id[2:4] / doc_id
+    return Path(doc_id)
+
+def read_layout(base_dir):
+    """Layout of a storage directory, from its `layout.json` (flat if missing)"""
+    layout_path = Path(base_dir) / "layout.json"
+    if not layout_path.exists():
+        return FLAT
+    with open(layout_path, "r") as f:
+        return json.load(f)["layout"]
+
+def scan_document_dirs(base_dir, layout=None):
+    """
+    Find the document directories of a storage directory by listing it
+
+    Args:
+        base_dir: Storage directory
+        layout: Layout to scan (read from the storage directory if None)
+
+    Yields:
+        Path of each document directory (only UUID-named directories)
+    """
+    base_dir = Path(base_dir)
+    layout = layout or read_layout(base_dir)
+    if layout == FLAT:
+        yield from (d for d in base_dir.iterdir() if is_document_dir(d))
+        return
+    for first in base_dir.iterdir():
+        if not (first.is_dir() and len(first.name) == 2):
+            continue
+        for second in first.iterdir():
+            if second.is_dir() and len(second.name) == 2:
+                yield from (d for d in second.iterdir() if is_document_dir(d))
+
+def new_run_id():
+    """A run ID that sorts by start time, e.g. "20250407T153012-3f9a1c" """
+    return f"{datetime.datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+class VersionConflictError(ValueError):
+    """A document changed since the version an update was based on"""
+
+@contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive advisory lock on `path` (created if missing)
+
+    Locks are per open file, so they exclude other processes and other
+    threads of this one alike.
+    """
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def write_json_atomic(path, data):
+    """
+    Write JSON to a temporary file next to `path`, then rename it into place
+
+    Readers see either the old or the new file, never a partial one.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 class DeclarationStorage:
-    def __init__(self, base_dir="declarations"):
-        """Initialize the declaration storage system"""
+    """
+    Declaration PDFs and their metadata, one directory per document
+
+    Metadata updates are appended to a per-document change log
+    (`<uuid>/changes.jsonl`) as field-level patches tagged with the run that
+    made them; a document's metadata is its `metadata.json` snapshot plus
+    those patches, and `compact` folds them back into the snapshot. A bad
+    run can be undone with `rollback_run`.
+
+    Safe to use from several processes at once: documents and the registry
+    are updated under per-document and registry locks (`<uuid>/.lock`,
+    `registry.json.lock`), files are replaced atomically, and each
+    document's metadata carries a `version` that's incremented on every
+    update, for optimistic updates (see `update_document_metadata`).
+    """
+    def __init__(self, base_dir="declarations", run_id=None, layout=None):
+        """
+        Initialize the declaration storage system
+
+        Args:
+            base_dir: Storage directory
+            run_id: ID recorded with this instance's metadata updates (defaults
+                to the `FEMA_RUN_ID` environment variable, or a new ID)
+            layout: Document directory layout (`FLAT` or `SHARDED`) of a new
+                storage directory. An existing one keeps its layout; use
+                `migrate_layout` to change it.
+        """
         self.base_dir = Path(base_dir)
-        self.setup_storage()
+        self.run_id = run_id or os.environ.get("FEMA_RUN_ID") or new_run_id()
+        self.packs = PackStore(self.base_dir / "packs")
+        self.setup_storage(layout)
     
-    def setup_storage(self):
+    def setup_storage(self, layout=None):
         """Create the base directory structure and registry files"""
         # Create base directory if it doesn't exist
         self.base_dir.mkdir(exist_ok=True)
         
         # Create registry file if it doesn't exist
         self.registry_path = self.base_dir / "registry.json"
+        self.registry_lock_path = self.base_dir / "registry.json.lock"
         if not self.registry_path.exists():
-            with open(self.registry_path, "w") as f:
-                json.dump({
-                    "documents": {},
-                    "last_updated": datetime.datetime.now().isoformat()
-                }, f, indent=2)
+            with file_lock(self.registry_lock_path):
+                if not self.registry_path.exists():
+                    if layout not in (None, FLAT):
+                        write_json_atomic(self.base_dir / "layout.json", {"layout": layout})
+                    write_json_atomic(self.registry_path, {
+                        "documents": {},
+                        "last_updated": datetime.datetime.now().isoformat()
+                    })
+        self.layout = read_layout(self.base_dir)
+        if layout is not None and layout != self.layout:
+            raise ValueError(
+                f"{self.base_dir} uses the {self.layout} layout, not {layout}; "
+                f"run `fema-agent storage migrate --layout {layout}` to change it"
+                )
         
         # Create metadata schema file if it doesn't exist
         schema_path = self.base_dir / "metadata_schema.json"
@@ -38,6 +185,7 @@ class DeclarationStorage:
                     "original_filename": {"type": "string"},
                     "import_date": {"type": "string", "format": "date-time"},
                     "page_count": {"type": "integer"},
+                    "form_number": {"type": "string"},
                     "file_path": {"type": "string"},
                     "pages": {"type": "array", "items": {"type": "string"}},
 
@@ -51,138 +199,390 @@ class DeclarationStorage:
                 },
                 "required": ["original_filename", "import_date", "page_count", "file_path", "pages"]
             }
-            with open(schema_path, "w") as f:
-                json.dump(schema, f, indent=2)
+            write_json_atomic(schema_path, schema)
+
+    def document_dir(self, doc_id):
+        """
+        Directory of a document
+
+        Falls back to the other layout's location, so a store whose migration
+        was interrupted still resolves every document.
+        """
+        doc_dir = self.base_dir / document_relpath(doc_id, self.layout)
+        if not doc_dir.exists():
+            other = SHARDED if self.layout == FLAT else FLAT
+            other_dir = self.base_dir / document_relpath(doc_id, other)
+            if other_dir.exists():
+                return other_dir
+        return doc_dir
+
+    def _document_lock(self, doc_id):
+        """Lock serializing metadata updates to one document"""
+        return file_lock(self.document_dir(doc_id) / ".lock")
     
-    def add_document(self, pdf_path, metadata=None):
+    def add_document(self, pdf_path, metadata=None, hardlink=False, form_number=forms.DEFAULT_FORM_NUMBER):
         """
         Add a new document to the storage system
+
+        The source PDF is read once: it's memory-mapped, and the same mapping
+        is written out as `all.pdf` and parsed to split the pages. Where the
+        filesystem supports it, `all.pdf` is a copy-on-write clone of the
+        source instead, so its bytes aren't copied at all.
         
         Args:
             pdf_path: Path to the PDF file
             metadata: Optional initial metadata
+            hardlink: Hard link `all.pdf` to the source rather than copying it.
+                Saves the copy on any filesystem, but the stored document then
+                changes if the source file is modified in place.
+            form_number: Form the document is, which picks its parse ops
             
         Returns:
             document_id: UUID of the added document
         """
+        from PyPDF2 import PdfReader, PdfWriter
+
         pdf_path = Path(pdf_path)
         
         # Generate UUID for this document
         doc_id = str(uuid.uuid4())
-        doc_dir = self.base_dir / doc_id
+        doc_dir = self.base_dir / document_relpath(doc_id, self.layout)
         
         # Create directory for this document
-        doc_dir.mkdir(exist_ok=True)
-        
-        # Copy the original PDF
-        dest_path = doc_dir / "all.pdf"
-        shutil.copy(pdf_path, dest_path)
-        
-        # Split the PDF into individual pages
-        reader = PdfReader(pdf_path)
-        total_pages = len(reader.pages)
-        
-        page_paths = []
-        page_dict = {}  # Dictionary for individual page entries
+        doc_dir.mkdir(parents=True, exist_ok=True)
+
+        with instrument.timer('pdf_split'), open(pdf_path, "rb") as source, \
+                mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # Copy the original PDF
+            dest_path = doc_dir / "all.pdf"
+            _copy_mapped(source, mapped, dest_path, hardlink=hardlink)
+
+            # Split the PDF into individual pages, reading the same mapping
+            reader = PdfReader(mapped)
+            total_pages = len(reader.pages)
+
+            for i in range(total_pages):
+                writer = PdfWriter()
+                writer.add_page(reader.pages[i])
+                page_path = doc_dir / f"page_{i+1}.pdf"
+                with open(page_path, "wb") as out:
+                    writer.write(out)
+        instrument.count('pages_split', total_pages)
         
-        for i in range(total_pages):
-            writer = PdfWriter()
-            writer.add_page(reader.pages[i])
-            page_path = doc_dir / f"page_{i+1}.pdf"
-            with open(page_path, "wb") as out:
-                writer.write(out)
-                
-            # Store relative path
-            rel_path = str(page_path.relative_to(self.base_dir))
-            page_paths.append(rel_path)
-            
-            # Add individual page entry
-            page_dict[f"page_{i+1}"] = rel_path
+        self.register_documents({
+            doc_id: self.new_document_metadata(doc_id, pdf_path.name, total_pages, metadata, form_number)
+            })
         
-        # Create or update metadata
-        if metadata is None:
-            metadata = {}
+        return doc_id
+
+    def new_document_metadata(self, doc_id, original_filename, total_pages, metadata=None,
+                              form_number=forms.DEFAULT_FORM_NUMBER):
+        """
+        Initial metadata of a document whose `all.pdf` and pages are in place
+
+        Args:
+            doc_id: UUID of the document
+            original_filename: Name of the PDF the document came from
+            total_pages: Number of `page_N.pdf` files
+            metadata: Optional initial metadata
+            form_number: Form the document is
+        """
+        forms.get_form(form_number)
+        doc_dir = self.base_dir / document_relpath(doc_id, self.layout)
+        page_paths = [
+            str((doc_dir / f"page_{i}.pdf").relative_to(self.base_dir)) for i in range(1, total_pages + 1)
+            ]
         
         doc_metadata = {
-            "original_filename": pdf_path.name,
+            "original_filename": original_filename,
             "import_date": datetime.datetime.now().isoformat(),
             "page_count": total_pages,
-            "file_path": str(dest_path.relative_to(self.base_dir)),
+            "form_number": form_number,
+            "file_path": str((doc_dir / "all.pdf").relative_to(self.base_dir)),
             "pages": page_paths,
-            **page_dict  # Add individual page entries
+            # Add individual page entries
+            **{f"page_{i}": path for i, path in enumerate(page_paths, 1)}
         }
-        doc_metadata.update(metadata)  # Add any additional metadata
-        
+        doc_metadata.update(metadata or {})  # Add any additional metadata
+        doc_metadata["version"] = 1
+        return doc_metadata
+
+    def register_documents(self, documents):
+        """
+        Save the metadata of new documents and add them to the registry
+
+        The registry is rewritten once for the whole batch.
+
+        Args:
+            documents: Dictionary mapping each new document's UUID to its
+                metadata (see `new_document_metadata`)
+        """
         # Save document metadata
-        with open(doc_dir / "metadata.json", "w") as f:
-            json.dump(doc_metadata, f, indent=2)
+        for doc_id, doc_metadata in documents.items():
+            with instrument.timer('json_io'):
+                write_json_atomic(self.document_dir(doc_id) / "metadata.json", doc_metadata)
         
         # Update registry
-        self.update_registry(doc_id, doc_metadata)
-        
-        return doc_id
+        with file_lock(self.registry_lock_path):
+            self._update_registry(documents)
     
     def update_registry(self, doc_id, metadata):
         """Update the registry with a new or updated document"""
-        # Update registry.json
-        with open(self.registry_path, "r") as f:
+        with file_lock(self.registry_lock_path):
+            self._update_registry({doc_id: metadata})
+
+    def _update_registry(self, documents):
+        # Update registry.json; the caller holds the registry lock
+        with instrument.timer('json_io'), open(self.registry_path, "r") as f:
             registry = json.load(f)
         
-        # Extract page-specific keys
-        page_dict = {}
-        for i in range(1, metadata["page_count"] + 1):
-            key = f"page_{i}"
-            if key in metadata:
-                page_dict[key] = metadata[key]
-        
-        # Add document info to registry
-        registry["documents"][doc_id] = {
-            "original_filename": metadata["original_filename"],
-            "import_date": metadata["import_date"],
-            "page_count": metadata["page_count"],
-            "file_path": metadata["file_path"],
-            "pages": metadata["pages"],
-            **page_dict  # Include individual page entries
-        }
+        for doc_id, metadata in documents.items():
+            # Extract page-specific keys
+            page_dict = {}
+            for i in range(1, metadata["page_count"] + 1):
+                key = f"page_{i}"
+                if key in metadata:
+                    page_dict[key] = metadata[key]
+            
+            # Add document info to registry
+            registry["documents"][doc_id] = {
+                "original_filename": metadata["original_filename"],
+                "import_date": metadata["import_date"],
+                "page_count": metadata["page_count"],
+                "form_number": metadata.get("form_number", forms.DEFAULT_FORM_NUMBER),
+                "file_path": metadata["file_path"],
+                "pages": metadata["pages"],
+                **page_dict  # Include individual page entries
+            }
         
         registry["last_updated"] = datetime.datetime.now().isoformat()
         
-        with open(self.registry_path, "w") as f:
-            json.dump(registry, f, indent=2)
+        with instrument.timer('json_io'):
+            write_json_atomic(self.registry_path, registry)
         
     
-    def update_document_metadata(self, doc_id, metadata):
-        """Update metadata for an existing document"""
-        doc_dir = self.base_dir / doc_id
-        metadata_path = doc_dir / "metadata.json"
-        
-        if not metadata_path.exists():
+    def update_document_metadata(self, doc_id, metadata, expected_version=None, run_id=None):
+        """
+        Update metadata for an existing document
+
+        The update is appended to the document's change log as a patch rather
+        than rewriting `metadata.json`; the log is folded back in once it has
+        `COMPACT_AFTER` entries. Only keys whose values change are logged, and
+        an update changing nothing isn't logged (or versioned) at all. The
+        read-modify-write holds the document's lock, so concurrent updates of
+        different keys are all kept.
+
+        Args:
+            doc_id: UUID of the document
+            metadata: Keys to add or replace
+            expected_version: If given, only update if the document is still at
+                this `version` (from `get_document_metadata`), so decisions made
+                on a stale read aren't written back
+            run_id: Run to record the change under (defaults to `self.run_id`)
+
+        Returns:
+            Updated document metadata
+
+        Raises:
+            ValueError: If the document doesn't exist
+            VersionConflictError: If the document's version isn't `expected_version`
+        """
+        if not (self.document_dir(doc_id) / "metadata.json").exists():
             raise ValueError(f"Document {doc_id} not found")
-        
-        # Read existing metadata
-        with open(metadata_path, "r") as f:
-            existing_metadata = json.load(f)
-        
-        # Update with new metadata
-        existing_metadata.update(metadata)
-        
-        # Save updated metadata
-        with open(metadata_path, "w") as f:
-            json.dump(existing_metadata, f, indent=2)
-        
+
+        # The version is maintained by the log, not set by callers
+        metadata = {k: v for k, v in metadata.items() if k != "version"}
+
+        with self._document_lock(doc_id):
+            existing_metadata, changes = self._read_document(doc_id)
+
+            # Documents stored before versioning count as version 0
+            version = existing_metadata.get("version", 0)
+            if expected_version is not None and version != expected_version:
+                raise VersionConflictError(
+                    f"Document {doc_id} is at version {version}, expected {expected_version}"
+                    )
+
+            # Re-sent values aren't changes, and would be undone by this run's rollback
+            metadata = {
+                k: v for k, v in metadata.items()
+                if k not in existing_metadata or existing_metadata[k] != v
+            }
+            if metadata:
+                self._log_change(doc_id, existing_metadata, changes, run_id or self.run_id, metadata)
+
+        return existing_metadata
+
+    def _log_change(self, doc_id, metadata, changes, run_id, set_keys, delete_keys=()):
+        """
+        Append a change to a document's log and apply it to its metadata
+
+        The log is compacted once it has `COMPACT_AFTER` entries, and the
+        registry is updated if the change touches the fields it mirrors. The
+        caller holds the document's lock.
+
+        Args:
+            doc_id: UUID of the document
+            metadata: The document's current metadata, updated in place
+            changes: Number of changes in the log (from `_read_document`)
+            run_id: Run to record the change under
+            set_keys: Keys to add or replace
+            delete_keys: Keys to remove
+        """
+        change = {
+            "version": metadata.get("version", 0) + 1,
+            "run_id": run_id,
+            "timestamp": datetime.datetime.now().isoformat(),
+            "set": set_keys,
+            "delete": list(delete_keys),
+            "previous": {k: metadata[k] for k in [*set_keys, *delete_keys] if k in metadata},
+            "added": [k for k in set_keys if k not in metadata],
+        }
+        with instrument.timer('json_io'):
+            _append_jsonl(self._changes_path(doc_id), change)
+        _apply_change(metadata, change)
+
+        if changes + 1 >= COMPACT_AFTER:
+            self._compact_document(doc_id)
+
         # Also update the registry if relevant fields changed
-        registry_fields = ["original_filename", "page_count", "file_path", "pages"]
+        registry_fields = ["original_filename", "page_count", "form_number", "file_path", "pages"]
         page_pattern = re.compile(r"^page_\d+$")
-        
-        if any(k in metadata for k in registry_fields) or any(page_pattern.match(k) for k in metadata):
-            self.update_registry(doc_id, existing_metadata)
-        
-        return existing_metadata
 
-    def update_declaration_id(self, doc_id, declaration_id):
+        touched = [*set_keys, *delete_keys]
+        if any(k in touched for k in registry_fields) or any(page_pattern.match(k) for k in touched):
+            self.update_registry(doc_id, metadata)
+
+    def _changes_path(self, doc_id):
+        return self.document_dir(doc_id) / "changes.jsonl"
+
+    def _history_path(self, doc_id):
+        return self.document_dir(doc_id) / "history.jsonl"
+
+    def _read_document(self, doc_id):
+        """
+        Current metadata of a document: its snapshot plus its pending changes
+
+        Returns:
+            Tuple of (metadata, number of changes not yet compacted)
+        """
+        metadata_path = self.document_dir(doc_id) / "metadata.json"
+        if not metadata_path.exists():
+            raise ValueError(f"Document {doc_id} not found")
+
+        with instrument.timer('json_io'):
+            with open(metadata_path, "r") as f:
+                metadata = json.load(f)
+            changes = _read_jsonl(self._changes_path(doc_id))
+
+        # Changes at or below the snapshot's version were already folded in
+        # by a compaction that was interrupted before truncating the log
+        snapshot_version = metadata.get("version", 0)
+        pending = [change for change in changes if change["version"] > snapshot_version]
+        for change in pending:
+            _apply_change(metadata, change)
+        return metadata, len(pending)
+
+    def _compact_document(self, doc_id):
+        # The caller holds the document's lock
+        metadata, pending = self._read_document(doc_id)
+        if not pending:
+            return False
+        changes_path = self._changes_path(doc_id)
+        with instrument.timer('json_io'):
+            # History first, then the snapshot, then the log: a crash at any
+            # point leaves a state `_read_document` reads correctly
+            with open(self._history_path(doc_id), "a") as f:
+                for change in _read_jsonl(changes_path):
+                    f.write(json.dumps(change) + "\n")
+            write_json_atomic(self.document_dir(doc_id) / "metadata.json", metadata)
+            changes_path.unlink()
+        return True
+
+    def compact(self, doc_ids=None):
+        """
+        Fold the change logs of documents into their `metadata.json`
+
+        The folded changes are kept in `<uuid>/history.jsonl`, so runs can
+        still be rolled back after compaction.
+
+        Args:
+            doc_ids: Documents to compact (all documents if None)
+
+        Returns:
+            Number of documents compacted
+        """
+        compacted = 0
+        for doc_id in (doc_ids if doc_ids is not None else self.get_all_documents()):
+            with self._document_lock(doc_id):
+                compacted += self._compact_document(doc_id)
+        return compacted
+
+    def document_history(self, doc_id):
+        """
+        All recorded changes to a document, oldest first
+
+        Raises:
+            ValueError: If the document doesn't exist
+        """
+        if not (self.document_dir(doc_id) / "metadata.json").exists():
+            raise ValueError(f"Document {doc_id} not found")
+
+        history = {}
+        for change in _read_jsonl(self._history_path(doc_id)) + _read_jsonl(self._changes_path(doc_id)):
+            # A change can be in both if a compaction was interrupted
+            history[change["version"]] = change
+        return [history[version] for version in sorted(history)]
+
+    def rollback_run(self, run_id, dry_run=False):
+        """
+        Undo every change a run made, restoring the values it replaced
+
+        Fields that a later run changed again are left alone. The rollback is
+        itself recorded as a change, under run ID `rollback-<run_id>`.
+
+        Args:
+            run_id: Run to undo
+            dry_run: If True, only report what would be restored
+
+        Returns:
+            Dictionary mapping each affected document to a tuple of (restored
+            fields, fields left alone because they changed since)
+        """
+        rolled_back = {}
+        for doc_id in self.get_all_documents():
+            with self._document_lock(doc_id):
+                history = self.document_history(doc_id)
+                if not any(change["run_id"] == run_id for change in history):
+                    continue
+                current, changes = self._read_document(doc_id)
+
+                # The value of each field before the run first touched it
+                before, skipped = {}, set()
+                for change in history:
+                    touched = set(change["set"]) | set(change["delete"])
+                    if change["run_id"] == run_id:
+                        for key in touched - skipped:
+                            before.setdefault(key, change["previous"].get(key, _MISSING))
+                    else:
+                        # Fields another run changed since are left as they are
+                        for key in touched & set(before):
+                            skipped.add(key)
+                            del before[key]
+
+                restore = {k: v for k, v in before.items() if v is not _MISSING}
+                delete = [k for k, v in before.items() if v is _MISSING and k in current]
+                rolled_back[doc_id] = (sorted(restore) + sorted(delete), sorted(skipped))
+                if dry_run or not (restore or delete):
+                    continue
+
+                self._log_change(doc_id, current, changes, f"rollback-{run_id}", restore, delete)
+        return rolled_back
+
+    def update_declaration_id(self, doc_id, declaration_id, expected_version=None):
         """Update a document with a FEMA disaster declaration ID"""
         metadata = {"fema_declaration_id": declaration_id}
-        return self.update_document_metadata(doc_id, metadata)
+        return self.update_document_metadata(doc_id, metadata, expected_version=expected_version)
 
     def store_pda_report(
         self,
@@ -192,6 +592,7 @@ class DeclarationStorage:
         pda_report_date: str = '',
         pda_report_url: str = '',
         pda_report_fetched_date: str = '',
+        expected_version=None,
         ):
         """
         Store a Preliminary Damage Assessment report for a document
@@ -200,6 +601,7 @@ class DeclarationStorage:
             doc_id: UUID of the document
             pda_text: Full text of the PDA report
             pda_metadata: Optional additional metadata about the PDA (source, date, etc.)
+            expected_version: Passed to `update_document_metadata`
             
         Returns:
             Updated document metadata
@@ -214,34 +616,171 @@ class DeclarationStorage:
         }
         
         # Update the document
-        return self.update_document_metadata(doc_id, pda_data)
+        return self.update_document_metadata(doc_id, pda_data, expected_version=expected_version)
     
     def get_document_metadata(self, doc_id):
         """Get metadata for a specific document"""
-        metadata_path = self.base_dir / doc_id / "metadata.json"
-        
-        if not metadata_path.exists():
-            raise ValueError(f"Document {doc_id} not found")
-        
-        with open(metadata_path, "r") as f:
-            return json.load(f)
+        return self._read_document(doc_id)[0]
     
     def get_document_path(self, doc_id):
         """Get the path to a document's PDF file"""
-        return self.base_dir / doc_id / "all.pdf"
+        return self._file_path(doc_id, "all.pdf")
     
     def get_page_path(self, doc_id, page_num):
         """Get the path to a specific page of a document"""
-        return self.base_dir / doc_id / f"page_{page_num}.pdf"
+        return self._file_path(doc_id, f"page_{page_num}.pdf")
+
+    def _file_path(self, doc_id, name):
+        """Path of a document's file, copied out of its pack if it's been packed"""
+        path = self.document_dir(doc_id) / name
+        if path.exists():
+            return path
+        return self.packs.materialize(doc_id, name) or path
+
+    def read_file(self, doc_id, name):
+        """
+        Read one of a document's PDFs ("all.pdf", "page_1.pdf", ...)
+
+        Returns:
+            The file's bytes; for packed documents, a zero-copy memoryview of
+            the mapped pack file
+
+        Raises:
+            ValueError: If the document has no such file
+        """
+        path = self.document_dir(doc_id) / name
+        if path.exists():
+            with instrument.timer('pack_io'):
+                return path.read_bytes()
+        data = self.packs.read(doc_id, name)
+        if data is None:
+            raise ValueError(f"Document {doc_id} has no file {name}")
+        return data
+
+    def pack_document(self, doc_id):
+        """
+        Move a document's PDFs into its shard's pack file
+
+        The loose files are deleted once the pack and its index are on disk.
+        `metadata.json` and the change log stay in the document's directory.
+
+        Returns:
+            Number of files packed
+        """
+        files = {path.name: path for path in sorted(self.document_dir(doc_id).glob("*.pdf"))}
+        if not files:
+            return 0
+
+        self.packs.directory.mkdir(exist_ok=True)
+        shard_lock = self.packs.directory / f"{self.packs.shard(doc_id)}.lock"
+        with self._document_lock(doc_id), file_lock(shard_lock):
+            self.packs.add(doc_id, files)
+            for name, path in files.items():
+                packed = self.packs.read(doc_id, name)
+                if packed is None or len(packed) != path.stat().st_size:
+                    raise IOError(f"Packing {path} failed, leaving the loose files in place")
+            for path in files.values():
+                path.unlink()
+        instrument.count('pack_files', len(files))
+        return len(files)
+
+    def pack(self, doc_ids=None):
+        """
+        Pack the PDFs of documents that still have loose files
+
+        Args:
+            doc_ids: Documents to pack (all documents if None)
+
+        Returns:
+            Tuple of (documents packed, files packed)
+        """
+        documents, files = 0, 0
+        for doc_id in (doc_ids if doc_ids is not None else self.get_all_documents()):
+            packed = self.pack_document(doc_id)
+            documents += bool(packed)
+            files += packed
+        return documents, files
     
     def get_all_documents(self):
         """Get information about all documents in the storage"""
-        with open(self.registry_path, "r") as f:
+        with instrument.timer('json_io'), open(self.registry_path, "r") as f:
             registry = json.load(f)
         
         return registry["documents"]
     
-    def add_directory(self, dir_path):
+    def migrate_layout(self, layout):
+        """
+        Move every document directory to another layout
+
+        Document directories are renamed into place, then the paths in the
+        registry and in each document's metadata are rewritten wherever they
+        don't match the new layout. Run it while nothing else is using the
+        store; if it's interrupted, documents are still found in either
+        layout, and running it again moves the rest and rewrites the paths
+        of the documents the interrupted run already moved.
+
+        Args:
+            layout: `FLAT` or `SHARDED`
+
+        Returns:
+            Number of documents moved
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout {layout!r}, expected one of: {', '.join(LAYOUTS)}")
+
+        old_layout = SHARDED if layout == FLAT else FLAT
+        moved = 0
+        with file_lock(self.registry_lock_path):
+            with instrument.timer('json_io'), open(self.registry_path, "r") as f:
+                registry = json.load(f)
+
+            for old_dir in list(scan_document_dirs(self.base_dir, old_layout)):
+                new_dir = self.base_dir / document_relpath(old_dir.name, layout)
+                new_dir.parent.mkdir(parents=True, exist_ok=True)
+                os.rename(old_dir, new_dir)
+                if old_layout == SHARDED:
+                    # Remove the prefix directories once they're empty
+                    for parent in (old_dir.parent, old_dir.parent.parent):
+                        if not any(parent.iterdir()):
+                            parent.rmdir()
+                moved += 1
+
+            # Every document in the new layout, so those moved by an
+            # interrupted run get their paths rewritten too
+            for new_dir in scan_document_dirs(self.base_dir, layout):
+                doc_id = new_dir.name
+
+                # Page paths are stored relative to the storage directory;
+                # `document_dir` finds the moved directory by falling back
+                def relocate(path, rel_dir=document_relpath(doc_id, layout)):
+                    return str(rel_dir / Path(path).name)
+
+                with self._document_lock(doc_id):
+                    metadata, _ = self._read_document(doc_id)
+                    relocated = json.loads(json.dumps(metadata))
+                    _relocate_paths(relocated, relocate)
+                    if relocated != metadata:
+                        self._compact_document(doc_id)
+                        metadata, _ = self._read_document(doc_id)
+                        _relocate_paths(metadata, relocate)
+                        write_json_atomic(new_dir / "metadata.json", metadata)
+
+                if doc_id in registry["documents"]:
+                    _relocate_paths(registry["documents"][doc_id], relocate)
+
+            if layout == FLAT:
+                (self.base_dir / "layout.json").unlink(missing_ok=True)
+            else:
+                write_json_atomic(self.base_dir / "layout.json", {"layout": layout})
+            self.layout = layout
+
+            registry["last_updated"] = datetime.datetime.now().isoformat()
+            with instrument.timer('json_io'):
+                write_json_atomic(self.registry_path, registry)
+
+        return moved
+
+    def add_directory(self, dir_path, hardlink=False, form_number=forms.DEFAULT_FORM_NUMBER):
         """Process all PDFs in a directory"""
         dir_path = Path(dir_path)
         
@@ -256,19 +795,182 @@ class DeclarationStorage:
         results = []
         for pdf in pdfs:
             print(f"Processing {pdf.name}...")
-            doc_id = self.add_document(pdf)
+            doc_id = self.add_document(pdf, hardlink=hardlink, form_number=form_number)
             results.append((pdf.name, doc_id))
             print(f"  → Stored as {doc_id}")
         
         return results
 
-def main():
+    def export_parquet(self, output_path):
+        """
+        Export the metadata of every document into a single columnar Parquet file
+
+        Form fields are typed according to their `FormFieldMetadata`, from the
+        form each document records: boolean fields are stored as bool,
+        multi-select fields as list columns, and all other fields as strings.
+        Values that don't match the field type are stored as nulls. Any
+        additional metadata keys (PDA reports, FEMA declaration IDs, ...) are
+        kept as string columns.
+
+        Args:
+            output_path: Path to the Parquet file to write
+
+        Returns:
+            Number of documents exported
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = {
+            "uuid": pa.string(),
+            "original_filename": pa.string(),
+            "import_date": pa.string(),
+            "page_count": pa.int64(),
+            "file_path": pa.string(),
+            "pages": pa.list_(pa.string()),
+            "version": pa.int64(),
+        }
+        page_pattern = re.compile(r"^page_\d+$")
+        rows = []
+        for doc_id in self.get_all_documents():
+            try:
+                metadata = self.get_document_metadata(doc_id)
+            except ValueError as e:
+                print(f"Error retrieving metadata for {doc_id}: {e}")
+                continue
+
+            metadata["uuid"] = doc_id
+            rows.append(metadata)
+
+        # Typed columns for the fields of every form exported, before other keys
+        for form in {forms.document_form(row).form_number: forms.document_form(row) for row in rows}.values():
+            for field_name, field in form.fields.items():
+                if field_name in columns:
+                    continue
+                if field.is_boolean:
+                    columns[field_name] = pa.bool_()
+                elif field.is_multi_select:
+                    columns[field_name] = pa.list_(pa.string())
+                else:
+                    columns[field_name] = pa.string()
+        for row in rows:
+            for key in row:
+                # Page paths are already captured by the `pages` list column
+                if key not in columns and not page_pattern.match(key):
+                    columns[key] = pa.string()
+
+        data = {
+            name: [_coerce_value(row.get(name), arrow_type) for row in rows]
+            for name, arrow_type in columns.items()
+        }
+        schema = pa.schema(list(columns.items()))
+        table = pa.Table.from_pydict(data, schema=schema)
+
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, output_path)
+
+        return len(rows)
+
+    @staticmethod
+    def read_parquet(path, columns=None):
+        """
+        Load a Parquet export created by `export_parquet` as a pandas DataFrame
+
+        Args:
+            path: Path to the Parquet file
+            columns: Optional list of columns to load (all columns if None)
+
+        Returns:
+            DataFrame with one row per document
+        """
+        import pandas as pd
+
+        return pd.read_parquet(path, columns=columns)
+
+# Linux ioctl cloning a file's extents into another file (a reflink)
+FICLONE = 0x40049409
+
+def _copy_mapped(source, mapped, dest_path, hardlink=False):
+    """
+    Store a memory-mapped source file at `dest_path`
+
+    Tries a hard link (if asked for), then a reflink, and otherwise writes
+    the mapping out directly, without reading the source again.
+    """
+    if hardlink:
+        try:
+            os.link(source.name, dest_path)
+            instrument.count('files_linked')
+            return
+        except OSError:
+            pass
+    with open(dest_path, "wb") as dest:
+        try:
+            if fcntl is None:
+                raise OSError("reflinks need fcntl")
+            fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+            instrument.count('files_cloned')
+        except OSError:
+            # Not supported by the filesystem, or across filesystems
+            dest.write(mapped)
+    shutil.copymode(source.name, dest_path)
+
+def _relocate_paths(entry, relocate):
+    """Rewrite the file and page paths of a metadata or registry entry, in place"""
+    page_pattern = re.compile(r"^page_\d+$")
+    for key, value in entry.items():
+        if key == "file_path" or page_pattern.match(key):
+            entry[key] = relocate(value)
+    if "pages" in entry:
+        entry["pages"] = [relocate(path) for path in entry["pages"]]
+
+def _append_jsonl(path, record):
+    """Append one record to a JSON Lines file and flush it to disk"""
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _read_jsonl(path):
+    """Records of a JSON Lines file, ignoring a final line still being written"""
+    if not Path(path).exists():
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.endswith("\n")]
+
+def _apply_change(metadata, change):
+    """Apply a change log entry to a document's metadata, in place"""
+    metadata.update(change["set"])
+    for key in change["delete"]:
+        metadata.pop(key, None)
+    metadata["version"] = change["version"]
+
+def _coerce_value(value, arrow_type):
+    """Coerce a metadata value to match its Parquet column type, or None"""
+    import pyarrow as pa
+
+    if value is None:
+        return None
+    if pa.types.is_boolean(arrow_type):
+        return value if isinstance(value, bool) else None
+    if pa.types.is_integer(arrow_type):
+        return value if isinstance(value, int) and not isinstance(value, bool) else None
+    if pa.types.is_list(arrow_type):
+        if not isinstance(value, list):
+            return None
+        return [v if isinstance(v, str) else json.dumps(v) for v in value]
+    return value if isinstance(value, str) else json.dumps(value)
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Disaster Declaration Document Storage")
 
     # Add base parser to pull the form folder storage directory
     base_parser = argparse.ArgumentParser(add_help=False)
     base_parser.add_argument('--base_dir', default='declarations',
                              help='Base directory for document storage.')
+    base_parser.add_argument('--layout', choices=LAYOUTS, default=None,
+                             help='Document directory layout of a new storage directory (default: flat)')
+    instrument.add_profile_arguments(base_parser)
 
     subparsers = parser.add_subparsers(
             dest="command",
@@ -278,6 +980,10 @@ def main():
     # Add document command
     add_parser = subparsers.add_parser("add", parents=[base_parser], help="Add a document")
     add_parser.add_argument("source", help="PDF file or directory to add")
+    add_parser.add_argument("--hardlink", action="store_true",
+                            help="Hard link the stored PDFs to the sources instead of copying them")
+    add_parser.add_argument("--form", choices=list(forms.FORMS), default=forms.DEFAULT_FORM_NUMBER,
+                            help="Form the documents are (default: %(default)s)")
     
     # List documents command
     list_parser = subparsers.add_parser("list", parents=[base_parser], help="List all documents")
@@ -287,21 +993,55 @@ def main():
     update_parser.add_argument("doc_id", help="Document UUID")
     update_parser.add_argument("--metadata", required=True, help="JSON metadata string or file path")
 
-    args = parser.parse_args()
+    # Export command
+    export_parser = subparsers.add_parser("export", parents=[base_parser], help="Export all metadata to Parquet")
+    export_parser.add_argument("output", help="Path to the output Parquet file")
+
+    # Change log commands
+    compact_parser = subparsers.add_parser("compact", parents=[base_parser],
+                                           help="Fold metadata change logs into metadata.json")
+    compact_parser.add_argument("doc_ids", nargs="*", help="Document UUIDs (all documents if omitted)")
+
+    history_parser = subparsers.add_parser("history", parents=[base_parser],
+                                           help="Show the metadata changes made to a document")
+    history_parser.add_argument("doc_id", help="Document UUID")
+
+    rollback_parser = subparsers.add_parser("rollback", parents=[base_parser],
+                                            help="Undo the metadata changes made by a run")
+    rollback_parser.add_argument("run_id", help="Run ID, as shown by `history`")
+    rollback_parser.add_argument("--dry-run", action="store_true",
+                                 help="Only show what would be restored")
+
+    # Pack command
+    pack_parser = subparsers.add_parser("pack", parents=[base_parser],
+                                        help="Move document PDFs into per-shard pack files")
+    pack_parser.add_argument("doc_ids", nargs="*", help="Document UUIDs (all documents if omitted)")
+
+    # Layout migration command
+    migrate_parser = subparsers.add_parser("migrate", parents=[base_parser],
+                                           help="Move the documents to another directory layout")
+
+    args = parser.parse_args(argv)
+    instrument.start_profiling(args)
     
-    storage = DeclarationStorage(args.base_dir)
+    # `migrate` takes the target layout, not the layout of the existing store
+    try:
+        storage = DeclarationStorage(args.base_dir, layout=None if args.command == "migrate" else args.layout)
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        return 1
     
     if args.command == "add":
         source_path = Path(args.source)
         
         if source_path.is_file() and source_path.suffix.lower() == '.pdf':
             # Add a single PDF file
-            doc_id = storage.add_document(source_path)
+            doc_id = storage.add_document(source_path, hardlink=args.hardlink, form_number=args.form)
             print(f"Added {source_path.name} → UUID: {doc_id}")
             
         elif source_path.is_dir():
             # Process all PDFs in a directory
-            results = storage.add_directory(source_path)
+            results = storage.add_directory(source_path, hardlink=args.hardlink, form_number=args.form)
             print(f"Added {len(results)} PDF files")
             for filename, doc_id in results:
                 print(f"  {filename} → {doc_id}")
@@ -315,7 +1055,8 @@ def main():
         documents = storage.get_all_documents()
         print(f"Found {len(documents)} documents:")
         for doc_id, info in documents.items():
-            print(f"  {doc_id}: {info['original_filename']} ({info['page_count']} pages)")
+            form_number = info.get('form_number', forms.DEFAULT_FORM_NUMBER)
+            print(f"  {doc_id}: {info['original_filename']} ({info['page_count']} pages, form {form_number})")
             
     elif args.command == "update":
         # Update document metadata
@@ -338,6 +1079,46 @@ def main():
             print(f"Error: {str(e)}")
             return 1
 
+    elif args.command == "export":
+        count = storage.export_parquet(args.output)
+        print(f"Exported {count} documents to {args.output}")
+
+    elif args.command == "compact":
+        count = storage.compact(args.doc_ids or None)
+        print(f"Compacted {count} documents")
+
+    elif args.command == "history":
+        try:
+            history = storage.document_history(args.doc_id)
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            return 1
+        for change in history:
+            fields = sorted(change["set"]) + [f"-{k}" for k in change["delete"]]
+            print(f"  v{change['version']:<4} {change['timestamp']}  {change['run_id']}: {', '.join(fields)}")
+
+    elif args.command == "rollback":
+        rolled_back = storage.rollback_run(args.run_id, dry_run=args.dry_run)
+        verb = "Would restore" if args.dry_run else "Restored"
+        for doc_id, (restored, skipped) in rolled_back.items():
+            print(f"  {doc_id}: {verb.lower()} {', '.join(restored) or 'nothing'}")
+            if skipped:
+                print(f"    left alone (changed by a later run): {', '.join(skipped)}")
+        print(f"{verb} fields of {len(rolled_back)} documents changed by run {args.run_id}")
+
+    elif args.command == "pack":
+        documents, files = storage.pack(args.doc_ids or None)
+        packs, packed_files, size = storage.packs.stats()
+        print(f"Packed {files} files of {documents} documents")
+        print(f"{packs} pack files hold {packed_files} files ({size / 1e6:.1f} MB)")
+
+    elif args.command == "migrate":
+        if args.layout is None:
+            print("Error: --layout is required")
+            return 1
+        count = storage.migrate_layout(args.layout)
+        print(f"Moved {count} documents to the {args.layout} layout")
+
     else:
         parser.print_help()
         
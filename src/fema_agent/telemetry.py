@@ -0,0 +1,355 @@
+"""
+Per-call LLM telemetry.
+
+Every LLM call made while telemetry is enabled is recorded as one span, a
+JSON line in the OpenTelemetry span JSON layout (name, context, start/end
+time, status, attributes), keyed by document `uuid`, form page or field
+chunk, and model. Attributes follow the OpenTelemetry GenAI conventions
+where one exists (`gen_ai.request.model`, `gen_ai.usage.input_tokens`, ...)
+and use a `fema.` prefix otherwise.
+
+Telemetry is enabled per process tree through an environment variable, so
+`simple_form_fill`'s worker processes write to the same file as the parent:
+
+    telemetry.enable("spans.jsonl")
+
+DocETL makes its own litellm calls, so for `parse` the spans come from a
+litellm callback; each page op tags its calls through litellm metadata, and
+the document is found from the PDF each call sends.
+Retries made inside the provider's HTTP client are invisible here and show
+up as latency; retries by `call_with_retries` or DocETL are counted.
+
+Summarize a spans file with:
+
+    python -m fema_agent.telemetry spans.jsonl --top 10
+"""
+
+import argparse
+import base64
+import datetime
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+TELEMETRY_PATH_ENV_VAR = "FEMA_TELEMETRY_PATH"
+TRACE_ID_ENV_VAR = "FEMA_TELEMETRY_TRACE_ID"
+
+# litellm metadata key marking calls that should be recorded by the callback
+METADATA_KEY = "fema_telemetry"
+
+# Document uuids by the SHA-256 of the PDFs sent for them, so calls made by
+# DocETL (which passes no per-item metadata to litellm) can be attributed
+_documents_by_digest: Dict[str, str] = {}
+_digests_by_path: Dict[str, str] = {}
+
+_write_lock = threading.Lock()
+_callbacks_registered = False
+
+def enable(path) -> None:
+    """
+    Record LLM call spans to a JSONL file, in this process and any it starts
+
+    Args:
+        path: Path of the JSONL file to append spans to
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    os.environ[TELEMETRY_PATH_ENV_VAR] = str(path)
+    os.environ.setdefault(TRACE_ID_ENV_VAR, secrets.token_hex(16))
+    register_litellm_callbacks()
+
+def enabled() -> bool:
+    return bool(os.environ.get(TELEMETRY_PATH_ENV_VAR))
+
+def _timestamp(seconds: float) -> str:
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).isoformat()
+
+def write_span(name: str, start: float, end: float, attributes: Dict[str, Any], error: Optional[str] = None):
+    """
+    Append one span to the telemetry file (a no-op when telemetry is disabled)
+
+    Args:
+        name: Span name, e.g. "parse.page" or "form_fill.chunk"
+        start: Start time, in seconds since the epoch
+        end: End time, in seconds since the epoch
+        attributes: Span attributes
+        error: Error description, if the call failed
+    """
+    path = os.environ.get(TELEMETRY_PATH_ENV_VAR)
+    if not path:
+        return
+
+    span = {
+        "name": name,
+        "context": {
+            "trace_id": "0x" + os.environ.get(TRACE_ID_ENV_VAR, "0" * 32),
+            "span_id": "0x" + secrets.token_hex(8),
+        },
+        "parent_id": None,
+        "start_time": _timestamp(start),
+        "end_time": _timestamp(end),
+        "status": {"status_code": "ERROR", "description": error} if error else {"status_code": "OK"},
+        "attributes": {
+            **attributes,
+            "fema.duration_seconds": end - start,
+            "process.pid": os.getpid(),
+        },
+    }
+    line = json.dumps(span, default=str) + "\n"
+    # One write per span on an append-mode file, so lines from several
+    # processes don't interleave
+    with _write_lock, open(path, "a") as f:
+        f.write(line)
+
+def usage_attributes(response) -> Dict[str, Any]:
+    """Token counts and cost of a litellm response, as span attributes"""
+    attributes = {}
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        attributes["gen_ai.usage.input_tokens"] = getattr(usage, "prompt_tokens", None)
+        attributes["gen_ai.usage.output_tokens"] = getattr(usage, "completion_tokens", None)
+
+    hidden_params = getattr(response, "_hidden_params", None) or {}
+    cost = hidden_params.get("response_cost")
+    if cost is None:
+        try:
+            import litellm
+            cost = litellm.completion_cost(completion_response=response)
+        except Exception:
+            # Unknown or local models have no price
+            cost = None
+    attributes["fema.cost_usd"] = cost
+    return attributes
+
+class Span:
+    """
+    A span measured around one logical LLM call, including its retries
+
+        span = Span("form_fill.chunk", {"fema.uuid": doc_id})
+        ...
+        span.end(response=response)
+    """
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.retries = 0
+        self.llm_seconds = 0.0
+
+    def end(self, response=None, error: Optional[str] = None):
+        attributes = {
+            **self.attributes,
+            "fema.retries": self.retries,
+            "fema.llm_seconds": self.llm_seconds,
+        }
+        if response is not None:
+            attributes.update(usage_attributes(response))
+        write_span(self.name, self.start, time.time(), attributes, error=error)
+
+def _seconds(value) -> float:
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return float(value)
+
+def _litellm_span(kwargs, response, start_time, end_time, error=None):
+    metadata = (kwargs.get("litellm_params") or {}).get("metadata") or {}
+    attributes = metadata.get(METADATA_KEY)
+    if not attributes:
+        return
+
+    attributes = dict(attributes)
+    # litellm strips the provider prefix; restore it to match the model requested
+    model = kwargs.get("model")
+    provider = (kwargs.get("litellm_params") or {}).get("custom_llm_provider")
+    if model and provider and not model.startswith(f"{provider}/"):
+        model = f"{provider}/{model}"
+    attributes["gen_ai.request.model"] = model
+    uuid = _sent_document(kwargs.get("messages"))
+    if uuid is not None:
+        attributes["fema.uuid"] = uuid
+
+    if response is not None and error is None:
+        attributes.update(usage_attributes(response))
+        if kwargs.get("response_cost") is not None:
+            attributes["fema.cost_usd"] = kwargs["response_cost"]
+
+    write_span(attributes.pop("fema.span_name", "llm.call"),
+               _seconds(start_time), _seconds(end_time), attributes, error=error)
+
+def _on_litellm_success(kwargs, response, start_time, end_time):
+    _litellm_span(kwargs, response, start_time, end_time)
+
+def _on_litellm_failure(kwargs, response, start_time, end_time):
+    exception = kwargs.get("exception")
+    error = f"{type(exception).__name__}: {exception}" if exception else "LLM call failed"
+    _litellm_span(kwargs, response, start_time, end_time, error=error)
+
+def register_document_file(path, uuid: str):
+    """
+    Attribute later calls sending this PDF to a document
+
+    Args:
+        path: Path of a PDF sent to the model, e.g. a page's `page_N` file
+        uuid: The document's uuid
+    """
+    path = str(path)
+    digest = _digests_by_path.get(path)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = _digests_by_path[path] = hashlib.sha256(f.read()).hexdigest()
+    _documents_by_digest[digest] = uuid
+
+def _sent_document(messages) -> Optional[str]:
+    """uuid of the document whose registered PDF is in a call's messages"""
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            continue
+        for part in content or []:
+            url = ((part or {}).get("image_url") or {}).get("url", "") if isinstance(part, dict) else ""
+            if url.startswith("data:") and "," in url:
+                digest = hashlib.sha256(base64.b64decode(url.split(",", 1)[1])).hexdigest()
+                if digest in _documents_by_digest:
+                    return _documents_by_digest[digest]
+    return None
+
+def register_litellm_callbacks():
+    """Record spans for litellm calls made by libraries, e.g. DocETL's page ops"""
+    global _callbacks_registered
+    if _callbacks_registered:
+        return
+    import litellm
+    litellm.success_callback.append(_on_litellm_success)
+    litellm.failure_callback.append(_on_litellm_failure)
+    _callbacks_registered = True
+
+def litellm_metadata(span_name: str, **attributes) -> Dict[str, Any]:
+    """litellm `metadata` tagging a call for the telemetry callback"""
+    return {METADATA_KEY: {"fema.span_name": span_name, **attributes}}
+
+def load_spans(path):
+    """Load a spans file into a DataFrame, one row per span, attributes flattened"""
+    import pandas as pd
+
+    rows = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            span = json.loads(line)
+            rows.append({
+                "name": span["name"],
+                "ok": span["status"]["status_code"] == "OK",
+                "error": span["status"].get("description"),
+                **span["attributes"],
+            })
+    spans = pd.DataFrame(rows)
+    for column in ("fema.uuid", "fema.page", "fema.field_chunk", "fema.fields", "gen_ai.request.model"):
+        if column not in spans:
+            spans[column] = None
+    for column in ("gen_ai.usage.input_tokens", "gen_ai.usage.output_tokens", "fema.cost_usd", "fema.retries"):
+        spans[column] = pd.to_numeric(spans[column], errors="coerce") if column in spans else 0.0
+    return spans
+
+def summarize(spans, top: int = 10):
+    """Print a summary report of a spans DataFrame"""
+    if spans.empty:
+        print("No spans recorded.")
+        return
+
+    # Page spans come from parse, chunk spans from form fill
+    import pandas as pd
+
+    spans = spans.copy()
+    pages = spans["fema.page"].map(lambda page: f"page {int(page)}" if pd.notna(page) else None)
+    chunks = spans["fema.field_chunk"].map(lambda chunk: f"fields {chunk}" if pd.notna(chunk) else None)
+    spans["unit"] = pages.fillna(chunks).fillna("-")
+    # Failed attempts inside DocETL are separate spans; count them as retries
+    spans["retries"] = spans["fema.retries"].fillna(0) + (~spans["ok"]).astype(int)
+    duration = "fema.duration_seconds"
+
+    print("\n" + "=" * 80)
+    print(f"{'LLM TELEMETRY SUMMARY':^80}")
+    print("=" * 80)
+
+    by_model = spans.groupby(spans["gen_ai.request.model"].fillna("-")).agg(
+        calls=("name", "size"),
+        errors=("ok", lambda ok: int((~ok).sum())),
+        retries=("retries", "sum"),
+        input_tokens=("gen_ai.usage.input_tokens", "sum"),
+        output_tokens=("gen_ai.usage.output_tokens", "sum"),
+        cost=("fema.cost_usd", "sum"),
+        p50=(duration, "median"),
+        p95=(duration, lambda d: d.quantile(0.95)),
+    )
+    print("\nBy model:")
+    for model, row in by_model.iterrows():
+        print(f"  {model:<40} {int(row['calls'])} calls, {int(row['errors'])} errors, "
+              f"{int(row['retries'])} retries")
+        print(f"  {'':<40} {int(row['input_tokens'])} in / {int(row['output_tokens'])} out tokens, "
+              f"${row['cost']:.4f}, p50 {row['p50']:.2f}s, p95 {row['p95']:.2f}s")
+
+    print("\n" + "-" * 80)
+    print(f"{'SLOWEST PAGES / FIELD CHUNKS':^80}")
+    print("-" * 80)
+    slowest = spans.groupby([spans["fema.uuid"].fillna("-"), "unit"])[duration].sum()
+    for (uuid, unit), seconds in slowest.sort_values(ascending=False).head(top).items():
+        print(f"  {uuid:<38} {unit:<16} {seconds:8.2f}s")
+
+    print("\n" + "-" * 80)
+    print(f"{'MOST EXPENSIVE DOCUMENTS':^80}")
+    print("-" * 80)
+    by_doc = spans.groupby(spans["fema.uuid"].fillna("-")).agg(
+        cost=("fema.cost_usd", "sum"),
+        tokens=("gen_ai.usage.input_tokens", "sum"),
+        seconds=(duration, "sum"),
+        retries=("retries", "sum"),
+    ).sort_values(["cost", "tokens"], ascending=False)
+    for uuid, row in by_doc.head(top).iterrows():
+        print(f"  {uuid:<38} ${row['cost']:.4f}  {int(row['tokens'])} input tokens  "
+              f"{row['seconds']:.2f}s  {int(row['retries'])} retries")
+
+    # A call's cost and tokens are shared evenly between the fields it extracted
+    fields = spans[spans["fema.fields"].map(lambda f: isinstance(f, list) and len(f) > 0)]
+    if not fields.empty:
+        print("\n" + "-" * 80)
+        print(f"{'MOST EXPENSIVE FIELDS':^80}")
+        print("-" * 80)
+        n_fields = fields["fema.fields"].map(len)
+        fields = fields.assign(
+            field_cost=fields["fema.cost_usd"].fillna(0) / n_fields,
+            field_tokens=fields["gen_ai.usage.input_tokens"].fillna(0) / n_fields,
+            field_seconds=fields[duration] / n_fields,
+        ).explode("fema.fields")
+        by_field = fields.groupby("fema.fields")[["field_cost", "field_tokens", "field_seconds"]].sum()
+        by_field = by_field.sort_values(["field_cost", "field_tokens"], ascending=False)
+        for field_name, row in by_field.head(top).iterrows():
+            print(f"  {field_name:<40} ${row['field_cost']:.4f}  {row['field_tokens']:.0f} input tokens  "
+                  f"{row['field_seconds']:.2f}s")
+
+    print("\n" + "=" * 80)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize LLM call telemetry")
+    parser.add_argument('spans_file', help='Path to a JSONL spans file')
+    parser.add_argument('--top', type=int, default=10, help='Rows to show per ranking')
+
+    args = parser.parse_args(argv)
+
+    try:
+        spans = load_spans(args.spans_file)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        return 1
+
+    summarize(spans, top=args.top)
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
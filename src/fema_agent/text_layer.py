@@ -0,0 +1,353 @@
+"""
+Read form fields straight from a page's PDF, without calling a model.
+
+Digitally submitted declarations carry their answers either as AcroForm
+widgets or as a clean text layer, so most of their fields can be read
+locally. Each field read this way gets a confidence:
+
+- AcroForm widgets are matched to form fields by name, with the match
+  similarity as the confidence
+- in the text layer, each field's label ("7. Incident Period: Beginning
+  Date") is located and the text up to the next label is its value. Checkbox
+  fields need a box mark next to the label ("[X]", "☒", ...) and multi-select
+  fields a mark next to every option. A label that isn't found, or is found
+  twice, or a date that can't be read, lowers the confidence.
+
+A page is resolved when every field on it reaches `MIN_CONFIDENCE`;
+`parse.parse_dataset` only sends unresolved pages to the model. Scanned and
+OCR'd pages rarely reproduce every label exactly, so they fall through to
+the model.
+
+Check how much of a corpus the text layer covers with:
+
+    python -m fema_agent.text_layer --storage-dir declarations
+"""
+
+import argparse
+import datetime
+import re
+import tempfile
+
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from fema_agent import forms
+from fema_agent.forms.fema_010_0_13 import FEMA_FORM_010_0_13
+from fema_agent.forms.form import Form, FormFieldMetadata
+
+MIN_CONFIDENCE = 0.9
+
+# Confidence of a value that was found but can't be trusted as is
+LOW_CONFIDENCE = 0.5
+
+# Minimum name similarity for matching an AcroForm widget to a form field
+WIDGET_NAME_THRESHOLD = 0.85
+
+CHECKBOX_MARK = r"\[[ xX✓✔]?\]|☒|☑|☐|■|□"
+CHECKED_MARKS = {'[x]', '[X]', '[✓]', '[✔]', '☒', '☑', '■'}
+CHECKBOX_OFF_STATES = {'/Off', '/No', '/0', ''}
+
+FOOTER_PATTERN = re.compile(r"FEMA\s+Form\s+010-0-13\b.*", re.DOTALL)
+
+DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%m-%d-%Y', '%b %d, %Y', '%B %d, %Y', '%b %d %Y', '%B %d %Y']
+
+@dataclass
+class PageExtraction:
+    """Field values read locally from one form page"""
+    page: int
+    values: Dict[str, Any] = field(default_factory=dict)
+    confidence: Dict[str, float] = field(default_factory=dict)   # Every field on the page, 0 if not found
+    sources: Dict[str, str] = field(default_factory=dict)        # "acroform" or "text"
+
+    def resolved(self, min_confidence: float = MIN_CONFIDENCE) -> bool:
+        """Whether every field on the page was read with enough confidence"""
+        return bool(self.confidence) and all(c >= min_confidence for c in self.confidence.values())
+
+    def unresolved_fields(self, min_confidence: float = MIN_CONFIDENCE) -> List[str]:
+        return [name for name, c in self.confidence.items() if c < min_confidence]
+
+def _words_pattern(text: str) -> str:
+    """Regex matching `text` with any whitespace between its words"""
+    return r"\s+".join(re.escape(word) for word in text.split())
+
+@lru_cache(maxsize=None)
+def _label_pattern(field_number: str, description: str) -> re.Pattern:
+    """Regex matching a field's label: optional number, optional box mark, description, optional colon"""
+    number = re.escape(field_number)
+    return re.compile(
+        rf"(?:{number}\.?\s+)?(?P<mark>{CHECKBOX_MARK})?\s*{_words_pattern(description)}(?:\s*:)?"
+        )
+
+def normalize_date(value: str) -> Optional[str]:
+    """Format a date as YYYY-MM-DD, or return None if it can't be read"""
+    value = re.sub(r"\s+", " ", value).strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+def _read_value(field_name: str, field_metadata: FormFieldMetadata, text: str) -> Tuple[Any, float]:
+    """Read a non-checkbox field's value from the text following its label"""
+    if field_metadata.is_multi_select or field_metadata.options:
+        marked = {}
+        for option in field_metadata.options:
+            option_pattern = rf"(?P<mark>{CHECKBOX_MARK})\s*{_words_pattern(option)}(?=\s*(?:{CHECKBOX_MARK})|\s*$)"
+            matches = list(re.finditer(option_pattern, text))
+            if len(matches) == 1:
+                marked[option] = matches[0].group('mark') in CHECKED_MARKS
+        checked = [option for option, is_checked in marked.items() if is_checked]
+
+        if field_metadata.is_multi_select:
+            if len(marked) < len(field_metadata.options):
+                return checked, 0.0
+            return checked, 1.0
+
+        if marked:
+            if len(checked) > 1:
+                return checked[0], LOW_CONFIDENCE
+            return (checked[0] if checked else ''), 1.0
+        value = ' '.join(text.split())
+        for option in field_metadata.options:
+            if value.lower() == option.lower():
+                return option, 1.0
+        return value, (1.0 if not value else LOW_CONFIDENCE)
+
+    value = ' '.join(text.split())
+    if 'date' in field_name and value:
+        date = normalize_date(value)
+        if date is None:
+            return value, LOW_CONFIDENCE
+        return date, 1.0
+    return value, 1.0
+
+def extract_text_fields(text: str, page: int, form: Form = FEMA_FORM_010_0_13) -> PageExtraction:
+    """
+    Read a page's fields from its text layer
+
+    Args:
+        text: Text extracted from the page
+        page: Form page number
+        form: Form whose fields to read
+
+    Returns:
+        The extracted values and their confidences
+    """
+    page_fields = form.get_fields_for_page(page)
+    extraction = PageExtraction(page=page, confidence={name: 0.0 for name in page_fields})
+
+    footer = FOOTER_PATTERN.search(text)
+    if footer:
+        text = text[:footer.start()]
+
+    # Labels overlap ("Public Assistance" starts "Public Assistance Dates
+    # Performed: ..."), so keep the earliest, then longest, of overlapping matches
+    candidates = []
+    for field_name, field_metadata in page_fields.items():
+        for match in _label_pattern(field_metadata.field_number, field_metadata.description).finditer(text):
+            candidates.append((match.start(), -match.end(), field_name, match))
+    candidates.sort(key=lambda candidate: candidate[:2])
+
+    labels = []
+    last_end = 0
+    for start, _, field_name, match in candidates:
+        if start >= last_end:
+            labels.append((field_name, match))
+            last_end = match.end()
+
+    occurrences = {}
+    for field_name, _ in labels:
+        occurrences[field_name] = occurrences.get(field_name, 0) + 1
+
+    for i, (field_name, match) in enumerate(labels):
+        if occurrences[field_name] > 1 and field_name in extraction.values:
+            continue
+        field_metadata = page_fields[field_name]
+        value_end = labels[i + 1][1].start() if i + 1 < len(labels) else len(text)
+
+        if field_metadata.is_boolean:
+            mark = match.group('mark')
+            value, confidence = (mark in CHECKED_MARKS, 1.0) if mark else (None, 0.0)
+        else:
+            value, confidence = _read_value(field_name, field_metadata, text[match.end():value_end])
+
+        if occurrences[field_name] > 1:
+            confidence = min(confidence, LOW_CONFIDENCE)
+        extraction.values[field_name] = value
+        extraction.confidence[field_name] = confidence
+        extraction.sources[field_name] = 'text'
+
+    return extraction
+
+def _normalize_name(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", name.lower()).strip()
+
+def _widget_values(pdf_page) -> Dict[str, Tuple[str, Any]]:
+    """
+    Read the AcroForm widgets annotated on a page
+
+    Returns:
+        Dictionary mapping widget name to (field type, value)
+    """
+    widgets = {}
+    for annotation in pdf_page.get('/Annots') or []:
+        widget = annotation.get_object()
+        if widget.get('/Subtype') != '/Widget':
+            continue
+        # Checkbox and radio widgets often keep their name and value on a parent
+        parent = widget.get('/Parent')
+        parent = parent.get_object() if parent is not None else {}
+        name = widget.get('/T') or parent.get('/T')
+        if name is None:
+            continue
+        field_type = widget.get('/FT') or parent.get('/FT')
+        value = widget.get('/V', parent.get('/V'))
+        if field_type == '/Btn' and value is None:
+            value = widget.get('/AS')
+        widgets[str(name)] = (str(field_type), value)
+    return widgets
+
+def extract_acroform_fields(pdf_page, page: int, form: Form = FEMA_FORM_010_0_13) -> PageExtraction:
+    """
+    Read a page's fields from its AcroForm widgets
+
+    Args:
+        pdf_page: PyPDF2 page
+        page: Form page number
+        form: Form whose fields to read
+
+    Returns:
+        The extracted values and their confidences
+    """
+    page_fields = form.get_fields_for_page(page)
+    extraction = PageExtraction(page=page, confidence={name: 0.0 for name in page_fields})
+
+    widgets = _widget_values(pdf_page)
+    if not widgets:
+        return extraction
+
+    for field_name, field_metadata in page_fields.items():
+        if field_metadata.is_multi_select:
+            continue
+        targets = [_normalize_name(field_name), _normalize_name(field_metadata.description)]
+        best_name, best_score = None, 0.0
+        for widget_name in widgets:
+            normalized = _normalize_name(widget_name)
+            score = max(SequenceMatcher(None, normalized, target).ratio() for target in targets)
+            if score > best_score:
+                best_name, best_score = widget_name, score
+        if best_score < WIDGET_NAME_THRESHOLD:
+            continue
+
+        field_type, value = widgets[best_name]
+        confidence = best_score
+        if field_metadata.is_boolean:
+            value = str(value) not in CHECKBOX_OFF_STATES if value is not None else False
+        else:
+            value = '' if value is None else str(value).strip()
+            if 'date' in field_name and value:
+                date = normalize_date(value)
+                if date is None:
+                    confidence = min(confidence, LOW_CONFIDENCE)
+                else:
+                    value = date
+        extraction.values[field_name] = value
+        extraction.confidence[field_name] = confidence
+        extraction.sources[field_name] = 'acroform'
+
+    return extraction
+
+def extract_page(page_path, page: int, form: Form = FEMA_FORM_010_0_13) -> PageExtraction:
+    """
+    Read a form page's fields from its PDF, preferring AcroForm values
+
+    Args:
+        page_path: Path to the single-page PDF
+        page: Form page number
+        form: Form whose fields to read
+
+    Returns:
+        The extracted values and their confidences (all zero if the PDF
+        can't be read)
+    """
+    from PyPDF2 import PdfReader
+
+    try:
+        pdf_page = PdfReader(page_path).pages[0]
+        acroform = extract_acroform_fields(pdf_page, page, form)
+        text = extract_text_fields(pdf_page.extract_text() or '', page, form)
+    except Exception as e:
+        print(f"Error reading the text layer of {page_path}: {e}")
+        return PageExtraction(page=page, confidence={name: 0.0 for name in form.get_fields_for_page(page)})
+
+    for field_name, confidence in acroform.confidence.items():
+        if confidence > text.confidence[field_name]:
+            text.values[field_name] = acroform.values[field_name]
+            text.confidence[field_name] = confidence
+            text.sources[field_name] = 'acroform'
+    return text
+
+def extract_document(document: Dict[str, Any], form: Form = FEMA_FORM_010_0_13) -> Dict[int, PageExtraction]:
+    """
+    Read every page of a document
+
+    Args:
+        document: Document metadata with absolute `page_N` paths, as in the
+            DocETL dataset built by `parse.create_docetl_dataset_from_storage`
+        form: Form whose fields to read
+
+    Returns:
+        Dictionary mapping page number to its extraction
+    """
+    extractions = {}
+    for page in sorted(form.fields_by_page):
+        page_path = document.get(f"page_{page}")
+        if page_path:
+            extractions[page] = extract_page(page_path, page, form)
+        else:
+            extractions[page] = PageExtraction(page=page, confidence={
+                name: 0.0 for name in form.get_fields_for_page(page)
+            })
+    return extractions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report how many form pages can be read without a model")
+    parser.add_argument('--storage-dir', type=str, required=True,
+                        help='Path to the storage directory containing declarations')
+    parser.add_argument('--min-confidence', type=float, default=MIN_CONFIDENCE,
+                        help='Minimum confidence for every field on a page to skip the model')
+    parser.add_argument('--verbose', action='store_true', help='List the unresolved fields of each document')
+
+    args = parser.parse_args(argv)
+
+    from fema_agent.parse import create_docetl_dataset_from_storage
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _, dataset = create_docetl_dataset_from_storage(args.storage_dir, temp_dir=temp_dir)
+
+    # Form number -> [document count, {page: documents resolved}]
+    resolved_by_form = {}
+    for document in dataset:
+        form = forms.document_form(document)
+        counts = resolved_by_form.setdefault(form.form_number, [0, {page: 0 for page in sorted(form.fields_by_page)}])
+        counts[0] += 1
+        extractions = extract_document(document, form)
+        for page, extraction in extractions.items():
+            if extraction.resolved(args.min_confidence):
+                counts[1][page] += 1
+            elif args.verbose:
+                print(f"{document['uuid']} page {page}: {', '.join(extraction.unresolved_fields(args.min_confidence))}")
+
+    print(f"Pages resolved from the text layer ({len(dataset)} documents):")
+    for form_number, (n_documents, resolved_by_page) in resolved_by_form.items():
+        if len(resolved_by_form) > 1:
+            print(f" FEMA Form {form_number}:")
+        for page, resolved in resolved_by_page.items():
+            print(f"  page {page}: {resolved}/{n_documents} ({resolved / n_documents:.0%})")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,179 @@
+"""
+Check parsed or filled field values against the form's field metadata.
+
+Each value is checked by its field's type:
+
+- checkbox fields must be booleans ("true", "no", ... are converted)
+- fields with options must be one of them, and multi-select fields a list
+  of them; options are matched ignoring case
+- date fields must be "YYYY-MM-DD" or "YYYY-MM" or empty; dates in other
+  readable formats ("Jan 12, 2018") are converted
+
+Rather than re-running a whole page or field chunk when some answers are
+invalid, callers re-request only the invalid fields, with the errors
+(`reask_instructions`) appended to the original request so the model keeps
+its context: `parse` re-runs the page op for just those fields, and
+`simple_form_fill` continues the chunk's conversation.
+
+`low_confidence_fields` also flags valid answers that are probably wrong:
+a field's label or description returned in place of an empty value (e.g.
+"I request the following type(s) of assistance:" for
+`direct_federal_assistance_types`, or the "OR" between two options; see
+`experiments/2025-04-07`). `parse --escalate-model` sends those fields to a
+stronger model.
+"""
+
+import re
+
+from difflib import SequenceMatcher
+from typing import Any, Dict, Optional, Tuple
+
+from fema_agent.forms.form import FormFieldMetadata
+from fema_agent.text_layer import normalize_date
+
+# Times the invalid fields of a page or chunk are re-requested
+REASKS = 1
+
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}(?:-\d{2})?")
+
+BOOLEAN_STRINGS = {'true': True, 'yes': True, 'false': False, 'no': False}
+
+# Similarity above which a value is taken to be its field's description echoed back
+ECHO_SIMILARITY = 0.8
+
+# Shortest value counted as an echo when it's only part of the description
+MIN_ECHO_CHARS = 12
+
+# Form labels returned for empty fields, e.g. the "OR" printed between two options
+LABEL_VALUES = {'or', 'and'}
+
+def is_date_field(field_name: str) -> bool:
+    return 'date' in field_name
+
+def check_value(field_name: str, field: FormFieldMetadata, value: Any) -> Tuple[Any, Optional[str]]:
+    """
+    Check one field's value
+
+    Args:
+        field_name: Field key, e.g. "ia_start_date"
+        field: The field's metadata
+        value: Value returned by the model
+
+    Returns:
+        Tuple of (value, converted where possible, and an error message or
+        None if the value is valid)
+    """
+    if field.is_boolean:
+        if isinstance(value, bool):
+            return value, None
+        if isinstance(value, str) and value.strip().lower() in BOOLEAN_STRINGS:
+            return BOOLEAN_STRINGS[value.strip().lower()], None
+        return value, "must be true or false"
+
+    if field.is_multi_select:
+        if not isinstance(value, list):
+            return value, "must be a list" + (f" of: {', '.join(field.options)}" if field.options else "")
+        if not field.options:
+            return value, None
+        options = {option.lower(): option for option in field.options}
+        unknown = [item for item in value if str(item).strip().lower() not in options]
+        if unknown:
+            return value, f"contains {', '.join(map(repr, unknown))}, not one of: {', '.join(field.options)}"
+        return [options[str(item).strip().lower()] for item in value], None
+
+    if not isinstance(value, str):
+        return value, "must be a string"
+
+    if field.options:
+        options = {option.lower(): option for option in field.options}
+        if value.strip() == '':
+            return '', None
+        if value.strip().lower() not in options:
+            return value, f"must be one of: {', '.join(field.options)} (or empty)"
+        return options[value.strip().lower()], None
+
+    if is_date_field(field_name) and value.strip():
+        if DATE_PATTERN.fullmatch(value.strip()):
+            return value.strip(), None
+        date = normalize_date(value)
+        if date is None:
+            return value, 'must be a date formatted as "YYYY-MM-DD" or "YYYY-MM" (or empty)'
+        return date, None
+
+    return value, None
+
+def validate_fields(values: Dict[str, Any], fields: Dict[str, FormFieldMetadata]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Check the values of a set of fields
+
+    Args:
+        values: Field values returned by the model
+        fields: The fields that were asked for, by name
+
+    Returns:
+        Tuple of (checked values, converted where possible, and a dictionary
+        mapping each invalid or missing field to its error)
+    """
+    checked, errors = {}, {}
+    for field_name, field in fields.items():
+        if field_name not in values:
+            errors[field_name] = "is missing"
+            continue
+        checked[field_name], error = check_value(field_name, field, values[field_name])
+        if error:
+            errors[field_name] = error
+    return checked, errors
+
+def _normalize(text: str) -> str:
+    return re.sub(r'[^a-z0-9]+', ' ', text.lower()).strip()
+
+def echoes_label(field_name: str, field: FormFieldMetadata, value: Any) -> bool:
+    """
+    Whether a text value is the field's own label rather than an answer
+
+    Matches the field's description (loosely, or a long enough part of it),
+    its key, or a bare form label like "OR".
+    """
+    if not isinstance(value, str):
+        return False
+    normalized = _normalize(value)
+    if not normalized:
+        return False
+    if normalized in LABEL_VALUES or normalized == _normalize(field_name):
+        return True
+    description = _normalize(field.description)
+    if len(normalized) >= MIN_ECHO_CHARS and normalized in description:
+        return True
+    return SequenceMatcher(None, normalized, description).ratio() >= ECHO_SIMILARITY
+
+def low_confidence_fields(values: Dict[str, Any], fields: Dict[str, FormFieldMetadata]) -> Dict[str, str]:
+    """
+    Fields whose answers are probably wrong: invalid, missing, or a label echoed back
+
+    Args:
+        values: Field values returned by the model
+        fields: The fields that were asked for, by name
+
+    Returns:
+        Dictionary mapping each low-confidence field to the reason
+    """
+    _, flagged = validate_fields(values, fields)
+    for field_name, field in fields.items():
+        if field_name not in flagged and echoes_label(field_name, field, values.get(field_name)):
+            flagged[field_name] = "echoes the field's label"
+    return flagged
+
+def reask_instructions(errors: Dict[str, str], values: Dict[str, Any]) -> str:
+    """
+    Instructions asking the model to answer again for only the invalid fields
+
+    Args:
+        errors: Invalid fields and their errors, from `validate_fields`
+        values: The model's previous answers
+    """
+    lines = ["Some of your previous answers were invalid:"]
+    for field_name, error in errors.items():
+        previous = f" (you answered {values[field_name]!r})" if field_name in values else ""
+        lines.append(f" - {field_name}{previous}: {error}")
+    lines.append("Answer again for only these fields, as a JSON object.")
+    return '\n'.join(lines)
@@ -0,0 +1,140 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from pathlib import Path
+
+# Offline: litellm's bundled model cost map, not a fetch retried in the background
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+from test_storage import write_pdf
+
+from fema_agent import forms, parse
+from fema_agent.batch import LocalBatchBackend, check_batch_provider, custom_id, parse_dataset_batch
+from fema_agent.storage import DeclarationStorage
+
+FORM = forms.get_form(forms.DEFAULT_FORM_NUMBER)
+
+class FlakyBatchBackend(LocalBatchBackend):
+    """A local backend whose first job fails one request, calling `on_failure` when it does"""
+    def __init__(self, directory, failing_id, on_failure=None):
+        super().__init__(directory)
+        self.failing_id = failing_id
+        self.on_failure = on_failure
+        self.jobs = []  # (batch ID, custom IDs submitted)
+
+    def submit(self, requests_path):
+        with open(requests_path) as f:
+            request_ids = [json.loads(line)["custom_id"] for line in f]
+        batch_id = super().submit(requests_path)
+        self.jobs.append((batch_id, request_ids))
+        return batch_id
+
+    def results(self, batch_id):
+        for result in super().results(batch_id):
+            if batch_id == self.jobs[0][0] and result["custom_id"] == self.failing_id:
+                result = {**result, "response": None, "error": {"code": "server_error", "message": "Try again"}}
+                if self.on_failure:
+                    self.on_failure()
+            yield result
+
+class ParseDatasetBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.work_dir = Path(self.temp_dir.name)
+        pdf_path = self.work_dir / "declaration.pdf"
+        write_pdf(pdf_path, pages=len(FORM.pages))
+        storage = DeclarationStorage(self.work_dir / "store")
+        self.doc_ids = [storage.add_document(pdf_path) for _ in range(2)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.dataset_path, _ = parse.create_docetl_dataset_from_storage(
+                str(self.work_dir / "store"), temp_dir=str(self.work_dir)
+                )
+        self.output_path = self.work_dir / "results.json"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def parse(self, backend, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return parse_dataset_batch(
+                self.dataset_path, str(self.output_path), "openai/mock", backend=backend,
+                reasks=0, poll_interval=0, **kwargs
+                )
+
+    def test_maps_answers_to_documents(self):
+        backend = FlakyBatchBackend(self.work_dir / "batches", failing_id=None)
+        results = self.parse(backend)
+
+        self.assertEqual(len(backend.jobs), 1)
+        self.assertEqual(sorted(backend.jobs[0][1]),
+                         sorted(custom_id(doc_id, page) for doc_id in self.doc_ids for page in FORM.pages))
+        self.assertEqual([result["uuid"] for result in results], self.doc_ids)
+        for result in results:
+            self.assertEqual(set(FORM.fields) - set(result), set())
+            self.assertEqual(result["validation_errors"], {})
+        with open(self.output_path) as f:
+            self.assertEqual(json.load(f), results)
+        self.assertTrue(self.output_path.with_name("results.json.batch.done.json").exists())
+
+        with open(backend.directory / backend.jobs[0][0] / "input.jsonl") as f:
+            content = json.loads(f.readline())["body"]["messages"][1]["content"]
+        self.assertEqual(content[0]["type"], "file")
+        self.assertTrue(content[0]["file"]["file_data"].startswith("data:application/pdf;base64,"))
+
+    def test_retries_failed_request(self):
+        failing_id = custom_id(self.doc_ids[1], 2)
+        backend = FlakyBatchBackend(self.work_dir / "batches", failing_id=failing_id)
+        results = self.parse(backend)
+
+        self.assertEqual([request_ids for _, request_ids in backend.jobs[1:]], [[failing_id]])
+        page_fields = parse.page_fields(2, form=FORM)
+        self.assertEqual(set(page_fields) - set(results[1]), set())
+        self.assertEqual(results[1]["validation_errors"], {})
+
+    def test_skips_retry_of_removed_page(self):
+        failing_id = custom_id(self.doc_ids[1], 2)
+        with open(self.dataset_path) as f:
+            page_path = Path(json.load(f)[1]["page_2"])
+        backend = FlakyBatchBackend(self.work_dir / "batches", failing_id=failing_id,
+                                    on_failure=lambda: page_path.unlink(missing_ok=True))
+        results = self.parse(backend)
+
+        self.assertEqual(len(backend.jobs), 1)
+        self.assertEqual(set(results[1]["validation_errors"]), set(parse.page_fields(2, form=FORM)))
+
+    def test_failed_page_leaves_fields_missing(self):
+        # Values from an earlier parse must not stand in for the failed page
+        page_fields = parse.page_fields(2, form=FORM)
+        with open(self.dataset_path) as f:
+            dataset = json.load(f)
+        for document in dataset:
+            document.update({name: "stale" for name in page_fields})
+        with open(self.dataset_path, "w") as f:
+            json.dump(dataset, f)
+
+        failing_id = custom_id(self.doc_ids[1], 2)
+        backend = FlakyBatchBackend(self.work_dir / "batches", failing_id=failing_id)
+        results = self.parse(backend, retries=0)
+
+        self.assertEqual(len(backend.jobs), 1)
+        self.assertEqual(set(page_fields) & set(results[1]), set())
+        self.assertEqual(set(results[1]["validation_errors"]), set(page_fields))
+        self.assertNotIn("stale", [results[0][name] for name in page_fields])
+
+class CheckBatchProviderTest(unittest.TestCase):
+    def test_supported_providers(self):
+        self.assertEqual(check_batch_provider("openai/gpt-4o-mini"), "openai")
+        self.assertEqual(check_batch_provider("gpt-4o-mini"), "openai")
+        self.assertEqual(check_batch_provider("azure/my-deployment"), "azure")
+
+    def test_unsupported_providers(self):
+        for model in ["gemini/gemini-2.0-flash", "vertex_ai/gemini-2.0-flash", "gemini-2.5-flash-preview-04-17"]:
+            with self.subTest(model=model), self.assertRaises(ValueError):
+                check_batch_provider(model)
+
+if __name__ == "__main__":
+    unittest.main()
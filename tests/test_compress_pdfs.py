@@ -0,0 +1,71 @@
+import contextlib
+import io
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from pathlib import Path
+from unittest import mock
+
+from test_storage import write_pdf
+
+from fema_agent.storage import SHARDED, DeclarationStorage
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+import compress_pdfs
+
+class CreatePdfArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.work_dir = Path(self.temp_dir.name)
+        self.pdf_path = self.work_dir / "declaration.pdf"
+        write_pdf(self.pdf_path, pages=2)
+        self.base_dir = self.work_dir / "store"
+        storage = DeclarationStorage(self.base_dir)
+        self.doc_ids = [storage.add_document(self.pdf_path) for _ in range(3)]
+        # One document packed, the others loose, in the sharded layout
+        storage.pack(self.doc_ids[:1])
+        storage.migrate_layout(SHARDED)
+        self.storage = DeclarationStorage(self.base_dir)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def archive(self, compression):
+        output_path = self.work_dir / f"{compression}.zip"
+        with contextlib.redirect_stdout(io.StringIO()):
+            compress_pdfs.create_pdf_archive(self.base_dir, output_path, compression=compression, workers=2)
+        return output_path
+
+    def assert_archive(self, output_path, compress_type):
+        with zipfile.ZipFile(output_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            expected = {f"{doc_id}/{name}" for doc_id in self.doc_ids for name in ("all.pdf", "page_1.pdf", "page_2.pdf")}
+            self.assertEqual(set(zipf.namelist()), expected)
+            for doc_id in self.doc_ids:
+                self.assertEqual(zipf.read(f"{doc_id}/all.pdf"), self.pdf_path.read_bytes())
+                self.assertEqual(zipf.read(f"{doc_id}/page_2.pdf"), bytes(self.storage.read_file(doc_id, "page_2.pdf")))
+            self.assertEqual({info.compress_type for info in zipf.infolist()}, {compress_type})
+
+    def test_codecs(self):
+        for compression, compress_type in compress_pdfs.COMPRESSION_METHODS.items():
+            with self.subTest(compression=compression):
+                self.assert_archive(self.archive(compression), compress_type)
+
+    def test_leaves_directory_untouched(self):
+        # A directory of UUID directories, with no registry
+        for name in ("registry.json", "registry.json.lock", "metadata_schema.json"):
+            (self.base_dir / name).unlink(missing_ok=True)
+        before = sorted(self.base_dir.rglob("*"))
+        self.archive("stored")
+        self.assertEqual(sorted(self.base_dir.rglob("*")), before)
+
+    def test_zip64_records(self):
+        with mock.patch.object(compress_pdfs, "ZIP64_LIMIT", 64), \
+                mock.patch.object(compress_pdfs, "ZIP_FILECOUNT_LIMIT", 2):
+            output_path = self.archive("deflated")
+        self.assert_archive(output_path, zipfile.ZIP_DEFLATED)
+
+if __name__ == "__main__":
+    unittest.main()
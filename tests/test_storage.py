@@ -0,0 +1,263 @@
+import json
+import multiprocessing as mp
+import os
+import tempfile
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+from PyPDF2 import PdfWriter
+
+from fema_agent import storage as storage_module
+from fema_agent.packs import PackStore
+from fema_agent.storage import COMPACT_AFTER, FLAT, SHARDED, DeclarationStorage, document_relpath, read_layout
+
+def write_pdf(path, pages=2):
+    """Write a PDF of blank pages"""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=612, height=792)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+def update_key(base_dir, doc_id, key, n_updates):
+    """Update one metadata key of a document, `n_updates` times"""
+    storage = DeclarationStorage(base_dir)
+    for i in range(n_updates):
+        storage.update_document_metadata(doc_id, {key: i})
+
+def add_documents(base_dir, pdf_path, n_documents):
+    """Add copies of a PDF to a store, returning their UUIDs"""
+    storage = DeclarationStorage(base_dir)
+    return [storage.add_document(pdf_path) for _ in range(n_documents)]
+
+class MigrateLayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = Path(self.temp_dir.name) / "store"
+        self.storage = DeclarationStorage(self.base_dir)
+        pdf_path = Path(self.temp_dir.name) / "declaration.pdf"
+        write_pdf(pdf_path)
+        self.doc_ids = [self.storage.add_document(pdf_path) for _ in range(3)]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_layout(self, layout):
+        storage = DeclarationStorage(self.base_dir)
+        self.assertEqual(read_layout(self.base_dir), layout)
+        registry = storage.get_all_documents()
+        for doc_id in self.doc_ids:
+            rel_dir = document_relpath(doc_id, layout)
+            self.assertTrue((self.base_dir / rel_dir / "metadata.json").exists())
+            metadata = storage.get_document_metadata(doc_id)
+            for entry in (metadata, registry[doc_id]):
+                self.assertEqual(entry["file_path"], str(rel_dir / "all.pdf"))
+                self.assertEqual(entry["pages"], [str(rel_dir / "page_1.pdf"), str(rel_dir / "page_2.pdf")])
+            self.assertTrue(storage.get_page_path(doc_id, 2).exists())
+
+    def test_round_trip(self):
+        self.assertEqual(self.storage.migrate_layout(SHARDED), 3)
+        self.assert_layout(SHARDED)
+        self.assertEqual(self.storage.migrate_layout(FLAT), 3)
+        self.assert_layout(FLAT)
+        self.assertEqual(sorted(p.name for p in self.base_dir.iterdir() if p.is_dir()), sorted(self.doc_ids))
+
+    def test_rerun_finishes_interrupted_migration(self):
+        # An interrupted migration: one document moved, no paths rewritten
+        doc_id = self.doc_ids[0]
+        moved_dir = self.base_dir / document_relpath(doc_id, SHARDED)
+        moved_dir.parent.mkdir(parents=True)
+        os.rename(self.base_dir / doc_id, moved_dir)
+        self.assertTrue(self.storage.get_page_path(doc_id, 1).exists())
+
+        self.assertEqual(self.storage.migrate_layout(SHARDED), 2)
+        self.assert_layout(SHARDED)
+
+    def test_packed_documents_survive_migration(self):
+        self.storage.pack(self.doc_ids[:2])
+        self.assertEqual(self.storage.migrate_layout(SHARDED), 3)
+        self.assertEqual(self.storage.migrate_layout(FLAT), 3)
+        storage = DeclarationStorage(self.base_dir)
+        self.assertTrue((self.base_dir / "packs").is_dir())
+        for doc_id in self.doc_ids:
+            self.assertEqual(bytes(storage.read_file(doc_id, "all.pdf"))[:5], b"%PDF-")
+            self.assertTrue(storage.get_page_path(doc_id, 2).exists())
+
+    def test_updates_survive_migration(self):
+        doc_id = self.doc_ids[0]
+        self.storage.update_document_metadata(doc_id, {"state_or_tribe": "Vermont"})
+        self.storage.migrate_layout(SHARDED)
+        metadata = DeclarationStorage(self.base_dir).get_document_metadata(doc_id)
+        self.assertEqual(metadata["state_or_tribe"], "Vermont")
+        with open(self.base_dir / document_relpath(doc_id, SHARDED) / "metadata.json") as f:
+            self.assertEqual(json.load(f)["state_or_tribe"], "Vermont")
+
+class ChangeLogTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = Path(self.temp_dir.name) / "store"
+        pdf_path = Path(self.temp_dir.name) / "declaration.pdf"
+        write_pdf(pdf_path)
+        self.doc_id = DeclarationStorage(self.base_dir).add_document(pdf_path)
+        self.document_dir = self.base_dir / self.doc_id
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_storage(self, run_id):
+        return DeclarationStorage(self.base_dir, run_id=run_id)
+
+    def read_log(self, name):
+        with open(self.document_dir / name) as f:
+            return [json.loads(line) for line in f]
+
+    def test_updates_are_logged_as_patches(self):
+        storage = self.run_storage("run-a")
+        storage.update_document_metadata(self.doc_id, {"state_or_tribe": "Vermont"})
+        storage.update_document_metadata(self.doc_id, {"state_or_tribe": "Maine", "incident_type": "Flood"})
+        # Nothing changes, so nothing is logged
+        storage.update_document_metadata(self.doc_id, {"state_or_tribe": "Maine"})
+
+        with open(self.document_dir / "metadata.json") as f:
+            self.assertNotIn("state_or_tribe", json.load(f))
+        changes = self.read_log("changes.jsonl")
+        # New documents are at version 1
+        self.assertEqual([change["version"] for change in changes], [2, 3])
+        self.assertEqual(changes[1]["set"], {"state_or_tribe": "Maine", "incident_type": "Flood"})
+        self.assertEqual(changes[1]["previous"], {"state_or_tribe": "Vermont"})
+        self.assertEqual(changes[1]["added"], ["incident_type"])
+
+        metadata = self.run_storage("run-b").get_document_metadata(self.doc_id)
+        self.assertEqual((metadata["state_or_tribe"], metadata["incident_type"], metadata["version"]),
+                         ("Maine", "Flood", 3))
+        self.assertEqual(storage.document_history(self.doc_id), changes)
+
+    def test_compacts_at_compact_after(self):
+        storage = self.run_storage("run-a")
+        for i in range(COMPACT_AFTER - 1):
+            storage.update_document_metadata(self.doc_id, {"counter": i})
+        self.assertEqual(len(self.read_log("changes.jsonl")), COMPACT_AFTER - 1)
+
+        storage.update_document_metadata(self.doc_id, {"counter": COMPACT_AFTER - 1})
+        self.assertFalse((self.document_dir / "changes.jsonl").exists())
+        with open(self.document_dir / "metadata.json") as f:
+            snapshot = json.load(f)
+        self.assertEqual((snapshot["counter"], snapshot["version"]), (COMPACT_AFTER - 1, COMPACT_AFTER + 1))
+
+        storage.update_document_metadata(self.doc_id, {"counter": "after"})
+        history = storage.document_history(self.doc_id)
+        self.assertEqual([change["version"] for change in history], list(range(2, COMPACT_AFTER + 3)))
+        self.assertEqual(len(self.read_log("history.jsonl")), COMPACT_AFTER)
+
+    def test_history_of_unknown_document(self):
+        with self.assertRaises(ValueError):
+            self.run_storage("run-a").document_history("00000000-0000-4000-8000-000000000000")
+
+    def test_rollback_run(self):
+        self.run_storage("run-a").update_document_metadata(
+            self.doc_id, {"state_or_tribe": "Vermont", "incident_type": "Flood"}
+            )
+        self.run_storage("run-b").update_document_metadata(self.doc_id, {"state_or_tribe": "Maine"})
+        self.run_storage("run-a").update_document_metadata(self.doc_id, {"declaration_date": "2018-01-12"})
+
+        storage = self.run_storage("run-c")
+        self.assertEqual(storage.rollback_run("run-a", dry_run=True),
+                         {self.doc_id: (["declaration_date", "incident_type"], ["state_or_tribe"])})
+        self.assertEqual(len(storage.document_history(self.doc_id)), 3)
+
+        storage.rollback_run("run-a")
+        metadata = storage.get_document_metadata(self.doc_id)
+        # run-b's later change is kept; the fields run-a added are removed
+        self.assertEqual(metadata["state_or_tribe"], "Maine")
+        self.assertNotIn("incident_type", metadata)
+        self.assertNotIn("declaration_date", metadata)
+        self.assertEqual(storage.document_history(self.doc_id)[-1]["run_id"], "rollback-run-a")
+
+    def test_rollback_restores_registry_fields(self):
+        storage = self.run_storage("run-a")
+        original = storage.get_all_documents()[self.doc_id]["original_filename"]
+        storage.update_document_metadata(self.doc_id, {"original_filename": "renamed.pdf"})
+        self.assertEqual(storage.get_all_documents()[self.doc_id]["original_filename"], "renamed.pdf")
+
+        self.run_storage("run-b").rollback_run("run-a")
+        storage = self.run_storage("run-c")
+        self.assertEqual(storage.get_document_metadata(self.doc_id)["original_filename"], original)
+        self.assertEqual(storage.get_all_documents()[self.doc_id]["original_filename"], original)
+
+    def test_rollback_compacts(self):
+        with mock.patch.object(storage_module, "COMPACT_AFTER", 2):
+            self.run_storage("run-a").update_document_metadata(self.doc_id, {"state_or_tribe": "Vermont"})
+            self.assertTrue((self.document_dir / "changes.jsonl").exists())
+            self.run_storage("run-b").rollback_run("run-a")
+        self.assertFalse((self.document_dir / "changes.jsonl").exists())
+        with open(self.document_dir / "metadata.json") as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot["version"], 3)
+        self.assertNotIn("state_or_tribe", snapshot)
+
+class LockingTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = Path(self.temp_dir.name) / "store"
+        self.pdf_path = Path(self.temp_dir.name) / "declaration.pdf"
+        write_pdf(self.pdf_path, pages=1)
+        self.storage = DeclarationStorage(self.base_dir)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_concurrent_updates_of_different_keys(self):
+        doc_id = self.storage.add_document(self.pdf_path)
+        keys = [f"key_{i}" for i in range(4)]
+        n_updates = COMPACT_AFTER  # Enough for a compaction mid-run
+        with mp.get_context("spawn").Pool(len(keys)) as pool:
+            pool.starmap(update_key, [(self.base_dir, doc_id, key, n_updates) for key in keys])
+
+        metadata = DeclarationStorage(self.base_dir).get_document_metadata(doc_id)
+        self.assertEqual({key: metadata[key] for key in keys}, {key: n_updates - 1 for key in keys})
+        self.assertEqual(metadata["version"], 1 + len(keys) * n_updates)
+        history = self.storage.document_history(doc_id)
+        self.assertEqual([change["version"] for change in history], list(range(2, 2 + len(keys) * n_updates)))
+
+    def test_concurrent_adds_keep_every_registry_entry(self):
+        with mp.get_context("spawn").Pool(4) as pool:
+            added = pool.starmap(add_documents, [(self.base_dir, self.pdf_path, 5)] * 4)
+
+        doc_ids = {doc_id for doc_ids in added for doc_id in doc_ids}
+        self.assertEqual(len(doc_ids), 20)
+        registry = DeclarationStorage(self.base_dir).get_all_documents()
+        self.assertEqual(set(registry), doc_ids)
+        for doc_id in doc_ids:
+            self.assertTrue((self.base_dir / registry[doc_id]["file_path"]).exists())
+
+class PackStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.packs = PackStore(Path(self.temp_dir.name) / "packs")
+        self.doc_id = "ab000000-0000-4000-8000-000000000000"
+
+    def tearDown(self):
+        self.packs.close()
+        self.temp_dir.cleanup()
+
+    def test_read_between_pack_and_index_writes(self):
+        first = Path(self.temp_dir.name) / "first.pdf"
+        first.write_bytes(b"first")
+        self.packs.add(self.doc_id, {"page_1.pdf": first})
+
+        # A read lands after the pack is appended to, before its index line is
+        shard = self.packs.shard(self.doc_id)
+        with open(self.packs.pack_path(shard), "ab") as pack:
+            pack.write(b"second")
+        self.assertIsNone(self.packs.read(self.doc_id, "page_2.pdf"))
+        with open(self.packs.index_path(shard), "a") as index:
+            entry = {"doc_id": self.doc_id, "name": "page_2.pdf", "offset": len(b"first"), "length": len(b"second")}
+            index.write(json.dumps(entry) + "\n")
+
+        self.assertEqual(bytes(self.packs.read(self.doc_id, "page_2.pdf")), b"second")
+        self.assertEqual(bytes(self.packs.read(self.doc_id, "page_1.pdf")), b"first")
+
+if __name__ == "__main__":
+    unittest.main()